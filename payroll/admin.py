@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import CustomUser, Employee, PayrollRun, Payslip, WorkingHoursConfig, Company, TaxBracket, WorkedHours, LeaveBalance, LeaveRequest
+from .models import CustomUser, Employee, PayrollRun, Payslip, WorkingHoursConfig, Company, TaxBracket, WorkedHours, LeaveBalance, LeaveAccrual, LeaveRequest
 
 admin.site.register(CustomUser)
 admin.site.register(Company)
@@ -10,6 +10,7 @@ admin.site.register(TaxBracket)
 admin.site.register(WorkedHours)
 admin.site.register(LeaveRequest)
 admin.site.register(LeaveBalance)
+admin.site.register(LeaveAccrual)
 
 @admin.register(WorkingHoursConfig)
 class WorkingHoursConfigAdmin(admin.ModelAdmin):
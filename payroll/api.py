@@ -0,0 +1,204 @@
+"""
+Read-only JSON representations of payroll runs, payslips and employees.
+
+Each resource lists its fields with the columns and joins they need, so a
+``?fields=`` projection only reads what it returns. Responses carry ETags
+built from the ``version`` columns of the rows they are read from (payslips
+with their employees and worked hours), which can be checked with one small
+query before anything is serialized.
+"""
+import hashlib
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db.models import Count, Max, Sum
+
+from .models import Employee, Payslip, PayrollRun, PayslipQuerySet
+
+# Rows per page of a list, unless ?limit= asks for fewer or more
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+CENTS = Decimal('0.01')
+
+# getter(row) -> value; columns for QuerySet.only(); related for select_related()
+ApiField = namedtuple('ApiField', ['getter', 'columns', 'related'], defaults=[(), None])
+
+
+def _column(name):
+    return ApiField(lambda row: getattr(row, name), (name,))
+
+
+RUN_FIELDS = {
+    'id': _column('id'),
+    'period_start': _column('period_start'),
+    'period_end': _column('period_end'),
+    'is_active': _column('is_active'),
+    'is_closed': _column('is_closed'),
+    'version': _column('version'),
+}
+
+EMPLOYEE_FIELDS = {
+    name: _column(name) for name in (
+        'id', 'first_name', 'last_name', 'id_number', 'tax_number', 'department', 'job_title', 'status',
+        'date_joined', 'is_wage_employee', 'salary', 'hourly_rate', 'version',
+    )
+}
+EMPLOYEE_FIELDS['company'] = ApiField(lambda e: e.company.code, ('company__code',), 'company')
+
+_EARNINGS = [
+    ('normal_hours', 'normal_earnings'),
+    ('overtime_hours', 'overtime_earnings'),
+    ('saturday_hours', 'saturday_earnings'),
+    ('sunday_public_hours', 'sunday_earnings'),
+]
+
+
+def _earnings(payslip):
+    wh = payslip.worked_hours
+    if wh is None:
+        return None
+    breakdown = {hours: getattr(wh, hours) for hours, _ in _EARNINGS}
+    breakdown.update({earnings: getattr(wh, earnings) for _, earnings in _EARNINGS})
+    breakdown['hourly_rate'] = wh.hourly_rate
+    breakdown['total_earnings'] = wh.total_earnings
+    return breakdown
+
+
+PAYSLIP_FIELDS = {
+    name: _column(name) for name in (
+        'id', 'basic_salary', 'gross_income', 'tax', 'uif', 'sdl', 'net_pay', 'version',
+    )
+}
+PAYSLIP_FIELDS.update({
+    'employee_id': ApiField(lambda p: p.employee_id, ('employee',)),
+    'payroll_run_id': ApiField(lambda p: p.payroll_run_id, ('payroll_run',)),
+    'employee': ApiField(
+        lambda p: {'id': p.employee_id, 'first_name': p.employee.first_name,
+                   'last_name': p.employee.last_name, 'id_number': p.employee.id_number},
+        ('employee__first_name', 'employee__last_name', 'employee__id_number'),
+        'employee',
+    ),
+    'earnings': ApiField(
+        _earnings,
+        tuple(f'worked_hours__{name}' for pair in _EARNINGS for name in pair)
+        + ('worked_hours__hourly_rate', 'worked_hours__total_earnings'),
+        'worked_hours',
+    ),
+    # Only given when asked for, by ?ytd=1 or by name in ?fields=
+    'ytd': ApiField(lambda p: {
+        field: Decimal(getattr(p, f'{field}_ytd')).quantize(CENTS) for field in PayslipQuerySet.YTD_FIELDS
+    }),
+})
+OPTIONAL_PAYSLIP_FIELDS = {'ytd'}
+
+
+def selected_fields(request, available, optional=()):
+    """
+    Names from ``?fields=a,b`` that ``available`` has, in the order given,
+    or every field except ``optional`` ones when no projection is asked for.
+    Unknown names raise ValueError.
+    """
+    requested = [name.strip() for name in request.GET.get('fields', '').split(',') if name.strip()]
+    if not requested:
+        return [name for name in available if name not in optional]
+    unknown = [name for name in requested if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys(requested))
+
+
+def project(queryset, fields, spec):
+    """Restricts ``queryset`` to the columns and joins that ``fields`` need."""
+    columns = {'id'}
+    related = set()
+    for name in fields:
+        columns.update(spec[name].columns)
+        if spec[name].related:
+            related.add(spec[name].related)
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset.only(*columns)
+
+
+def serialize(row, fields, spec):
+    return {name: spec[name].getter(row) for name in fields}
+
+
+def _etag(*parts):
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _collection_version(queryset):
+    """(row count, sum and max of versions, highest id): changes whenever any row is written, added or removed."""
+    totals = queryset.order_by().aggregate(count=Count('id'), versions=Sum('version'), last=Max('id'))
+    return totals['count'], totals['versions'], totals['last']
+
+
+def _payslip_sources_version(payslips):
+    """Sums of the versions of the employees and worked hours that ``payslips`` show."""
+    totals = payslips.order_by().aggregate(
+        employees=Sum('employee__version'), worked_hours=Sum('worked_hours__version')
+    )
+    return totals['employees'], totals['worked_hours']
+
+
+def _query(request):
+    return sorted(request.GET.lists())
+
+
+def wants_ytd(request, fields):
+    return request.GET.get('ytd') == '1' or 'ytd' in fields
+
+
+def run_etag(request, pk):
+    version = PayrollRun.objects.filter(pk=pk).values_list('version', flat=True).first()
+    return None if version is None else _etag('run', pk, version, _query(request))
+
+
+def runs_etag(request):
+    return _etag('runs', *_collection_version(PayrollRun.objects.all()), _query(request))
+
+
+def run_payslips_etag(request, pk):
+    version = PayrollRun.objects.filter(pk=pk).values_list('version', flat=True).first()
+    if version is None:
+        return None
+    payslips = Payslip.objects.filter(payroll_run_id=pk, employee__company_id=request.user.company_id)
+    # YTD figures also depend on earlier runs' payslips
+    if wants_ytd(request, request.GET.get('fields', '').split(',')):
+        payslips = Payslip.objects.filter(
+            employee__company_id=request.user.company_id,
+            payroll_run__period_start__lte=PayrollRun.objects.filter(pk=pk).values('period_start'),
+        )
+    return _etag(
+        'run-payslips', pk, version, *_collection_version(payslips), *_payslip_sources_version(payslips),
+        _query(request),
+    )
+
+
+def payslip_etag(request, pk):
+    payslip = Payslip.objects.filter(pk=pk, employee__company_id=request.user.company_id).values(
+        'version', 'employee_id', 'employee__version', 'worked_hours__version', 'payroll_run__period_start'
+    ).first()
+    if payslip is None:
+        return None
+    parts = ['payslip', pk, payslip['version'], payslip['employee__version'], payslip['worked_hours__version']]
+    if wants_ytd(request, request.GET.get('fields', '').split(',')):
+        parts += _collection_version(Payslip.objects.filter(
+            employee_id=payslip['employee_id'],
+            payroll_run__period_start__lte=payslip['payroll_run__period_start'],
+        ))
+    return _etag(*parts, _query(request))
+
+
+def employees_etag(request):
+    employees = Employee.objects.filter(company_id=request.user.company_id)
+    return _etag('employees', *_collection_version(employees), _query(request))
+
+
+def employee_etag(request, pk):
+    version = Employee.objects.filter(pk=pk, company_id=request.user.company_id).values_list(
+        'version', flat=True
+    ).first()
+    return None if version is None else _etag('employee', pk, version, _query(request))
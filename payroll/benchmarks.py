@@ -0,0 +1,171 @@
+"""
+Benchmarks of the payroll hot paths.
+
+Each benchmark is timed over a number of rounds after one warm-up call,
+with the SQL queries of the last round counted. Views are requested through
+the test client as a logged-in user of one company, so middleware, context
+processors and templates are included. Results are plain dicts, written as
+JSON so runs on different commits can be compared. View benchmarks are
+checked against the view's query budget (see payroll.querycount).
+"""
+import statistics
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Company, Employee, LeaveRequest, Payslip, PayrollRun
+from .querycount import query_budget
+from .services import get_month_bounds, tax_year_label
+from .utils import calculate_tax
+
+BENCHMARK_USERNAME = 'benchmark'
+
+# Incomes taxed per round of the calculate_tax benchmark
+TAX_CALCULATIONS = 10000
+
+# (name, description) of every benchmark, in the order they run
+BENCHMARKS = [
+    ('dashboard', "GET dashboard"),
+    ('employee_list', "GET employee list, first page"),
+    ('employee_search', "GET employee list searching by last name"),
+    ('payslips_summary', "GET payslip summary of the current run"),
+    ('payslip_detail', "GET one payslip of the current run"),
+    ('leave_summary', "GET leave summary"),
+    ('calculate_tax', f"calculate_tax for {TAX_CALCULATIONS} incomes"),
+]
+
+# URL name of each view benchmark, where it differs from the benchmark's name
+VIEW_NAMES = {'employee_search': 'employee_list'}
+
+
+def _measure(call, rounds):
+    call()
+    timings = []
+    for _ in range(rounds - 1):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+
+    return {
+        'rounds': rounds,
+        'queries': len(queries),
+        'query_ms': round(sum(float(query['time']) for query in queries.captured_queries) * 1000, 2),
+        'min_ms': round(min(timings) * 1000, 2),
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'max_ms': round(max(timings) * 1000, 2),
+    }
+
+
+def _view(client, url):
+    def call():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+        # Streamed responses are only produced as they are read
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+    return call
+
+
+def _taxes(tax_year):
+    incomes = [Decimal(income) for income in range(50000, 50000 + TAX_CALCULATIONS * 150, 150)]
+
+    def call():
+        for income in incomes:
+            calculate_tax(income, tax_year)
+    return call
+
+
+def run_benchmarks(company=None, rounds=5, only=None):
+    """
+    Runs the benchmarks as a user of ``company`` (default: the company with
+    the most employees) and returns the results with a description of the
+    data they ran against. ``only`` limits them to the names given.
+    """
+    if company is None:
+        company = Company.objects.annotate(employee_count=Count('employees')).order_by('-employee_count', 'id').first()
+    user, _ = get_user_model().objects.get_or_create(username=BENCHMARK_USERNAME, defaults={'company': company})
+    if user.company_id != company.pk:
+        user.company = company
+        user.save(update_fields=['company'])
+    client = Client()
+    client.force_login(user)
+
+    today = timezone.now().date()
+    period_start, period_end = get_month_bounds(today)
+    payroll_run = PayrollRun.objects.filter(period_start=period_start, period_end=period_end).first()
+    payslip = Payslip.objects.filter(payroll_run=payroll_run, employee__company=company).order_by('id').first()
+    last_name = Employee.objects.filter(company=company).values_list('last_name', flat=True).first() or 'a'
+
+    calls = {
+        'dashboard': _view(client, reverse('dashboard')),
+        'employee_list': _view(client, reverse('employee_list')),
+        'employee_search': _view(client, f"{reverse('employee_list')}?q={last_name}"),
+        'payslips_summary': _view(client, reverse('payslips_summary')),
+        'leave_summary': _view(client, reverse('leave_summary')),
+        'calculate_tax': _taxes(tax_year_label(period_start)),
+    }
+    if payslip is not None:
+        calls['payslip_detail'] = _view(client, reverse('payslip_detail', args=[payslip.pk]))
+
+    results = {}
+    # The test client's host must be allowed, as in Django's test runner
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        for name, description in BENCHMARKS:
+            if only and name not in only:
+                continue
+            if name not in calls:
+                results[name] = {'description': description, 'skipped': "No payslip in the current run"}
+                continue
+            results[name] = {'description': description, **_measure(calls[name], rounds)}
+            if name != 'calculate_tax':
+                budget = query_budget(VIEW_NAMES.get(name, name))
+                results[name]['query_budget'] = budget
+                results[name]['over_budget'] = budget is not None and results[name]['queries'] > budget
+
+    return {
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'company': company.code,
+        'data': {
+            'employees': Employee.objects.filter(company=company).count(),
+            'all_employees': Employee.objects.count(),
+            'payroll_runs': PayrollRun.objects.count(),
+            'current_run_payslips': Payslip.objects.filter(payroll_run=payroll_run).count(),
+            'all_payslips': Payslip.objects.count(),
+            'leave_requests': LeaveRequest.objects.count(),
+        },
+        'results': results,
+    }
+
+
+def compare_results(baseline, current):
+    """
+    Yields (name, baseline median ms, current median ms, baseline queries,
+    current queries) for the benchmarks in both result sets.
+    """
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if before is None or 'median_ms' not in before or 'median_ms' not in result:
+            continue
+        yield name, before['median_ms'], result['median_ms'], before['queries'], result['queries']
+
+
+def over_budget(results):
+    """Yields (name, queries, budget) for the benchmarks that ran more queries than their view's budget."""
+    for name, result in results['results'].items():
+        if result.get('over_budget'):
+            yield name, result['queries'], result['query_budget']
@@ -1,19 +1,14 @@
-from .models import Company, Employee
+from .utils import get_active_employee_count, get_cached_company
+
 
 def current_company(request):
     company_id = request.session.get('company_id')
-    company = None
-    if company_id:
-        try:
-            company = Company.objects.get(id=company_id)
-        except Company.DoesNotExist:
-            pass
-    return {'company': company}
+    return {'company': get_cached_company(company_id) if company_id else None}
 
 
 def active_employees(request):
-    # Query the count of active employees
-    active_count = Employee.objects.filter(status='active').count()  
+    # Active employees in the session's company, from the cache
+    company_id = request.session.get('company_id')
     return {
-        'active_employees': active_count
-    }
\ No newline at end of file
+        'active_employees': get_active_employee_count(company_id) if company_id else 0
+    }
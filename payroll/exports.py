@@ -0,0 +1,233 @@
+"""
+Streaming CSV and XLSX exports of payroll runs and the employee register.
+
+Rows are read with QuerySet.iterator() and written out as they arrive, so
+memory use stays flat however large the run is. XLSX files are written as a
+minimal workbook straight into a streamed ZIP, without any extra dependency.
+"""
+import csv
+import re
+import zipfile
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from .models import Employee, Payslip
+from .pdf import ZipStream
+from .snapshots import closed_run_snapshot, snapshot_payslips
+
+# Rows fetched from the database at a time
+EXPORT_CHUNK_SIZE = 2000
+
+# Rows written between chunks handed to the response
+ROWS_PER_CHUNK = 500
+
+CENTS = Decimal('0.01')
+
+
+def _money(value):
+    return Decimal(value or 0).quantize(CENTS)
+
+
+def _worked(worked_hours, name):
+    return getattr(worked_hours, name) if worked_hours is not None else Decimal('0.00')
+
+
+PAYSLIP_COLUMNS = [
+    ('Employee No.', lambda p: p.employee_id),
+    ('Last Name', lambda p: p.employee.last_name),
+    ('First Name', lambda p: p.employee.first_name),
+    ('ID Number', lambda p: p.employee.id_number),
+    ('Department', lambda p: p.employee.department),
+    ('Job Title', lambda p: p.employee.job_title or ''),
+    ('Basic Salary', lambda p: _money(p.basic_salary)),
+    ('Normal Hours', lambda p: _worked(p.worked_hours, 'normal_hours')),
+    ('Normal Earnings', lambda p: _worked(p.worked_hours, 'normal_earnings')),
+    ('Overtime Hours', lambda p: _worked(p.worked_hours, 'overtime_hours')),
+    ('Overtime Earnings', lambda p: _worked(p.worked_hours, 'overtime_earnings')),
+    ('Saturday Hours', lambda p: _worked(p.worked_hours, 'saturday_hours')),
+    ('Saturday Earnings', lambda p: _worked(p.worked_hours, 'saturday_earnings')),
+    ('Sunday/Public Holiday Hours', lambda p: _worked(p.worked_hours, 'sunday_public_hours')),
+    ('Sunday/Public Holiday Earnings', lambda p: _worked(p.worked_hours, 'sunday_earnings')),
+    ('Gross Income', lambda p: _money(p.gross_income)),
+    ('Tax (PAYE)', lambda p: _money(p.tax)),
+    ('UIF', lambda p: _money(p.uif)),
+    ('SDL', lambda p: _money(p.sdl)),
+    ('Net Pay', lambda p: _money(p.net_pay)),
+    ('YTD Basic Salary', lambda p: p.ytd_basic_salary),
+    ('YTD Wages', lambda p: p.ytd_wages),
+    ('YTD Gross Income', lambda p: p.ytd_gross_income),
+    ('YTD Tax', lambda p: p.ytd_tax),
+    ('YTD UIF', lambda p: p.ytd_uif),
+    ('YTD SDL', lambda p: p.ytd_sdl),
+    ('YTD Net Pay', lambda p: p.ytd_net_pay),
+]
+
+EMPLOYEE_FIELDS = [
+    ('Employee No.', 'id'),
+    ('First Name', 'first_name'),
+    ('Last Name', 'last_name'),
+    ('ID Number', 'id_number'),
+    ('Tax Number', 'tax_number'),
+    ('Department', 'department'),
+    ('Job Title', 'job_title'),
+    ('Status', 'status'),
+    ('Date Joined', 'date_joined'),
+    ('Wage Employee', 'is_wage_employee'),
+    ('Salary', 'salary'),
+    ('Hourly Rate', 'hourly_rate'),
+    ('Company', 'company__code'),
+]
+
+
+def payslip_export(payroll_run, company=None):
+    """
+    Returns (headers, rows) for every payslip in a run, with the worked
+    hours breakdown and YTD totals, optionally limited to one company.
+    Closed runs are read from their snapshot.
+    """
+    snapshot = closed_run_snapshot(payroll_run)
+    if snapshot is not None:
+        payslips = snapshot_payslips(snapshot, company)
+    else:
+        payslips = Payslip.objects.filter(payroll_run=payroll_run).with_ytd().select_related(
+            'employee', 'worked_hours'
+        ).order_by('employee__last_name', 'employee__first_name', 'id')
+        if company is not None:
+            payslips = payslips.filter(employee__company=company)
+        payslips = payslips.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    rows = ([getter(payslip) for _, getter in PAYSLIP_COLUMNS] for payslip in payslips)
+    return [header for header, _ in PAYSLIP_COLUMNS], rows
+
+
+def employee_export(company=None, status=None):
+    """Returns (headers, rows) for the employee register."""
+    employees = Employee.objects.order_by('last_name', 'first_name', 'id')
+    if company is not None:
+        employees = employees.filter(company=company)
+    if status:
+        employees = employees.filter(status=status)
+
+    statuses = dict(Employee.EMPLOYMENT_STATUSES)
+    status_index = [field for _, field in EMPLOYEE_FIELDS].index('status')
+
+    def rows():
+        values = employees.values_list(*(field for _, field in EMPLOYEE_FIELDS))
+        for row in values.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            row = list(row)
+            row[status_index] = statuses.get(row[status_index], row[status_index])
+            yield row
+
+    return [header for header, _ in EMPLOYEE_FIELDS], rows()
+
+
+class _Echo:
+    """File-like object for csv.writer that returns each line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(headers, rows):
+    """Yields the CSV text of ``headers`` and ``rows`` a few hundred lines at a time."""
+    writer = csv.writer(_Echo())
+    lines = [writer.writerow(headers)]
+    for row in rows:
+        lines.append(writer.writerow(['' if value is None else value for value in row]))
+        if len(lines) >= ROWS_PER_CHUNK:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+# Characters that are not allowed in XML 1.0
+_ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_cell(value):
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, Decimal, float)):
+        return f'<c><v>{value}</v></c>'
+    if value is None:
+        return '<c/>'
+    text = escape(_ILLEGAL_XML.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(_xlsx_cell(value) for value in values) + '</row>'
+
+
+def stream_xlsx(headers, rows, sheet_name='Sheet1'):
+    """
+    Yields an XLSX workbook with one sheet chunk by chunk. The sheet is
+    deflated into a ZIP written to an unseekable stream as rows arrive.
+    """
+    stream = ZipStream()
+    workbook = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', workbook)
+        yield stream.read_written()
+
+        # force_zip64 because the sheet size isn't known up front
+        with archive.open('xl/worksheets/sheet1.xml', mode='w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(headers).encode())
+            lines = []
+            for row in rows:
+                lines.append(_xlsx_row(row))
+                if len(lines) >= ROWS_PER_CHUNK:
+                    sheet.write(''.join(lines).encode())
+                    lines = []
+                    yield stream.read_written()
+            sheet.write(''.join(lines).encode())
+            sheet.write(b'</sheetData></worksheet>')
+    yield stream.read_written()
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
@@ -0,0 +1,191 @@
+"""
+Bulk employee import from CSV or JSON.
+
+Rows are read as a stream and handled in batches: each batch is validated
+against the Employee model fields, checked for ID numbers that already
+exist in the company with one query, and written with bulk_create together
+with the new employees' leave balances and search index entries. The
+working hours config used for salaried hourly rates is looked up once per
+import.
+"""
+import csv
+import io
+import json
+from dataclasses import dataclass, field
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Employee, LeaveBalance, WorkingHoursConfig
+from .search import index_employees
+from .utils import invalidate_company_cache
+
+# Rows validated and written per transaction
+IMPORT_BATCH_SIZE = 2000
+
+# Columns an import may set; anything else in a row is ignored
+IMPORT_FIELDS = [
+    'first_name', 'last_name', 'id_number', 'tax_number', 'date_joined', 'department', 'job_title',
+    'status', 'is_wage_employee', 'salary', 'hourly_rate',
+]
+
+CENTS = Decimal('0.01')
+
+_TRUE = {'1', 'true', 'yes', 'y', 't'}
+_FALSE = {'0', 'false', 'no', 'n', 'f', ''}
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    # (row number, {field: [messages]}), row numbers counting from 1
+    errors: list = field(default_factory=list)
+    # Set when the stream could not be read to the end; the rows before it are imported
+    read_error: str = ''
+
+    @property
+    def error_count(self):
+        return len(self.errors)
+
+
+def read_rows(stream, fmt):
+    """
+    Yields dicts from a binary or text stream. ``fmt`` is 'csv' (with a
+    header row), 'json' (an array of objects) or 'jsonl' (one object per
+    line). CSV and JSON Lines are read incrementally.
+    """
+    if isinstance(stream, (bytes, str)):
+        stream = io.BytesIO(stream) if isinstance(stream, bytes) else io.StringIO(stream)
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    elif fmt == 'json':
+        data = json.load(stream)
+        if not isinstance(data, list):
+            raise ValueError("JSON imports must be an array of employee objects")
+        yield from data
+    else:
+        raise ValueError(f"Unknown import format: {fmt}")
+
+
+def _clean_row(row, fields):
+    """Returns (values, errors) for one raw row, using the model fields' own validation."""
+    if not isinstance(row, dict):
+        return None, {'__all__': ["Expected an object with employee fields"]}
+
+    values, errors = {}, {}
+    for name, model_field in fields.items():
+        raw = row.get(name)
+        if isinstance(raw, str):
+            raw = raw.strip()
+        if raw in (None, ''):
+            if model_field.has_default():
+                values[name] = model_field.get_default()
+                continue
+            raw = None if model_field.null else ''
+        if name == 'is_wage_employee' and isinstance(raw, str):
+            if raw.lower() not in _TRUE | _FALSE:
+                errors[name] = [f"'{raw}' must be true or false."]
+                continue
+            raw = raw.lower() in _TRUE
+        try:
+            values[name] = model_field.clean(raw, None)
+        except ValidationError as e:
+            errors[name] = e.messages
+
+    return values, errors
+
+
+def _import_batch(batch, company, config, seen_id_numbers, result, dry_run):
+    fields = {name: Employee._meta.get_field(name) for name in IMPORT_FIELDS}
+    cleaned = []
+    for row_number, row in batch:
+        values, errors = _clean_row(row, fields)
+        if not errors:
+            id_number = values['id_number']
+            if id_number in seen_id_numbers:
+                errors = {'id_number': [f"ID number {id_number} appears more than once in this import."]}
+            else:
+                seen_id_numbers.add(id_number)
+        if errors:
+            result.errors.append((row_number, errors))
+        else:
+            cleaned.append((row_number, values))
+
+    existing = set(
+        Employee.objects.filter(
+            company=company, id_number__in=[values['id_number'] for _, values in cleaned]
+        ).values_list('id_number', flat=True)
+    )
+
+    now = timezone.now()
+    employees = []
+    for row_number, values in cleaned:
+        if values['id_number'] in existing:
+            result.errors.append((row_number, {'id_number': [f"An employee with ID number {values['id_number']} already exists."]}))
+            continue
+        employee = Employee(company=company, status_changed_at=now, **values)
+        # Same rules as Employee.save, with the config looked up once
+        if employee.is_wage_employee:
+            if employee.hourly_rate is None:
+                employee.hourly_rate = 0
+        elif employee.salary:
+            employee.hourly_rate = employee.calculate_hourly_rate(config).quantize(CENTS, rounding=ROUND_HALF_UP)
+        employees.append(employee)
+
+    if dry_run or not employees:
+        result.created += len(employees)
+        return
+
+    with transaction.atomic():
+        Employee.objects.bulk_create(employees)
+        LeaveBalance.initialize_leave_for_employees(employees)
+        index_employees(employees)
+    result.created += len(employees)
+
+
+def import_employees(rows, company, batch_size=IMPORT_BATCH_SIZE, dry_run=False):
+    """
+    Creates employees for ``company`` from an iterable of dicts (see
+    read_rows), with their default leave balances. Invalid rows are skipped
+    and reported in the returned ImportResult; valid ones are imported.
+    If the stream can't be read to the end, the rows before the bad one are
+    imported and the error is set on the result. With ``dry_run`` nothing
+    is written.
+    """
+    result = ImportResult()
+    config = WorkingHoursConfig.objects.filter(active=True).first()
+    seen_id_numbers = set()
+    batch = []
+    rows = iter(rows)
+    row_number = 0
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            break
+        except (ValueError, csv.Error) as e:
+            # Earlier batches are committed, so report how far the import got
+            result.read_error = f"Row {row_number + 1}: {e}"
+            break
+        row_number += 1
+        batch.append((row_number, row))
+        if len(batch) >= batch_size:
+            _import_batch(batch, company, config, seen_id_numbers, result, dry_run)
+            batch = []
+    if batch:
+        _import_batch(batch, company, config, seen_id_numbers, result, dry_run)
+    result.errors.sort(key=lambda error: error[0])
+
+    # bulk_create sends no signals
+    if result.created and not dry_run:
+        invalidate_company_cache(company.pk)
+    return result
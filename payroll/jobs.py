@@ -0,0 +1,82 @@
+import datetime
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import PayrollJob
+from .services import run_payroll
+
+
+def enqueue_payroll_job(payroll_run):
+    """
+    Queues a payroll calculation for ``payroll_run``. If one is already
+    queued or running for the run, that job is returned instead; the
+    unique_active_payroll_job constraint settles concurrent requests.
+    """
+    job = PayrollJob.objects.filter(payroll_run=payroll_run, status__in=['queued', 'running']).first()
+    if job is not None:
+        return job
+    try:
+        with transaction.atomic():
+            return PayrollJob.objects.create(payroll_run=payroll_run)
+    except IntegrityError:
+        return PayrollJob.objects.get(payroll_run=payroll_run, status__in=['queued', 'running'])
+
+
+def requeue_expired_jobs():
+    """Queues running jobs whose worker stopped renewing its lease again. Returns how many there were."""
+    cutoff = timezone.now() - datetime.timedelta(seconds=settings.PAYROLL_JOB_LEASE)
+    return PayrollJob.objects.filter(status='running').filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True)
+    ).update(status='queued', started_at=None, heartbeat_at=None)
+
+
+def claim_next_job():
+    """
+    Marks the oldest queued job as running and returns it, or None if the
+    queue is empty. Jobs lost by a stopped worker are queued first. The
+    conditional UPDATE makes sure only one worker can claim a given job.
+    """
+    requeue_expired_jobs()
+    for job in PayrollJob.objects.filter(status='queued').order_by('created_at', 'id')[:10]:
+        now = timezone.now()
+        claimed = PayrollJob.objects.filter(pk=job.pk, status='queued').update(
+            status='running', started_at=now, heartbeat_at=now
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def process_job(job, workers=None):
+    """
+    Runs a claimed job, recording progress and renewing its lease, and
+    marks it done or failed. Updates are made only while the job is still
+    this worker's, so a worker whose lease expired can't overwrite the job
+    after it has been claimed again.
+
+    The lease is renewed each time progress is reported: as payslips are
+    calculated, just before they are saved and once they are. The save is
+    one transaction that can't report progress, so PAYROLL_JOB_LEASE must
+    be longer than the largest run takes to save; otherwise the job is
+    queued again and calculated a second time.
+    """
+    lease = PayrollJob.objects.filter(pk=job.pk, status='running', started_at=job.started_at)
+
+    def report(done, total):
+        lease.update(done=done, total=total, heartbeat_at=timezone.now())
+
+    try:
+        run_payroll(job.payroll_run, workers=workers, progress=report)
+    except Exception:
+        lease.update(status='failed', error=traceback.format_exc(), finished_at=timezone.now())
+        job.refresh_from_db()
+        raise
+
+    lease.update(status='done', finished_at=timezone.now())
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payroll.models import PayrollRun
+from payroll.snapshots import SnapshotError, archive_run, can_archive, write_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the missing snapshots of closed payroll runs and, with --prune, deletes the detailed "
+        "payslip rows of runs whose tax year is over."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', type=int, help="ID of a closed PayrollRun; defaults to every closed run")
+        parser.add_argument('--prune', action='store_true', help="Delete the detailed rows of runs that can be archived")
+        parser.add_argument('--dry-run', action='store_true', help="List the runs that would be pruned without changing them")
+
+    def handle(self, *args, **options):
+        runs = PayrollRun.objects.filter(is_closed=True).select_related('snapshot').order_by('period_start')
+        if options['run']:
+            runs = runs.filter(pk=options['run'])
+            if not runs.exists():
+                raise CommandError(f"Closed PayrollRun {options['run']} does not exist")
+
+        written = pruned = 0
+        for payroll_run in runs:
+            if options['dry_run']:
+                if options['prune'] and can_archive(payroll_run):
+                    self.stdout.write(f"Would prune {payroll_run}")
+                    pruned += 1
+                continue
+
+            if not hasattr(payroll_run, 'snapshot'):
+                snapshot = write_snapshot(payroll_run)
+                self.stdout.write(f"{payroll_run}: {snapshot.payslip_count} payslips written to {snapshot.path}")
+                written += 1
+            if options['prune'] and can_archive(payroll_run):
+                try:
+                    deleted = archive_run(payroll_run)
+                except SnapshotError as e:
+                    raise CommandError(str(e))
+                if deleted:
+                    self.stdout.write(f"{payroll_run}: {deleted} payslips pruned")
+                    pruned += 1
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"{pruned} payroll runs would be pruned"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{written} snapshots written, {pruned} payroll runs pruned"))
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payroll.benchmarks import BENCHMARKS, compare_results, over_budget, run_benchmarks
+from payroll.models import Company
+
+
+class Command(BaseCommand):
+    help = "Times the payroll views and tax calculation and counts their queries. Prints the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', help="Code of the company to benchmark as; defaults to the largest")
+        parser.add_argument('--rounds', type=int, default=5, help="Timed calls per benchmark, after one warm-up call (default: 5)")
+        parser.add_argument('--only', action='append', choices=[name for name, _ in BENCHMARKS], help="Run only this benchmark; may be repeated")
+        parser.add_argument('--output', help="Write the JSON results to this file instead of standard output")
+        parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+
+    def handle(self, *args, **options):
+        company = None
+        if options['company']:
+            try:
+                company = Company.objects.get(code=options['company'])
+            except Company.DoesNotExist:
+                raise CommandError(f"Company {options['company']} does not exist")
+        if options['rounds'] < 1:
+            raise CommandError("--rounds must be at least 1")
+
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read {options['compare']}: {e}")
+
+        results = run_benchmarks(company, rounds=options['rounds'], only=options['only'])
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            for name, before_ms, after_ms, before_queries, after_queries in compare_results(baseline, results):
+                change = (after_ms - before_ms) / before_ms * 100 if before_ms else 0
+                self.stderr.write(
+                    f"{name:<18} {before_ms:>9.2f} ms -> {after_ms:>9.2f} ms ({change:+.1f}%)"
+                    f"   {before_queries} -> {after_queries} queries"
+                )
+
+        for name, queries, budget in over_budget(results):
+            self.stderr.write(self.style.WARNING(f"{name} ran {queries} queries, over its budget of {budget}"))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payroll.exports import EXPORT_FORMATS, employee_export, payslip_export
+from payroll.models import Company, PayrollRun
+
+
+class Command(BaseCommand):
+    help = "Exports a payroll run's payslips, or the employee register, to CSV or XLSX."
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--run', type=int, help="ID of the PayrollRun to export")
+        target.add_argument('--employees', action='store_true', help="Export the employee register")
+        parser.add_argument('--company', help="Only include employees of the company with this code")
+        parser.add_argument('--status', help="With --employees, only include employees with this status")
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help="File to write; defaults to payroll_<YYYY-MM>.<format> or employees.<format>")
+
+    def handle(self, *args, **options):
+        company = None
+        if options['company']:
+            try:
+                company = Company.objects.get(code=options['company'])
+            except Company.DoesNotExist:
+                raise CommandError(f"Company {options['company']} does not exist")
+
+        fmt = options['format']
+        if options['run']:
+            try:
+                payroll_run = PayrollRun.objects.get(pk=options['run'])
+            except PayrollRun.DoesNotExist:
+                raise CommandError(f"PayrollRun {options['run']} does not exist")
+            headers, rows = payslip_export(payroll_run, company)
+            output = options['output'] or f"payroll_{payroll_run.period_start:%Y-%m}.{fmt}"
+        else:
+            headers, rows = employee_export(company, options['status'])
+            output = options['output'] or f"employees.{fmt}"
+
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        stream, _ = EXPORT_FORMATS[fmt]
+        if fmt == 'csv':
+            f = open(output, 'w', newline='', encoding='utf-8')
+        else:
+            f = open(output, 'wb')
+        with f:
+            for chunk in stream(headers, counted(rows)):
+                f.write(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f"{count} rows written to {output}"))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payroll.models import Company, PayrollRun
+from payroll.pdf import iter_run_pdfs, stream_zip
+
+
+class Command(BaseCommand):
+    help = "Renders every payslip in a payroll run to PDF and writes them to a ZIP file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', type=int, required=True, help="ID of the PayrollRun")
+        parser.add_argument('--company', help="Only include employees of the company with this code")
+        parser.add_argument('--output', help="ZIP file to write; defaults to payslips_<YYYY-MM>.zip")
+        parser.add_argument('--workers', type=int, help="Number of rendering processes; defaults to settings.PAYROLL_WORKERS")
+
+    def handle(self, *args, **options):
+        try:
+            payroll_run = PayrollRun.objects.get(pk=options['run'])
+        except PayrollRun.DoesNotExist:
+            raise CommandError(f"PayrollRun {options['run']} does not exist")
+        company = None
+        if options['company']:
+            try:
+                company = Company.objects.get(code=options['company'])
+            except Company.DoesNotExist:
+                raise CommandError(f"Company {options['company']} does not exist")
+
+        output = options['output'] or f"payslips_{payroll_run.period_start:%Y-%m}.zip"
+        count = 0
+
+        def counted(files):
+            nonlocal count
+            for item in files:
+                count += 1
+                yield item
+
+        with open(output, 'wb') as f:
+            for chunk in stream_zip(counted(iter_run_pdfs(payroll_run, company, workers=options['workers']))):
+                f.write(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f"{count} payslips written to {output}"))
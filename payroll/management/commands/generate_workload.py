@@ -0,0 +1,52 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payroll.workload import generate_workload
+
+
+class Command(BaseCommand):
+    help = "Generates synthetic companies, employees, payroll runs, worked hours and leave for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=1, help="Number of companies to add (default: 1)")
+        parser.add_argument('--employees', type=int, default=1000, help="Employees to add, spread over the companies (default: 1000)")
+        parser.add_argument('--wage-ratio', type=float, default=0.3, help="Share of employees paid by the hour (default: 0.3)")
+        parser.add_argument('--months', type=int, default=3, help="Monthly payroll runs up to the current month; all but the latest are closed (default: 3)")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same data")
+        parser.add_argument('--no-leave', action='store_true', help="Don't generate leave requests")
+        parser.add_argument('--workers', type=int, help="Number of processes to calculate payslips with; defaults to settings.PAYROLL_WORKERS")
+        parser.add_argument('--date', help="Date (YYYY-MM-DD) to generate as at; defaults to today")
+
+    def handle(self, *args, **options):
+        if options['companies'] < 1 or options['employees'] < options['companies']:
+            raise CommandError("Give at least one company and at least one employee per company")
+        if not 0 <= options['wage_ratio'] <= 1:
+            raise CommandError("--wage-ratio must be between 0 and 1")
+        if options['months'] < 1:
+            raise CommandError("--months must be at least 1")
+        today = None
+        if options['date']:
+            try:
+                today = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError("--date must be in YYYY-MM-DD format")
+
+        try:
+            result = generate_workload(
+                companies=options['companies'],
+                employees=options['employees'],
+                wage_ratio=options['wage_ratio'],
+                months=options['months'],
+                seed=options['seed'],
+                leave=not options['no_leave'],
+                workers=options['workers'],
+                today=today,
+                log=self.stdout.write,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"{result.companies} companies, {result.employees} employees, {result.runs} payroll runs, "
+            f"{result.payslips} payslips, {result.worked_hours} timesheets and {result.leave_requests} leave requests generated"
+        ))
@@ -0,0 +1,46 @@
+import csv
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payroll.imports import IMPORT_BATCH_SIZE, import_employees, read_rows
+from payroll.models import Company
+
+
+class Command(BaseCommand):
+    help = "Imports employees for a company from a CSV, JSON or JSON Lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import")
+        parser.add_argument('--company', required=True, help="Code of the company the employees belong to")
+        parser.add_argument('--format', choices=['csv', 'json', 'jsonl'], help="File format; defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help="Rows validated and written at a time")
+        parser.add_argument('--dry-run', action='store_true', help="Validate the file without saving anything")
+
+    def handle(self, *args, **options):
+        try:
+            company = Company.objects.get(code=options['company'])
+        except Company.DoesNotExist:
+            raise CommandError(f"Company {options['company']} does not exist")
+
+        fmt = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if fmt not in ('csv', 'json', 'jsonl'):
+            raise CommandError("Use --format to give the file format (csv, json or jsonl)")
+
+        try:
+            with open(options['path'], 'rb') as f:
+                result = import_employees(
+                    read_rows(f, fmt), company, batch_size=options['batch_size'], dry_run=options['dry_run']
+                )
+        except (OSError, ValueError, csv.Error) as e:
+            raise CommandError(f"Could not read {options['path']}: {e}")
+
+        for row_number, errors in result.errors:
+            for field, messages in errors.items():
+                self.stderr.write(f"Row {row_number}: {field}: {' '.join(messages)}")
+
+        verb = "would be imported" if options['dry_run'] else "imported"
+        summary = f"{result.created} employees {verb} into {company}, {result.error_count} rows with errors"
+        if result.read_error:
+            raise CommandError(f"Could not read {options['path']}: {result.read_error} ({summary})")
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,75 @@
+import csv
+import datetime
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from payroll.models import Company, PayrollRun
+from payroll.imports import read_rows
+from payroll.services import get_payroll_run_for
+from payroll.timesheets import TIMESHEET_BATCH_SIZE, ingest_timesheets
+
+
+class Command(BaseCommand):
+    help = "Saves worked hours for a payroll run from a CSV, JSON or JSON Lines file and recalculates the affected payslips."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import")
+        parser.add_argument('--run', type=int, help="ID of an existing PayrollRun")
+        parser.add_argument('--date', help="Any date (YYYY-MM-DD) in the month the hours are for; defaults to today")
+        parser.add_argument('--company', help="Only accept employees of the company with this code")
+        parser.add_argument('--format', choices=['csv', 'json', 'jsonl'], help="File format; defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=TIMESHEET_BATCH_SIZE, help="Rows validated and written at a time")
+        parser.add_argument('--no-recalculate', action='store_true', help="Only mark the affected payslips out of date")
+
+    def handle(self, *args, **options):
+        if options['run']:
+            try:
+                payroll_run = PayrollRun.objects.get(pk=options['run'])
+            except PayrollRun.DoesNotExist:
+                raise CommandError(f"PayrollRun {options['run']} does not exist")
+        else:
+            if options['date']:
+                try:
+                    day = datetime.date.fromisoformat(options['date'])
+                except ValueError:
+                    raise CommandError("--date must be in YYYY-MM-DD format")
+            else:
+                day = timezone.now().date()
+            payroll_run = get_payroll_run_for(day)
+
+        if payroll_run.is_closed:
+            raise CommandError(f"{payroll_run} is closed")
+
+        company = None
+        if options['company']:
+            try:
+                company = Company.objects.get(code=options['company'])
+            except Company.DoesNotExist:
+                raise CommandError(f"Company {options['company']} does not exist")
+
+        fmt = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if fmt not in ('csv', 'json', 'jsonl'):
+            raise CommandError("Use --format to give the file format (csv, json or jsonl)")
+
+        try:
+            with open(options['path'], 'rb') as f:
+                result = ingest_timesheets(
+                    read_rows(f, fmt), payroll_run, company,
+                    batch_size=options['batch_size'], recalculate=not options['no_recalculate'],
+                )
+        except (OSError, ValueError, csv.Error) as e:
+            raise CommandError(f"Could not read {options['path']}: {e}")
+
+        for row_number, errors in result.errors:
+            for field, messages in errors.items():
+                self.stderr.write(f"Row {row_number}: {field}: {' '.join(messages)}")
+
+        summary = (
+            f"{payroll_run}: {result.saved} timesheets saved, {result.recalculated} payslips recalculated, "
+            f"{result.error_count} rows with errors"
+        )
+        if result.read_error:
+            raise CommandError(f"Could not read {options['path']}: {result.read_error} ({summary})")
+        self.stdout.write(self.style.SUCCESS(summary))
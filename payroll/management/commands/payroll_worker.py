@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payroll.jobs import claim_next_job, process_job
+
+
+class Command(BaseCommand):
+    help = "Processes queued payroll jobs. Runs until stopped unless --once is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to wait between queue checks")
+        parser.add_argument('--workers', type=int, help="Number of processes to calculate payslips with; defaults to settings.PAYROLL_WORKERS")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Payroll worker started")
+        try:
+            while True:
+                job = claim_next_job()
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                self.stdout.write(f"Processing {job}")
+                try:
+                    job = process_job(job, workers=options['workers'])
+                except Exception as e:
+                    self.stderr.write(self.style.ERROR(f"Payroll job {job.pk} failed: {e}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"Payroll job {job.pk} done: {job.done} payslips in {job.elapsed.total_seconds():.1f}s"
+                    ))
+        except KeyboardInterrupt:
+            self.stdout.write("Payroll worker stopped")
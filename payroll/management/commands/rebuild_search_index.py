@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from payroll.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the employee search index from the employee table."
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"{count} employees indexed"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payroll.models import PayrollRun
+from payroll.services import refresh_run_summaries, refresh_run_totals
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the dashboard summaries and totals of one payroll run, or of every run. Frozen totals of closed runs are kept."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', type=int, help="ID of the PayrollRun; defaults to every run")
+
+    def handle(self, *args, **options):
+        runs = PayrollRun.objects.all()
+        if options['run']:
+            runs = runs.filter(pk=options['run'])
+            if not runs.exists():
+                raise CommandError(f"PayrollRun {options['run']} does not exist")
+
+        count = 0
+        for payroll_run in runs:
+            refresh_run_summaries(payroll_run)
+            refresh_run_totals(payroll_run)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Summaries refreshed for {count} payroll runs"))
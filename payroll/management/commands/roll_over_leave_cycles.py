@@ -0,0 +1,28 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payroll.models import LeaveBalance, LeaveType
+
+
+class Command(BaseCommand):
+    help = "Resets the annual, sick, family and study leave balances whose cycles have ended. Safe to run nightly."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Date (YYYY-MM-DD) to roll over as at; defaults to today")
+        parser.add_argument('--dry-run', action='store_true', help="Count the balances that are due without changing them")
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError("--date must be in YYYY-MM-DD format")
+
+        counts = LeaveBalance.roll_over_cycles(today, dry_run=options['dry_run'])
+        for leave_type, count in counts.items():
+            self.stdout.write(f"{LeaveType(leave_type).label}: {count}")
+
+        verb = "due for rollover" if options['dry_run'] else "rolled over"
+        self.stdout.write(self.style.SUCCESS(f"{sum(counts.values())} leave balances {verb}"))
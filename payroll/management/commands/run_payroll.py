@@ -0,0 +1,66 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from payroll.models import PayrollRun
+from payroll.services import get_payroll_run_for, recalculate_dirty_payslips, run_payroll
+from payroll.vectorized import ReconciliationError
+
+
+class Command(BaseCommand):
+    help = "Calculates and stores payslips for every active employee in a payroll run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', type=int, help="ID of an existing PayrollRun")
+        parser.add_argument('--date', help="Any date (YYYY-MM-DD) in the month to run; defaults to today")
+        parser.add_argument('--dirty', action='store_true', help="Only recalculate payslips marked out of date (all open runs unless --run/--date is given)")
+        parser.add_argument('--workers', type=int, help="Number of processes to calculate payslips with; defaults to settings.PAYROLL_WORKERS")
+        parser.add_argument('--vectorized', action='store_true', help="Calculate with the NumPy calculator (requires numpy)")
+        parser.add_argument('--reconcile', action='store_true', help="With --vectorized, check every payslip against the Decimal calculation to the cent")
+
+    def handle(self, *args, **options):
+        if options['dirty'] and not (options['run'] or options['date']):
+            count = recalculate_dirty_payslips(workers=options['workers'])
+            self.stdout.write(self.style.SUCCESS(f"{count} out-of-date payslips recalculated"))
+            return
+
+        if options['run']:
+            try:
+                payroll_run = PayrollRun.objects.get(pk=options['run'])
+            except PayrollRun.DoesNotExist:
+                raise CommandError(f"PayrollRun {options['run']} does not exist")
+        else:
+            if options['date']:
+                try:
+                    day = datetime.date.fromisoformat(options['date'])
+                except ValueError:
+                    raise CommandError("--date must be in YYYY-MM-DD format")
+            else:
+                day = timezone.now().date()
+            payroll_run = get_payroll_run_for(day)
+
+        if payroll_run.is_closed:
+            raise CommandError(f"{payroll_run} is closed")
+
+        if options['dirty']:
+            count = recalculate_dirty_payslips(payroll_run, workers=options['workers'])
+            self.stdout.write(self.style.SUCCESS(f"{payroll_run}: {count} out-of-date payslips recalculated"))
+            return
+
+        try:
+            created, updated = run_payroll(
+                payroll_run,
+                workers=options['workers'],
+                vectorized=options['vectorized'],
+                reconcile=options['reconcile'],
+            )
+        except ReconciliationError as e:
+            for data, result, expected in e.mismatches[:20]:
+                self.stderr.write(f"Employee {data.employee_id}: vectorized {result} != decimal {expected}")
+            raise CommandError(f"{e}; nothing was saved")
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"{payroll_run}: {created} payslips created, {updated} updated"
+        ))
@@ -0,0 +1,55 @@
+import logging
+
+from django.conf import settings
+
+from .querycount import QueryRecorder, QueryStats, query_budget
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the queries and database time of each request and attributes
+    them to the view's URL name. Logs a warning when a view goes over its
+    query budget (see payroll.querycount). With DEBUG on, the numbers are
+    also sent as X-DB-* and Server-Timing headers. Streamed responses run
+    their queries as the body is read, after this returns, so they are
+    only flagged (X-DB-Streaming) and never reported as within budget.
+    Should come first in MIDDLEWARE so session and user lookups are
+    counted too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else None
+        stats = QueryStats(
+            view=view or request.path,
+            count=recorder.count,
+            duration=recorder.duration,
+            budget=query_budget(view) if view else None,
+            streaming=response.streaming,
+        )
+        response.query_stats = stats
+
+        if stats.streaming:
+            if settings.DEBUG:
+                response['X-DB-Streaming'] = '1'
+            return response
+        if stats.over_budget:
+            logger.warning(
+                "%s (%s %s) ran %d queries in %.1f ms, over its budget of %d",
+                stats.view, request.method, request.path, stats.count, stats.duration * 1000, stats.budget,
+            )
+        if settings.DEBUG:
+            response['X-DB-Query-Count'] = str(stats.count)
+            response['X-DB-Time'] = f"{stats.duration * 1000:.1f}"
+            if stats.budget is not None:
+                response['X-DB-Query-Budget'] = str(stats.budget)
+            response['Server-Timing'] = f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"'
+        return response
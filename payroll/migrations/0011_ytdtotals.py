@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0010_leaverequest_leavebalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='YtdTotals',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tax_year', models.CharField(max_length=9)),
+                ('basic_salary', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('wages', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('gross_income', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('tax', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('uif', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('sdl', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('net_pay', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payroll.employee')),
+                ('payslip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ytd_totals', to='payroll.payslip')),
+            ],
+            options={
+                'verbose_name_plural': 'YTD totals',
+                'indexes': [models.Index(fields=['employee', 'tax_year'], name='payroll_ytd_employe_41e949_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:06
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0012_payrolljob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyPayslip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('marked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payroll.employee')),
+                ('payroll_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dirty_payslips', to='payroll.payrollrun')),
+            ],
+            options={
+                'unique_together': {('employee', 'payroll_run')},
+            },
+        ),
+    ]
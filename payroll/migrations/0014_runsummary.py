@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:11
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0013_dirtypayslip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('headcount', models.PositiveIntegerField(default=0)),
+                ('gross_income', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('tax', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('uif', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('sdl', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('net_pay', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('departments', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('top_earners', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('refreshed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='run_summaries', to='payroll.company')),
+                ('payroll_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='payroll.payrollrun')),
+            ],
+            options={
+                'verbose_name_plural': 'run summaries',
+                'unique_together': {('company', 'payroll_run')},
+            },
+        ),
+    ]
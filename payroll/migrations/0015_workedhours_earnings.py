@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:13
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+def backfill_earnings(apps, schema_editor):
+    # Existing rows take the employee's current rate: no earlier one was recorded
+    WorkedHours = apps.get_model('payroll', 'WorkedHours')
+    cents = Decimal('0.01')
+    rows = []
+    for wh in WorkedHours.objects.select_related('employee').iterator(chunk_size=500):
+        hourly = Decimal(wh.employee.hourly_rate or 0)
+        normal = wh.normal_hours * hourly
+        overtime = wh.overtime_hours * hourly * Decimal('1.5')
+        saturday = wh.saturday_hours * hourly * Decimal('1.5')
+        sunday = wh.sunday_public_hours * hourly * Decimal('2.0')
+        wh.hourly_rate = hourly.quantize(cents, rounding=ROUND_HALF_UP)
+        wh.normal_earnings = normal.quantize(cents, rounding=ROUND_HALF_UP)
+        wh.overtime_earnings = overtime.quantize(cents, rounding=ROUND_HALF_UP)
+        wh.saturday_earnings = saturday.quantize(cents, rounding=ROUND_HALF_UP)
+        wh.sunday_earnings = sunday.quantize(cents, rounding=ROUND_HALF_UP)
+        wh.total_earnings = (normal + overtime + saturday + sunday).quantize(cents, rounding=ROUND_HALF_UP)
+        rows.append(wh)
+    WorkedHours.objects.bulk_update(rows, [
+        'hourly_rate', 'normal_earnings', 'overtime_earnings', 'saturday_earnings', 'sunday_earnings', 'total_earnings',
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0014_runsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workedhours',
+            name='hourly_rate',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True),
+        ),
+        migrations.AddField(
+            model_name='workedhours',
+            name='normal_earnings',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='workedhours',
+            name='overtime_earnings',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='workedhours',
+            name='saturday_earnings',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='workedhours',
+            name='sunday_earnings',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='workedhours',
+            name='total_earnings',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_earnings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:19
+
+from django.db import migrations
+
+
+def remove_duplicate_worked_hours(apps, schema_editor):
+    # Keep the row a payslip points at (else the oldest) for each employee and run
+    WorkedHours = apps.get_model('payroll', 'WorkedHours')
+    Payslip = apps.get_model('payroll', 'Payslip')
+    linked = set(Payslip.objects.exclude(worked_hours=None).values_list('worked_hours_id', flat=True))
+    keep = {}
+    for wh_id, key in (
+        (wh['id'], (wh['employee_id'], wh['payroll_run_id']))
+        for wh in WorkedHours.objects.order_by('id').values('id', 'employee_id', 'payroll_run_id')
+    ):
+        if key not in keep or (wh_id in linked and keep[key] not in linked):
+            keep[key] = wh_id
+    WorkedHours.objects.exclude(id__in=keep.values()).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0015_workedhours_earnings'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_worked_hours, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:19
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0016_remove_duplicate_worked_hours'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='workedhours',
+            unique_together={('employee', 'payroll_run')},
+        ),
+    ]
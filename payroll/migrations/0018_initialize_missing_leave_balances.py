@@ -0,0 +1,43 @@
+from decimal import Decimal
+
+from django.db import migrations
+
+
+# Opening allocations as in LeaveBalance.DEFAULT_ALLOCATIONS when this was written
+DEFAULT_ALLOCATIONS = {
+    'Annual': Decimal('17.00'),
+    'Sick': Decimal('30.00'),
+    'Family': Decimal('3.00'),
+    'Maternity': Decimal('0.00'),
+    'Parental': Decimal('0.00'),
+    'Study': Decimal('5.00'),
+}
+
+
+def initialize_missing_leave_balances(apps, schema_editor):
+    # Balances used to be created when the leave summary was first viewed
+    Employee = apps.get_model('payroll', 'Employee')
+    LeaveBalance = apps.get_model('payroll', 'LeaveBalance')
+    for leave_type, allocation in DEFAULT_ALLOCATIONS.items():
+        employees = Employee.objects.exclude(leavebalance__leave_type=leave_type).values_list('id', 'date_joined')
+        LeaveBalance.objects.bulk_create([
+            LeaveBalance(
+                employee_id=employee_id,
+                leave_type=leave_type,
+                total_days=allocation,
+                used_days=Decimal('0.00'),
+                cycle_start=date_joined,
+            )
+            for employee_id, date_joined in employees.iterator(chunk_size=2000)
+        ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0017_workedhours_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(initialize_missing_leave_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:24
+
+import calendar
+import django.db.models.deletion
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+
+
+def open_accrued_balances(apps, schema_editor):
+    # Annual leave used to be worked out from cycle_start on every read. Carry
+    # it forward, by the new monthly rule, up to the end of the last closed
+    # run; later runs post their own accruals when they close.
+    PayrollRun = apps.get_model('payroll', 'PayrollRun')
+    LeaveBalance = apps.get_model('payroll', 'LeaveBalance')
+    last_closed = PayrollRun.objects.filter(is_closed=True).order_by('-period_end').first()
+    if last_closed is None:
+        return
+    as_of = last_closed.period_end
+    monthly = Decimal('1.42')
+    balances = []
+    for balance in LeaveBalance.objects.filter(leave_type='Annual', cycle_start__lte=as_of).iterator(chunk_size=2000):
+        start = balance.cycle_start
+        days_in_month = calendar.monthrange(start.year, start.month)[1]
+        months = Decimal(days_in_month - start.day + 1) / days_in_month
+        months += (as_of.year - start.year) * 12 + as_of.month - start.month
+        accrued = (months * monthly).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        balance.accrued_days = max(Decimal('0.00'), min(accrued, balance.total_days))
+        balances.append(balance)
+    LeaveBalance.objects.bulk_update(balances, ['accrued_days'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0018_initialize_missing_leave_balances'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leavebalance',
+            name='accrued_days',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=5),
+        ),
+        migrations.CreateModel(
+            name='LeaveAccrual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('days', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('accrued_days', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('used_days', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('posted_at', models.DateTimeField()),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payroll.employee')),
+                ('leave_balance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accruals', to='payroll.leavebalance')),
+                ('payroll_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leave_accruals', to='payroll.payrollrun')),
+            ],
+            options={
+                'unique_together': {('leave_balance', 'payroll_run')},
+            },
+        ),
+        migrations.RunPython(open_accrued_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:27
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE payroll_employee_fts USING fts5("
+                "company, first_name, last_name, id_number, prefix='2 3')"
+            )
+            cursor.execute(
+                "INSERT INTO payroll_employee_fts (rowid, company, first_name, last_name, id_number) "
+                "SELECT id, 'c' || company_id, first_name, last_name, id_number FROM payroll_employee"
+            )
+        return
+
+    Employee = apps.get_model('payroll', 'Employee')
+    EmployeeSearchTerm = apps.get_model('payroll', 'EmployeeSearchTerm')
+
+    def words(text):
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+        return {word[:64] for word in re.findall(r'[^\W_]+', text)}
+
+    employees = Employee.objects.values_list('id', 'company_id', 'first_name', 'last_name', 'id_number')
+    EmployeeSearchTerm.objects.bulk_create((
+        EmployeeSearchTerm(company_id=company_id, employee_id=employee_id, term=word)
+        for employee_id, company_id, *fields in employees.iterator(chunk_size=2000)
+        for word in words(' '.join(fields))
+    ), batch_size=1000)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS payroll_employee_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0019_leave_accruals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployeeSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='payroll.company')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='payroll.employee')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['company', 'term'], name='payroll_emp_company_cd28cc_idx'), models.Index(fields=['term'], name='payroll_emp_term_1b1018_idx')],
+            },
+        ),
+        migrations.RunPython(build_search_index, drop_search_index),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+
+def build_run_totals(apps, schema_editor):
+    # Totals for runs calculated before they were stored; closed runs are frozen
+    PayrollRun = apps.get_model('payroll', 'PayrollRun')
+    Payslip = apps.get_model('payroll', 'Payslip')
+    RunTotals = apps.get_model('payroll', 'RunTotals')
+    sources = {
+        'basic_salary': 'basic_salary',
+        'normal_earnings': 'worked_hours__normal_earnings',
+        'overtime_earnings': 'worked_hours__overtime_earnings',
+        'saturday_earnings': 'worked_hours__saturday_earnings',
+        'sunday_earnings': 'worked_hours__sunday_earnings',
+        'wages': 'worked_hours__total_earnings',
+        'gross_income': 'gross_income',
+        'tax': 'tax',
+        'uif': 'uif',
+        'sdl': 'sdl',
+        'net_pay': 'net_pay',
+    }
+    grouped = Payslip.objects.values('payroll_run_id').annotate(
+        headcount=Count('id'), **{field: Sum(source) for field, source in sources.items()}
+    ).order_by()
+    closed = set(PayrollRun.objects.filter(is_closed=True).values_list('id', flat=True))
+    now = timezone.now()
+    RunTotals.objects.bulk_create([
+        RunTotals(
+            payroll_run_id=row['payroll_run_id'],
+            headcount=row['headcount'],
+            refreshed_at=now,
+            frozen_at=now if row['payroll_run_id'] in closed else None,
+            **{field: Decimal(row[field] or 0).quantize(Decimal('0.01')) for field in sources},
+        )
+        for row in grouped
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0021_row_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunTotals',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('headcount', models.PositiveIntegerField(default=0)),
+                ('basic_salary', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('normal_earnings', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('overtime_earnings', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('saturday_earnings', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('sunday_earnings', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('wages', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('gross_income', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('tax', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('uif', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('sdl', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('net_pay', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('refreshed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('frozen_at', models.DateTimeField(blank=True, null=True)),
+                ('payroll_run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='totals', to='payroll.payrollrun')),
+            ],
+            options={
+                'verbose_name_plural': 'run totals',
+            },
+        ),
+        migrations.RunPython(build_run_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0022_run_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('checksum', models.CharField(max_length=64)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('payslip_count', models.PositiveIntegerField(default=0)),
+                ('first_payslip_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('last_payslip_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('archived_at', models.DateTimeField(blank=True, null=True)),
+                ('payroll_run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='payroll.payrollrun')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:48
+
+from django.db import migrations, models
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    # Keep the oldest queued or running job of each run
+    PayrollJob = apps.get_model('payroll', 'PayrollJob')
+    seen = set()
+    for job in PayrollJob.objects.filter(status__in=['queued', 'running']).order_by('created_at', 'id'):
+        if job.payroll_run_id in seen:
+            job.status = 'failed'
+            job.error = 'Duplicate of an earlier queued job'
+            job.save(update_fields=['status', 'error'])
+        seen.add(job.payroll_run_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0023_run_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payrolljob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='payrolljob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('payroll_run',), name='unique_active_payroll_job'),
+        ),
+    ]
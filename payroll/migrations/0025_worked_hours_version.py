@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0024_payroll_job_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workedhours',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
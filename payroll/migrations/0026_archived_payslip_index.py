@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0025_worked_hours_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='runsnapshot',
+            name='group_offsets',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.CreateModel(
+            name='ArchivedPayslip',
+            fields=[
+                ('id', models.PositiveBigIntegerField(primary_key=True, serialize=False)),
+                ('group', models.PositiveIntegerField()),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_payslips', to='payroll.runsnapshot')),
+            ],
+        ),
+    ]
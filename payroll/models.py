@@ -1,15 +1,16 @@
-from django.db import models
-from decimal import Decimal
+from django.db import models, transaction
+from decimal import Decimal, ROUND_HALF_UP
 from django.conf import settings
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
 from datetime import date
-from django.db.models import Sum
+from django.db.models import Case, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, ExtractYear
 
 import datetime
-import calendar
 
 
 class Company(models.Model):
@@ -68,6 +69,35 @@ class Employee(models.Model):
     job_title = models.CharField(max_length=100, blank=True, null=True)
     status = models.CharField(max_length=20, choices=EMPLOYMENT_STATUSES, default='active')
     status_changed_at = models.DateTimeField(null=True, blank=True)
+    # Bumped on every save (see payroll.signals); the API's ETags are built from it
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    # Fields that feed into payslip calculations (id_number gives the age rebate)
+    PAYROLL_FIELDS = ('salary', 'hourly_rate', 'is_wage_employee', 'status', 'id_number')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def payroll_fields_changed(self):
+        """True if any PAYROLL_FIELDS differ from when the row was loaded."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return True
+
+        def stored(field_name, value):
+            # Compare decimals as they are saved, e.g. a recalculated hourly rate
+            field = self._meta.get_field(field_name)
+            if value is not None and isinstance(field, models.DecimalField):
+                return Decimal(value).quantize(Decimal(1).scaleb(-field.decimal_places))
+            return value
+
+        return any(
+            field in loaded and stored(field, loaded[field]) != stored(field, getattr(self, field))
+            for field in self.PAYROLL_FIELDS
+        )
 
     @property
     def birthdate(self):
@@ -137,6 +167,8 @@ class PayrollRun(models.Model):
     is_active = models.BooleanField(default=False)
     is_closed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped on every save (see payroll.signals)
+    version = models.PositiveIntegerField(default=1, editable=False)
 
     def __str__(self):
         return f"Payroll Run: {self.period_start} to {self.period_end}"
@@ -145,6 +177,92 @@ class PayrollRun(models.Model):
         ordering = ['-period_start']
 
 
+class PayrollJob(models.Model):
+    """
+    A queued payroll calculation for a PayrollRun, picked up by the
+    `payroll_worker` management command. Tracks progress while it runs.
+    The worker holds a lease on a running job, renewed with each progress
+    report; jobs whose lease has expired are queued again. Only one job
+    per run can be queued or running.
+    """
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    payroll_run = models.ForeignKey(PayrollRun, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['payroll_run'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_active_payroll_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Payroll job {self.pk} ({self.get_status_display()}) – {self.payroll_run}"
+
+    @property
+    def is_active(self):
+        return self.status in ('queued', 'running')
+
+    @property
+    def elapsed(self):
+        if not self.started_at:
+            return None
+        return (self.finished_at or timezone.now()) - self.started_at
+
+    @property
+    def eta(self):
+        """Estimated time remaining, extrapolated from progress so far."""
+        if self.status != 'running' or not self.done or not self.total:
+            return None
+        return self.elapsed * (self.total - self.done) / self.done
+
+    def progress(self):
+        elapsed, eta = self.elapsed, self.eta
+        return {
+            'id': self.pk,
+            'payroll_run': self.payroll_run_id,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'elapsed_seconds': round(elapsed.total_seconds(), 1) if elapsed is not None else None,
+            'eta_seconds': round(eta.total_seconds(), 1) if eta is not None else None,
+            'error': self.error,
+        }
+
+
+class DirtyPayslip(models.Model):
+    """
+    Marks an employee's payslip in an open payroll run as out of date
+    because one of its inputs changed. Cleared when it is recalculated.
+    """
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE)
+    payroll_run = models.ForeignKey(PayrollRun, on_delete=models.CASCADE, related_name='dirty_payslips')
+    marked_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('employee', 'payroll_run')
+
+    def __str__(self):
+        return f"{self.employee} – {self.payroll_run} (dirty)"
+
+
 class WorkedHours(models.Model):
     """
     Captures hours worked by wage-based employees for a specific payroll run.
@@ -158,37 +276,96 @@ class WorkedHours(models.Model):
     saturday_hours = models.DecimalField(max_digits=5, decimal_places=2, default=0)
     sunday_public_hours = models.DecimalField(max_digits=5, decimal_places=2, default=0)
 
-    @property
-    def normal_earnings(self):
-        return self.normal_hours * self.employee.hourly_rate
+    # Earnings are stored when the hours are saved or the run is calculated, at
+    # the employee's hourly rate at the time, so later rate changes leave past
+    # payslips alone and totals can be summed in SQL.
+    hourly_rate = models.DecimalField(max_digits=7, decimal_places=2, blank=True, null=True)
+    normal_earnings = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    overtime_earnings = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    saturday_earnings = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    sunday_earnings = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_earnings = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Bumped on every save and bulk write; the API's payslip ETags include it
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    EARNINGS_FIELDS = [
+        'hourly_rate', 'normal_earnings', 'overtime_earnings', 'saturday_earnings', 'sunday_earnings', 'total_earnings',
+    ]
 
-    @property
-    def overtime_earnings(self):
-        return self.overtime_hours * self.employee.hourly_rate * Decimal("1.5")
+    class Meta:
+        unique_together = ('employee', 'payroll_run')
 
-    @property
-    def saturday_earnings(self):
-        return self.saturday_hours * self.employee.hourly_rate * Decimal("1.5")
+    def calculate_earnings(self, hourly_rate=None):
+        """
+        Sets the earnings fields from the hours at ``hourly_rate`` (default:
+        the rate already recorded, or else the employee's current rate).
+        The total is rounded once from the exact sum, as the payslip is.
+        """
+        if hourly_rate is None:
+            hourly_rate = self.hourly_rate if self.hourly_rate is not None else self.employee.hourly_rate
+        hourly = Decimal(hourly_rate or 0)
+        normal = Decimal(self.normal_hours or 0) * hourly
+        overtime = Decimal(self.overtime_hours or 0) * hourly * Decimal("1.5")
+        saturday = Decimal(self.saturday_hours or 0) * hourly * Decimal("1.5")
+        sunday = Decimal(self.sunday_public_hours or 0) * hourly * Decimal("2.0")
+
+        cents = Decimal("0.01")
+        self.hourly_rate = hourly.quantize(cents, rounding=ROUND_HALF_UP)
+        self.normal_earnings = normal.quantize(cents, rounding=ROUND_HALF_UP)
+        self.overtime_earnings = overtime.quantize(cents, rounding=ROUND_HALF_UP)
+        self.saturday_earnings = saturday.quantize(cents, rounding=ROUND_HALF_UP)
+        self.sunday_earnings = sunday.quantize(cents, rounding=ROUND_HALF_UP)
+        self.total_earnings = (normal + overtime + saturday + sunday).quantize(cents, rounding=ROUND_HALF_UP)
+        return self.total_earnings
+
+    def save(self, *args, **kwargs):
+        self.calculate_earnings()
+        super().save(*args, **kwargs)
 
-    @property
-    def sunday_earnings(self):
-        return self.sunday_public_hours * self.employee.hourly_rate * Decimal("2")
-
-    def calculate_gross_pay(self):
-        normal = self.normal_hours or 0
-        ot_1_5 = self.overtime_hours or 0
-        sat_1_5 = self.saturday_hours or 0
-        sun_2_0 = self.sunday_public_hours or 0
-
-        hourly = self.employee.hourly_rate or Decimal("0.00")
-
-        gross = (
-            Decimal(normal) * hourly +
-            Decimal(ot_1_5) * hourly * Decimal("1.5") +
-            Decimal(sat_1_5) * hourly * Decimal("1.5") +
-            Decimal(sun_2_0) * hourly * Decimal("2.0")
-        )
-        return gross
+
+def tax_year_of(field):
+    """
+    SQL expression for the calendar year a date field's tax year starts in
+    (SA tax year: March to Feb).
+    """
+    return ExtractYear(field) - Case(When(**{f'{field}__month__lt': 3}, then=Value(1)), default=Value(0))
+
+
+class PayslipQuerySet(models.QuerySet):
+    YTD_FIELDS = ['basic_salary', 'wages', 'gross_income', 'tax', 'uif', 'sdl', 'net_pay']
+
+    def with_ytd(self):
+        """
+        Annotates <field>_ytd year-to-date totals on every payslip using
+        correlated subqueries, so a single payslip or a whole run can be read
+        with its YTD figures in one query. Payslip.ytd picks them up.
+        """
+        same_tax_year = Payslip.objects.annotate(
+            tax_year_no=tax_year_of('payroll_run__period_start')
+        ).filter(
+            employee=OuterRef('employee'),
+            tax_year_no=OuterRef('tax_year_no'),
+            payroll_run__period_start__lte=OuterRef('payroll_run__period_start'),
+        ).order_by().values('employee')
+
+        totals = {
+            'basic_salary': Sum('basic_salary', filter=Q(employee__is_wage_employee=False)),
+            'wages': Sum('worked_hours__total_earnings', filter=Q(employee__is_wage_employee=True)),
+            'gross_income': Sum('gross_income'),
+            'tax': Sum('tax'),
+            'uif': Sum('uif'),
+            'sdl': Sum('sdl'),
+            'net_pay': Sum('net_pay'),
+        }
+        output_field = DecimalField(max_digits=12, decimal_places=2)
+        return self.annotate(tax_year_no=tax_year_of('payroll_run__period_start')).annotate(**{
+            f'{field}_ytd': Coalesce(
+                Subquery(same_tax_year.annotate(total=total).values('total'), output_field=output_field),
+                Value(Decimal('0.00')),
+                output_field=output_field,
+            )
+            for field, total in totals.items()
+        })
 
 
 class Payslip(models.Model):
@@ -210,6 +387,10 @@ class Payslip(models.Model):
         null=True, blank=True,
         on_delete=models.SET_NULL
     )
+    # Bumped on every save and by the payroll engine's bulk updates
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = PayslipQuerySet.as_manager()
 
     class Meta:
         unique_together = ('employee', 'payroll_run')
@@ -218,109 +399,71 @@ class Payslip(models.Model):
         return f"{self.employee.first_name} {self.employee.last_name} – {self.payroll_run.period_start.strftime('%b %Y')}"
     
     def get_income_total(self):
-        wh = self.worked_hours
-        return (
-            (self.basic_salary or 0) +
-            (wh.normal_earnings if wh else 0) +
-            (wh.overtime_earnings if wh else 0) +
-            (wh.saturday_earnings if wh else 0) +
-            (wh.sunday_earnings if wh else 0)
-        )
+        return (self.basic_salary or 0) + self.get_wages_total()
 
     def get_deductions_total(self):
         return (self.tax or 0) + (self.uif or 0)
     
     def get_wages_total(self):
         wh = self.worked_hours
-        return (
-            (wh.normal_earnings if wh else 0) +
-            (wh.overtime_earnings if wh else 0) +
-            (wh.saturday_earnings if wh else 0) +
-            (wh.sunday_earnings if wh else 0)
-        )
+        return wh.total_earnings if wh else 0
     
+    @property
+    def ytd(self):
+        """
+        Year-to-date running totals as at this payslip. Uses the annotations
+        from Payslip.objects.with_ytd() when present, otherwise reads the
+        YtdTotals ledger, building it for the tax year if it is missing.
+        """
+        if 'gross_income_ytd' in self.__dict__:
+            if '_annotated_ytd' not in self.__dict__:
+                self._annotated_ytd = YtdTotals(
+                    employee_id=self.employee_id,
+                    **{
+                        field: Decimal(getattr(self, f'{field}_ytd')).quantize(Decimal('0.01'))
+                        for field in PayslipQuerySet.YTD_FIELDS
+                    }
+                )
+            return self._annotated_ytd
+        try:
+            return self.ytd_totals
+        except YtdTotals.DoesNotExist:
+            from .services import refresh_ytd_totals
+            refresh_ytd_totals([self.employee_id], self.payroll_run.period_start)
+            self.ytd_totals = YtdTotals.objects.get(payslip=self)
+            return self.ytd_totals
+
     @property
     def ytd_basic_salary(self):
-        if not self.employee.is_wage_employee:
-            start = datetime.date(self.payroll_run.period_start.year, 3, 1)
-            return Payslip.objects.filter(
-                employee=self.employee,
-                payroll_run__period_start__gte=start,
-                payroll_run__period_start__lte=self.payroll_run.period_start
-            ).aggregate(total=Sum('basic_salary'))['total'] or Decimal('0.00')
-        return Decimal('0.00')
+        return self.ytd.basic_salary
     
     @property
     def ytd_wages(self):
-        if self.employee.is_wage_employee:
-            start = datetime.date(self.payroll_run.period_start.year, 3, 1)
-            payslips = Payslip.objects.filter(
-                employee=self.employee,
-                payroll_run__period_start__gte=start,
-                payroll_run__period_start__lte=self.payroll_run.period_start
-            ).select_related('worked_hours')
-
-            total = Decimal('0.00')
-            for slip in payslips:
-                wh = slip.worked_hours
-                if wh:
-                    total += (
-                        wh.normal_earnings +
-                        wh.overtime_earnings +
-                        wh.saturday_earnings +
-                        wh.sunday_earnings
-                    )
-            return total
-        return Decimal('0.00')
+        return self.ytd.wages
     
     @property
     def ytd_net_pay(self):
-        start_of_tax_year = datetime.date(self.payroll_run.period_start.year, 3, 1)
-        return Payslip.objects.filter(
-            employee=self.employee,
-            payroll_run__period_start__gte=start_of_tax_year,
-            payroll_run__period_start__lte=self.payroll_run.period_start
-        ).aggregate(total=Sum('net_pay'))['total'] or Decimal('0.00')
+        return self.ytd.net_pay
     
     @property
     def ytd_gross_income(self):
-        start = datetime.date(self.payroll_run.period_start.year, 3, 1)
-        return Payslip.objects.filter(
-            employee=self.employee,
-            payroll_run__period_start__gte=start,
-            payroll_run__period_start__lte=self.payroll_run.period_start
-        ).aggregate(total=Sum('gross_income'))['total'] or Decimal('0.00')
+        return self.ytd.gross_income
 
     @property
     def ytd_total_deductions(self):
-        return (self.tax or Decimal('0.00')) + (self.uif or Decimal('0.00'))
+        return self.ytd.tax + self.ytd.uif
 
     @property
     def ytd_tax(self):
-        start = datetime.date(self.payroll_run.period_start.year, 3, 1)
-        return Payslip.objects.filter(
-            employee=self.employee,
-            payroll_run__period_start__gte=start,
-            payroll_run__period_start__lte=self.payroll_run.period_start
-        ).aggregate(total=Sum('tax'))['total'] or Decimal('0.00')
+        return self.ytd.tax
     
     @property
     def ytd_uif(self):
-        start = datetime.date(self.payroll_run.period_start.year, 3, 1)
-        return Payslip.objects.filter(
-            employee=self.employee,
-            payroll_run__period_start__gte=start,
-            payroll_run__period_start__lte=self.payroll_run.period_start
-        ).aggregate(total=Sum('uif'))['total'] or Decimal('0.00')
+        return self.ytd.uif
     
     @property
     def ytd_sdl(self):
-        start = datetime.date(self.payroll_run.period_start.year, 3, 1)
-        return Payslip.objects.filter(
-            employee=self.employee,
-            payroll_run__period_start__gte=start,
-            payroll_run__period_start__lte=self.payroll_run.period_start
-        ).aggregate(total=Sum('sdl'))['total'] or Decimal('0.00')
+        return self.ytd.sdl
     
     @property
     def total_employer_contribution(self):
@@ -328,23 +471,14 @@ class Payslip(models.Model):
     
     @property
     def ytd_total_employer_contribution(self):
-        start = datetime.date(self.payroll_run.period_start.year, 3, 1)
-        totals = Payslip.objects.filter(
-            employee=self.employee,
-            payroll_run__period_start__gte=start,
-            payroll_run__period_start__lte=self.payroll_run.period_start
-        ).aggregate(
-            total_sdl=Sum('sdl'),
-            total_uif=Sum('uif')
-        )
-        return (totals['total_sdl'] or Decimal('0.00')) + (totals['total_uif'] or Decimal('0.00'))
+        return self.ytd.sdl + self.ytd.uif
 
     def save(self, *args, **kwargs):
         if self.employee.is_wage_employee:
             try:
                 hours = WorkedHours.objects.get(employee=self.employee, payroll_run=self.payroll_run)
                 self.worked_hours = hours
-                self.gross_income = hours.calculate_gross_pay()
+                self.gross_income = hours.total_earnings
             except WorkedHours.DoesNotExist:
                 self.worked_hours = None
                 self.gross_income = 0
@@ -357,6 +491,152 @@ class Payslip(models.Model):
 
 
 
+class YtdTotals(models.Model):
+    """
+    Running tax-year totals for an employee as at one payslip.
+    Rebuilt for the employee's tax year whenever their payslips are written.
+    """
+    payslip = models.OneToOneField(Payslip, on_delete=models.CASCADE, related_name='ytd_totals')
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE)
+    tax_year = models.CharField(max_length=9)  # e.g., "2024/2025"
+    basic_salary = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    wages = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    gross_income = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    uif = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    sdl = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    net_pay = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "YTD totals"
+        indexes = [models.Index(fields=['employee', 'tax_year'])]
+
+    def __str__(self):
+        return f"YTD {self.tax_year} – {self.payslip}"
+
+
+class RunSummary(models.Model):
+    """
+    Materialized totals for one company's payslips in a payroll run, read by
+    the dashboard. Refreshed whenever the run is calculated or closed.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='run_summaries')
+    payroll_run = models.ForeignKey(PayrollRun, on_delete=models.CASCADE, related_name='summaries')
+    headcount = models.PositiveIntegerField(default=0)
+    gross_income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    uif = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sdl = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    net_pay = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # {department: {'headcount': n, 'gross_income': '...', ...}}
+    departments = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # [{'employee_id': n, 'name': '...', 'gross_income': '...', 'net_pay': '...'}], highest gross first
+    top_earners = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    refreshed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = "run summaries"
+        unique_together = ('company', 'payroll_run')
+
+    def __str__(self):
+        return f"{self.company} – {self.payroll_run}"
+
+
+class RunTotals(models.Model):
+    """
+    Totals over every payslip in a payroll run, read by the payslip summary.
+    Refreshed whenever the run's payslips are calculated or edited, and
+    frozen (``frozen_at`` set) when the run is closed.
+    """
+    payroll_run = models.OneToOneField(PayrollRun, on_delete=models.CASCADE, related_name='totals')
+    headcount = models.PositiveIntegerField(default=0)
+    basic_salary = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Wage earnings, from the payslips' worked hours
+    normal_earnings = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    overtime_earnings = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    saturday_earnings = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sunday_earnings = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    wages = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    gross_income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    uif = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sdl = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    net_pay = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    refreshed_at = models.DateTimeField(default=timezone.now)
+    frozen_at = models.DateTimeField(null=True, blank=True)
+
+    AMOUNT_FIELDS = [
+        'basic_salary', 'normal_earnings', 'overtime_earnings', 'saturday_earnings', 'sunday_earnings', 'wages',
+        'gross_income', 'tax', 'uif', 'sdl', 'net_pay',
+    ]
+
+    class Meta:
+        verbose_name_plural = "run totals"
+
+    def __str__(self):
+        return f"Totals for {self.payroll_run}"
+
+    @property
+    def income_total(self):
+        return self.basic_salary + self.wages
+
+    @property
+    def deductions_total(self):
+        return self.tax + self.uif
+
+
+class RunSnapshot(models.Model):
+    """
+    The compressed columnar file holding every payslip of a closed payroll
+    run as it was closed (see payroll.snapshots). Written once and never
+    changed; ``archived_at`` is set once the run's detailed rows are pruned.
+    """
+    payroll_run = models.OneToOneField(PayrollRun, on_delete=models.CASCADE, related_name='snapshot')
+    path = models.CharField(max_length=255)
+    checksum = models.CharField(max_length=64)  # SHA-256 of the file
+    size = models.PositiveBigIntegerField(default=0)
+    payslip_count = models.PositiveIntegerField(default=0)
+    # Range of the payslip IDs inside
+    first_payslip_id = models.PositiveBigIntegerField(null=True, blank=True)
+    last_payslip_id = models.PositiveBigIntegerField(null=True, blank=True)
+    # Byte offset in the file of each group of rows, so one group can be read on its own
+    group_offsets = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    archived_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Snapshot of {self.payroll_run}"
+
+
+class ArchivedPayslip(models.Model):
+    """
+    Where a pruned payslip is kept: the snapshot of its run and the group of
+    rows it is in, so it can be read without decompressing the whole file.
+    """
+    id = models.PositiveBigIntegerField(primary_key=True)  # The payslip's ID
+    snapshot = models.ForeignKey(RunSnapshot, on_delete=models.CASCADE, related_name='archived_payslips')
+    group = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"Archived payslip {self.pk}"
+
+
+class EmployeeSearchTerm(models.Model):
+    """
+    One word of an employee's names or ID number, for prefix search on
+    databases without SQLite's FTS5 (see payroll.search).
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='+')
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64)
+
+    class Meta:
+        indexes = [models.Index(fields=['company', 'term']), models.Index(fields=['term'])]
+
+    def __str__(self):
+        return self.term
+
+
 class AllowanceType(models.Model):
     """
     Defines a type of allowance (e.g. travel, meal, housing).
@@ -497,6 +777,8 @@ class LeaveBalance(models.Model):
     leave_type = models.CharField(max_length=20, choices=LeaveType.choices)
     total_days = models.DecimalField(max_digits=5, decimal_places=2)
     used_days = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal('0.00'))
+    # Annual leave accrued this cycle, posted by closed payroll runs (see LeaveAccrual)
+    accrued_days = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal('0.00'))
     cycle_start = models.DateField(default=datetime.date.today)
     
     # For maternity/parental leave tracking
@@ -517,102 +799,110 @@ class LeaveBalance(models.Model):
         else:
             return max(Decimal('0.00'), self.total_days - self.used_days)
     
+    # Opening allocation (days) for each leave type
+    DEFAULT_ALLOCATIONS = {
+        LeaveType.ANNUAL: Decimal('17.00'),
+        LeaveType.SICK: Decimal('30.00'),  # 30 days over 3-year cycle
+        LeaveType.FAMILY: Decimal('3.00'),  # 3 days per year
+        LeaveType.MATERNITY: Decimal('0.00'),  # ~4 months (in working days)
+        LeaveType.PARENTAL: Decimal('0.00'),  # 10 days
+        LeaveType.STUDY: Decimal('5.00'),  # 5 days per year
+    }
+
     @classmethod
-    def initialize_leave_for_employee(cls, employee):
-        """Creates default leave balances for a new employee"""
-        leave_allocations = {
-            LeaveType.ANNUAL: Decimal('17.00'),
-            LeaveType.SICK: Decimal('30.00'),  # 30 days over 3-year cycle
-            LeaveType.FAMILY: Decimal('3.00'),  # 3 days per year
-            LeaveType.MATERNITY: Decimal('0.00'),  # ~4 months (in working days)
-            LeaveType.PARENTAL: Decimal('0.00'),  # 10 days
-            LeaveType.STUDY: Decimal('5.00'),  # 5 days per year
-        }
-        
-        for leave_type, allocation in leave_allocations.items():
-            cls.objects.create(
+    def initial_balances(cls, employee):
+        """Unsaved default leave balances for a new employee, for bulk_create"""
+        return [
+            cls(
                 employee=employee,
                 leave_type=leave_type,
                 total_days=allocation,
                 used_days=Decimal('0.00'),
                 cycle_start=employee.date_joined
             )
+            for leave_type, allocation in cls.DEFAULT_ALLOCATIONS.items()
+        ]
+
+    @classmethod
+    def initialize_leave_for_employee(cls, employee):
+        """Creates default leave balances for a new employee"""
+        cls.objects.bulk_create(cls.initial_balances(employee))
+
+    @classmethod
+    def initialize_leave_for_employees(cls, employees, batch_size=1000):
+        """
+        Creates any missing default leave balances for many saved employees
+        with bulk_create. Existing balances are left alone, so this is safe
+        to run again.
+        """
+        balances = [balance for employee in employees for balance in cls.initial_balances(employee)]
+        cls.objects.bulk_create(balances, batch_size=batch_size, ignore_conflicts=True)
+
+    # Annual leave accrued per month worked (17 days / 12 months)
+    MONTHLY_ANNUAL_ACCRUAL = Decimal('1.42')
 
     def calculate_annual_leave_accrued(self):
         """
-        Calculates accrued annual leave based on South African regulations.
-        Annual leave accrues at approximately 1.42 days per month (17 days per year).
+        Annual leave accrued so far this cycle, as posted by closed payroll
+        runs and capped at the cycle's allocation.
         """
         if self.leave_type != LeaveType.ANNUAL:
             return self.total_days
-            
-        today = datetime.date.today()
-        
-        # Calculate full months worked since cycle start
-        full_months = (today.year - self.cycle_start.year) * 12 + (today.month - self.cycle_start.month)
-        
-        # Calculate the fraction of the current month
-        days_in_month = calendar.monthrange(today.year, today.month)[1]  # Accurate days in the month
-        
-        # For employees who started in current month
-        if full_months == 0:
-            days_worked_in_first_month = today.day - self.cycle_start.day + 1  # +1 to include the start day
-            month_fraction = Decimal(str(max(0, days_worked_in_first_month) / days_in_month))
-        else:
-            # For employees with at least one full month, calculate the fraction of the current month
-            month_fraction = Decimal(str(today.day / days_in_month))
-        
-        # Calculate total months including fraction
-        total_months = Decimal(str(full_months)) + month_fraction
-        
-        # Monthly accrual rate (17 days / 12 months)
-        monthly_accrual = Decimal('1.42')
-        
-        # Calculate total accrued leave, ensuring we don't exceed the total allocation
-        accrued = min(total_months * monthly_accrual, self.total_days)
-        
-        # Debug print to check calculations (remove in production)
-        print(f"Employee: {self.employee}, Start: {self.cycle_start}, Full months: {full_months}, "
-            f"Month fraction: {month_fraction}, Total months: {total_months}, Accrued: {accrued}")
-        
-        return max(Decimal('0.00'), accrued)
+        return max(Decimal('0.00'), min(self.accrued_days, self.total_days))
+
+    # Years in each leave type's cycle (BCEA). Maternity and parental leave
+    # don't reset on cycles: they're event-based.
+    CYCLE_YEARS = {
+        LeaveType.ANNUAL: 1,
+        LeaveType.SICK: 3,  # 30 days over 3 years
+        LeaveType.FAMILY: 1,
+        LeaveType.STUDY: 1,
+    }
+
+    @staticmethod
+    def cycle_due_before(today, years):
+        """Latest cycle start that has run for ``years`` full years by ``today``."""
+        try:
+            return today.replace(year=today.year - years)
+        except ValueError:  # 29 February
+            return today.replace(year=today.year - years, day=28)
 
     def reset_cycle(self):
         """
         Resets leave based on South African BCEA requirements for each leave type.
         """
         today = datetime.date.today()
+        years = self.CYCLE_YEARS.get(self.leave_type)
+        if years and self.cycle_start <= self.cycle_due_before(today, years):
+            self.total_days = self.DEFAULT_ALLOCATIONS[self.leave_type]
+            self.used_days = Decimal('0.00')
+            self.accrued_days = Decimal('0.00')
+            self.cycle_start = today
+            self.save()
 
-        if self.leave_type == LeaveType.ANNUAL:
-            if today >= self.cycle_start.replace(year=self.cycle_start.year + 1):
-                self.total_days = Decimal('17.00')  # Standard reset
-                self.used_days = Decimal('0.00')
-                self.cycle_start = today
-                self.save()
-
-        elif self.leave_type == LeaveType.SICK:
-            if today >= self.cycle_start.replace(year=self.cycle_start.year + 3):
-                self.total_days = Decimal('30.00')  # 30 days over 3 years
-                self.used_days = Decimal('0.00')
-                self.cycle_start = today
-                self.save()
-                
-        elif self.leave_type == LeaveType.FAMILY:
-            if today >= self.cycle_start.replace(year=self.cycle_start.year + 1):
-                self.total_days = Decimal('3.00')  # 3 days per year
-                self.used_days = Decimal('0.00')
-                self.cycle_start = today
-                self.save()
-                
-        elif self.leave_type == LeaveType.STUDY:
-            if today >= self.cycle_start.replace(year=self.cycle_start.year + 1):
-                self.total_days = Decimal('5.00')  # 5 days per year as specified
-                self.used_days = Decimal('0.00')
-                self.cycle_start = today
-                self.save()
-        
-        # Maternity and Parental leave don't reset on cycles
-        # They're event-based and should be handled differently
+    @classmethod
+    def roll_over_cycles(cls, today=None, dry_run=False):
+        """
+        Resets every balance whose cycle has run its course, as reset_cycle
+        does, with one UPDATE per leave type. Rolled-over cycles start on
+        ``today``, so running it again the same day changes nothing.
+        Returns the number of balances reset per leave type.
+        """
+        today = today or datetime.date.today()
+        counts = {}
+        with transaction.atomic():
+            for leave_type, years in cls.CYCLE_YEARS.items():
+                due = cls.objects.filter(leave_type=leave_type, cycle_start__lte=cls.cycle_due_before(today, years))
+                if dry_run:
+                    counts[leave_type] = due.count()
+                else:
+                    counts[leave_type] = due.update(
+                        total_days=cls.DEFAULT_ALLOCATIONS[leave_type],
+                        used_days=Decimal('0.00'),
+                        accrued_days=Decimal('0.00'),
+                        cycle_start=today,
+                    )
+        return counts
 
     @property
     def leave_summary(self):
@@ -628,6 +918,32 @@ class LeaveBalance(models.Model):
         }
 
 
+class LeaveAccrual(models.Model):
+    """
+    Annual leave accrued by an employee in one payroll run, posted when the
+    run closes. Keeps the running totals as at that run, so past balances
+    can be read without recalculating.
+    """
+    leave_balance = models.ForeignKey(LeaveBalance, on_delete=models.CASCADE, related_name='accruals')
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE)
+    payroll_run = models.ForeignKey(PayrollRun, on_delete=models.CASCADE, related_name='leave_accruals')
+    days = models.DecimalField(max_digits=5, decimal_places=2)
+    # Balance totals after this posting
+    accrued_days = models.DecimalField(max_digits=5, decimal_places=2)
+    used_days = models.DecimalField(max_digits=5, decimal_places=2)
+    posted_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('leave_balance', 'payroll_run')
+
+    def __str__(self):
+        return f"{self.employee} – {self.days} days accrued in {self.payroll_run}"
+
+    @property
+    def remaining_days(self):
+        return max(Decimal('0.00'), self.accrued_days - self.used_days)
+
+
 class LeaveRequest(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -0,0 +1,139 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are found by filtering past the last row of the previous page on a
+unique ordering such as (last_name, first_name, id), so every page costs
+the same and no COUNT(*) is run. Positions are handed out as signed,
+opaque cursor tokens. Listings opt in with a ``cursor`` query parameter;
+without it they keep Django's numbered Paginator.
+"""
+import json
+
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+CURSOR_SALT = 'payroll.pagination'
+
+
+def _after(ordering, values, reverse=False):
+    """Q for rows after ``values`` on ``ordering`` (ascending fields), or before with ``reverse``."""
+    lookup = 'lt' if reverse else 'gt'
+    condition = Q()
+    for index, field in enumerate(ordering):
+        step = Q(**{f'{field}__{lookup}': values[index]})
+        for previous, value in zip(ordering[:index], values[:index]):
+            step &= Q(**{previous: value})
+        condition |= step
+    return condition
+
+
+class CursorSerializer(signing.JSONSerializer):
+    """Writes dates and decimals as strings, which the ordering fields' lookups read back."""
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'), cls=DjangoJSONEncoder).encode('latin-1')
+
+
+def encode_cursor(values, reverse=False):
+    return signing.dumps([reverse, list(values)], salt=CURSOR_SALT, serializer=CursorSerializer, compress=True)
+
+
+def decode_cursor(token):
+    """Returns (values, reverse), or (None, False) for a missing or tampered token."""
+    try:
+        reverse, values = signing.loads(token, salt=CURSOR_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None, False
+    return values, bool(reverse)
+
+
+class CursorPage:
+    is_cursor = True
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator:
+    """
+    Splits ``queryset`` into pages of ``per_page`` rows ordered by
+    ``ordering``, a sequence of ascending field paths ending in a unique one.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = list(ordering)
+
+    def _key(self, row):
+        values = []
+        for field in self.ordering:
+            value = row
+            for part in field.split('__'):
+                value = getattr(value, part)
+            values.append(value)
+        return values
+
+    def get_page(self, cursor=None):
+        values, reverse = decode_cursor(cursor) if cursor else (None, False)
+        if values is not None and len(values) != len(self.ordering):
+            values, reverse = None, False
+
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(_after(self.ordering, values, reverse))
+        if reverse:
+            queryset = queryset.order_by(*(f'-{field}' for field in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        # One extra row tells whether there is another page in this direction
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        first = encode_cursor(self._key(rows[0]), reverse=True) if rows else None
+        last = encode_cursor(self._key(rows[-1])) if rows else None
+        if reverse:
+            next_cursor, previous_cursor = last, first if more else None
+        else:
+            next_cursor, previous_cursor = last if more else None, first if values is not None else None
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+
+def paginate(request, queryset, per_page, ordering):
+    """
+    A page of ``queryset`` for a listing view: a CursorPage when the request
+    has a ``cursor`` parameter (empty for the first page), otherwise a
+    numbered Paginator page from ``page``. Cursor pages carry
+    ``next_query`` and ``previous_query``, the request's query string with
+    the cursor moved, for building links.
+    """
+    queryset = queryset.order_by(*ordering)
+    if 'cursor' not in request.GET:
+        return Paginator(queryset, per_page).get_page(request.GET.get('page'))
+
+    page = CursorPaginator(queryset, per_page, ordering).get_page(request.GET.get('cursor'))
+    for name, cursor in (('next_query', page.next_cursor), ('previous_query', page.previous_cursor)):
+        params = request.GET.copy()
+        params['cursor'] = cursor or ''
+        setattr(page, name, params.urlencode())
+    return page
@@ -0,0 +1,319 @@
+"""
+Batch payslip PDF rendering.
+
+PDFs are drawn with ReportLab (an optional dependency) from plain payslip
+data, so a whole run can be rendered across a process pool. Each worker
+registers fonts and builds its layout once. Runs are streamed back as ZIP
+archives, and PDFs of closed runs are cached in default storage.
+"""
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .models import Payslip
+from .snapshots import closed_run_snapshot, snapshot_payslips
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:  # pragma: no cover
+    canvas = None
+
+
+# Payslips handed to the render pool at a time, which bounds memory use
+RENDER_BATCH_SIZE = 200
+
+# Fonts, page geometry etc., set up once per process by load_resources()
+_resources = None
+
+
+def load_resources(fonts=None):
+    """
+    Registers fonts and prepares layout constants for this process.
+    ``fonts`` may map 'regular' and 'bold' to TTF file paths (default:
+    settings.PAYSLIP_PDF_FONTS); the built-in Helvetica is used otherwise.
+    """
+    global _resources
+    if canvas is None:
+        raise ImproperlyConfigured("Payslip PDFs require ReportLab (pip install reportlab).")
+    if fonts is None:
+        fonts = getattr(settings, 'PAYSLIP_PDF_FONTS', None) or {}
+
+    regular, bold = 'Helvetica', 'Helvetica-Bold'
+    if fonts.get('regular'):
+        pdfmetrics.registerFont(TTFont('PayslipRegular', fonts['regular']))
+        regular = 'PayslipRegular'
+    if fonts.get('bold'):
+        pdfmetrics.registerFont(TTFont('PayslipBold', fonts['bold']))
+        bold = 'PayslipBold'
+
+    width, height = A4
+    _resources = {
+        'regular': regular,
+        'bold': bold,
+        'page': A4,
+        'left': 20 * mm,
+        'right': width - 20 * mm,
+        'top': height - 20 * mm,
+        'line': 6 * mm,
+    }
+    return _resources
+
+
+def _init_worker(fonts):
+    django.setup()
+    load_resources(fonts)
+
+
+def _money(value):
+    return f"R{Decimal(value or 0):,.2f}"
+
+
+def payslip_pdf_data(payslip):
+    """
+    Plain data needed to draw a payslip. ``payslip`` should come from
+    Payslip.objects.with_ytd() with employee, company and worked hours
+    selected, so no further queries are made.
+    """
+    employee = payslip.employee
+    wh = payslip.worked_hours
+    return {
+        'payslip_id': payslip.pk,
+        'company': employee.company.name,
+        'period_start': payslip.payroll_run.period_start.isoformat(),
+        'period_end': payslip.payroll_run.period_end.isoformat(),
+        'employee_id': employee.pk,
+        'first_name': employee.first_name,
+        'last_name': employee.last_name,
+        'id_number': employee.id_number,
+        'tax_number': employee.tax_number or '',
+        'job_title': employee.job_title or '',
+        'date_joined': employee.date_joined.strftime('%d %b %Y'),
+        'income': [
+            ('Basic Salary', payslip.basic_salary, payslip.ytd_basic_salary),
+            ('Wages', payslip.get_wages_total(), payslip.ytd_wages),
+        ],
+        'gross': (payslip.get_income_total(), payslip.ytd_gross_income),
+        'deductions': [
+            ('UIF - Employee', payslip.uif, payslip.ytd_uif),
+            ('Tax (PAYE)', payslip.tax, payslip.ytd_tax),
+        ],
+        'total_deductions': (payslip.get_deductions_total(), payslip.ytd_total_deductions),
+        'net_pay': (payslip.net_pay, payslip.ytd_net_pay),
+        'employer': [
+            ('SDL - Employer', payslip.sdl, payslip.ytd_sdl),
+            ('UIF - Employer', payslip.uif, payslip.ytd_uif),
+        ],
+        'total_employer': (payslip.total_employer_contribution, payslip.ytd_total_employer_contribution),
+        'hours': [
+            ('Normal', wh.normal_hours if wh else 0),
+            ('Overtime', wh.overtime_hours if wh else 0),
+            ('Saturday', wh.saturday_hours if wh else 0),
+            ('Sunday/Public Holiday', wh.sunday_public_hours if wh else 0),
+        ],
+    }
+
+
+def render_payslip_pdf(data):
+    """Draws one payslip from payslip_pdf_data() and returns the PDF bytes."""
+    res = _resources or load_resources()
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=res['page'])
+    pdf.setTitle(f"Payslip {data['last_name']}, {data['first_name']} {data['period_start']}")
+    left, right, line = res['left'], res['right'], res['line']
+    current_col, ytd_col = right - 45 * mm, right
+    y = res['top']
+
+    def text(x, value, bold=False, size=10, align='left'):
+        pdf.setFont(res['bold'] if bold else res['regular'], size)
+        if align == 'right':
+            pdf.drawRightString(x, y, str(value))
+        else:
+            pdf.drawString(x, y, str(value))
+
+    def section(title):
+        nonlocal y
+        y -= line
+        text(left, title, bold=True, size=12)
+        text(current_col, 'Current', bold=True, align='right')
+        text(ytd_col, 'YTD', bold=True, align='right')
+        y -= 2
+        pdf.line(left, y - 2, right, y - 2)
+        y -= line
+
+    def row(label, current, ytd, bold=False):
+        nonlocal y
+        text(left, label, bold=bold)
+        text(current_col, _money(current), bold=bold, align='right')
+        text(ytd_col, _money(ytd), bold=bold, align='right')
+        y -= line
+
+    text(left, data['company'], bold=True, size=16)
+    text(right, 'PAYSLIP', bold=True, size=16, align='right')
+    y -= line
+    text(right, f"Period: {data['period_start']} to {data['period_end']}", align='right')
+    y -= line * 1.5
+
+    for label, value in [
+        ('Name', f"{data['last_name']}, {data['first_name']}"),
+        ('ID No.', data['id_number']),
+        ('Employee No.', data['employee_id']),
+        ('Job Title', data['job_title']),
+        ('Income Tax Number', data['tax_number']),
+        ('Employment Date', data['date_joined']),
+    ]:
+        text(left, f"{label}:", bold=True)
+        text(left + 45 * mm, value)
+        y -= line
+
+    section('Income')
+    for label, current, ytd in data['income']:
+        row(label, current, ytd)
+    row('Gross Earnings', *data['gross'], bold=True)
+
+    section('Deductions')
+    for label, current, ytd in data['deductions']:
+        row(label, current, ytd)
+    row('Total Deductions', *data['total_deductions'], bold=True)
+
+    y -= line / 2
+    row('Net Pay', *data['net_pay'], bold=True)
+
+    section('Employer Contributions')
+    for label, current, ytd in data['employer']:
+        row(label, current, ytd)
+    row('Total Employer Contributions', *data['total_employer'], bold=True)
+
+    y -= line
+    text(left, 'Hours', bold=True, size=12)
+    y -= line
+    for label, hours in data['hours']:
+        text(left, label)
+        text(current_col, hours or 0, align='right')
+        y -= line
+
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def payslip_pdf_filename(data):
+    name = re.sub(r'[^A-Za-z0-9]+', '_', f"{data['last_name']}_{data['first_name']}").strip('_')
+    return f"{data['period_start'][:7]}_{name}_{data['employee_id']}.pdf"
+
+
+def cached_pdf_path(payroll_run_id, payslip_id):
+    return f"payslip_pdfs/run_{payroll_run_id}/{payslip_id}.pdf"
+
+
+def pdf_payslips():
+    """Payslips with everything payslip_pdf_data() reads, in one query."""
+    return Payslip.objects.with_ytd().select_related('employee__company', 'payroll_run', 'worked_hours')
+
+
+def iter_run_pdfs(payroll_run, company=None, workers=None):
+    """
+    Yields (filename, pdf bytes) for every payslip in a run, optionally
+    limited to one company, rendering in batches across ``workers``
+    processes (default: settings.PAYROLL_WORKERS).
+    Closed runs are read from their snapshot, and their PDFs from, and
+    saved to, the storage cache.
+    """
+    if workers is None:
+        workers = getattr(settings, 'PAYROLL_WORKERS', 1)
+    use_cache = payroll_run.is_closed
+    executor = None
+    if workers > 1:
+        fonts = getattr(settings, 'PAYSLIP_PDF_FONTS', None) or {}
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(fonts,))
+
+    def render_batch(batch):
+        to_render = []
+        cached = {}
+        for data in batch:
+            path = cached_pdf_path(payroll_run.pk, data['payslip_id'])
+            if use_cache and default_storage.exists(path):
+                with default_storage.open(path, 'rb') as f:
+                    cached[data['payslip_id']] = f.read()
+            else:
+                to_render.append(data)
+
+        if executor is not None:
+            rendered = executor.map(render_payslip_pdf, to_render, chunksize=8)
+        else:
+            rendered = map(render_payslip_pdf, to_render)
+        for data, pdf in zip(to_render, rendered):
+            cached[data['payslip_id']] = pdf
+            if use_cache:
+                default_storage.save(cached_pdf_path(payroll_run.pk, data['payslip_id']), ContentFile(pdf))
+
+        for data in batch:
+            yield payslip_pdf_filename(data), cached[data['payslip_id']]
+
+    try:
+        batch = []
+        snapshot = closed_run_snapshot(payroll_run)
+        if snapshot is not None:
+            payslips = snapshot_payslips(snapshot, company)
+        else:
+            payslips = pdf_payslips().filter(payroll_run=payroll_run).order_by(
+                'employee__last_name', 'employee__first_name', 'id'
+            )
+            if company is not None:
+                payslips = payslips.filter(employee__company=company)
+            payslips = payslips.iterator(chunk_size=RENDER_BATCH_SIZE)
+        for payslip in payslips:
+            batch.append(payslip_pdf_data(payslip))
+            if len(batch) >= RENDER_BATCH_SIZE:
+                yield from render_batch(batch)
+                batch = []
+        if batch:
+            yield from render_batch(batch)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+class ZipStream:
+    """Write-only file object that hands back whatever was written since the last read."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read_written(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files):
+    """
+    Yields a ZIP archive of (filename, bytes) pairs chunk by chunk. The
+    archive is written to an unseekable stream, so only the current file
+    is ever held in memory.
+    """
+    stream = ZipStream()
+    # PDFs are already compressed, so storing them is nearly as small and much faster
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for filename, data in files:
+            archive.writestr(filename, data)
+            yield stream.read_written()
+    yield stream.read_written()
@@ -0,0 +1,105 @@
+"""
+Query counting and per-view query budgets.
+
+QueryRecorder counts the SQL queries run on every database connection,
+and the time they take, through Django's execute wrappers, so it works
+with DEBUG off. QueryBudgetMiddleware uses it for each request; the
+helpers at the bottom are for tests.
+
+Budgets are set per URL name in settings.PAYROLL_QUERY_BUDGETS, with
+settings.PAYROLL_QUERY_BUDGET for every other view (None: no budget).
+Streamed responses (CSV exports, PDF ZIPs) run most of their queries
+after the view returns, while the body is read, so their counts are
+flagged as incomplete rather than checked against a budget.
+"""
+import time
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connections
+
+
+class QueryRecorder:
+    """Context manager counting the queries, and their time, on all connections while it is active."""
+
+    def __init__(self, record_sql=False):
+        self.count = 0
+        self.duration = 0.0
+        self.record_sql = record_sql
+        self.queries = []
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+            if self.record_sql:
+                self.queries.append(sql)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        return False
+
+
+@dataclass
+class QueryStats:
+    view: str
+    count: int
+    duration: float  # seconds
+    budget: int = None
+    # The response was streamed: ``count`` misses the queries run while reading it
+    streaming: bool = False
+
+    @property
+    def over_budget(self):
+        return not self.streaming and self.budget is not None and self.count > self.budget
+
+
+def query_budget(view_name):
+    """The most queries ``view_name`` (a URL name) should run, or None for no limit."""
+    budgets = getattr(settings, 'PAYROLL_QUERY_BUDGETS', {})
+    if view_name in budgets:
+        return budgets[view_name]
+    return getattr(settings, 'PAYROLL_QUERY_BUDGET', None)
+
+
+def _failure(label, count, budget, queries):
+    listing = '\n'.join(f"{number}. {sql}" for number, sql in enumerate(queries, start=1))
+    return f"{label} ran {count} queries, over its budget of {budget}:\n{listing}"
+
+
+@contextmanager
+def assert_max_queries(max_queries, label="Block"):
+    """
+    Fails with the SQL that ran if the block runs more than ``max_queries``
+    queries. Yields the QueryRecorder.
+    """
+    with QueryRecorder(record_sql=True) as recorder:
+        yield recorder
+    if recorder.count > max_queries:
+        raise AssertionError(_failure(label, recorder.count, max_queries, recorder.queries))
+
+
+def assert_within_budget(response):
+    """Fails if the view behind a test client response ran more queries than its budget."""
+    stats = getattr(response, 'query_stats', None)
+    if stats is None:
+        raise AssertionError("The response has no query stats; is QueryBudgetMiddleware installed?")
+    if stats.streaming:
+        raise AssertionError(
+            f"{stats.view} streamed its response, so its queries can't be counted by the middleware; "
+            f"read the body inside assert_max_queries instead"
+        )
+    if stats.over_budget:
+        raise AssertionError(f"{stats.view} ran {stats.count} queries, over its budget of {stats.budget}")
+    return stats
@@ -0,0 +1,129 @@
+"""
+Employee search index.
+
+Names and ID numbers are indexed as lower-case words, so the search boxes
+match word prefixes without scanning the employee table. On SQLite the
+index is an FTS5 table; on other databases it is EmployeeSearchTerm,
+searched with one indexed range scan per word. The index is kept up to date
+by the Employee signals, and by bulk imports, which send none.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Employee, EmployeeSearchTerm
+
+FTS_TABLE = 'payroll_employee_fts'
+
+# Employees written to the index per statement
+INDEX_BATCH_SIZE = 900
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def search_words(text):
+    """Lower-case words in ``text`` with accents removed, as FTS5's unicode61 tokenizer splits them."""
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    max_length = EmployeeSearchTerm._meta.get_field('term').max_length
+    return [word[:max_length] for word in _WORD.findall(text)]
+
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def _company_token(company_id):
+    return f"c{company_id}"
+
+
+def _chunks(items, size=INDEX_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def remove_from_index(employee_ids):
+    employee_ids = list(employee_ids)
+    if uses_fts():
+        with connection.cursor() as cursor:
+            for chunk in _chunks(employee_ids):
+                cursor.execute(
+                    f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(chunk))})", chunk
+                )
+    else:
+        EmployeeSearchTerm.objects.filter(employee_id__in=employee_ids).delete()
+
+
+def index_employees(employees):
+    """(Re)indexes saved Employee instances, replacing any earlier entries."""
+    employees = list(employees)
+    if not employees:
+        return
+    remove_from_index([employee.pk for employee in employees])
+
+    if uses_fts():
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, company, first_name, last_name, id_number) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [
+                    (employee.pk, _company_token(employee.company_id),
+                     employee.first_name, employee.last_name, employee.id_number)
+                    for employee in employees
+                ],
+            )
+    else:
+        EmployeeSearchTerm.objects.bulk_create([
+            EmployeeSearchTerm(company_id=employee.company_id, employee_id=employee.pk, term=word)
+            for employee in employees
+            for word in set(search_words(f"{employee.first_name} {employee.last_name} {employee.id_number}"))
+        ], batch_size=INDEX_BATCH_SIZE)
+
+
+def rebuild_index():
+    """Indexes every employee from scratch. Returns the number indexed."""
+    if uses_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+    else:
+        EmployeeSearchTerm.objects.all().delete()
+
+    count = 0
+    batch = []
+    employees = Employee.objects.only('id', 'company_id', 'first_name', 'last_name', 'id_number')
+    for employee in employees.iterator(chunk_size=2000):
+        batch.append(employee)
+        if len(batch) >= INDEX_BATCH_SIZE:
+            index_employees(batch)
+            count += len(batch)
+            batch = []
+    index_employees(batch)
+    return count + len(batch)
+
+
+def matching_employee_ids(query, company_id=None):
+    """
+    Subquery of the ids of employees, optionally in one company, with a
+    word starting with each word of ``query``, for use with ``__in``.
+    """
+    words = search_words(query)
+    if not words:
+        return Employee.objects.none().values('id')
+
+    if uses_fts():
+        # Words are quoted, so nothing in the query is read as FTS syntax
+        match = ' AND '.join(f'{{first_name last_name id_number}} : "{word}"*' for word in words)
+        if company_id is not None:
+            match = f'company : "{_company_token(company_id)}" AND {match}'
+        return RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+
+    employees = Employee.objects.all()
+    for word in words:
+        # A range scan on the term index finds every word with this prefix
+        terms = EmployeeSearchTerm.objects.filter(term__gte=word, term__lt=word + '\U0010ffff')
+        if company_id is not None:
+            terms = terms.filter(company_id=company_id)
+        employees = employees.filter(id__in=terms.values('employee_id'))
+    return employees.values('id')
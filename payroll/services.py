@@ -0,0 +1,612 @@
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import groupby
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+import django
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum, Value, Window
+from django.db.models.functions import Coalesce, Round, RowNumber
+from django.utils import timezone
+
+from .models import (
+    DirtyPayslip, Employee, LeaveAccrual, LeaveBalance, LeaveType, Payslip, PayrollRun, PayslipQuerySet, RunSnapshot,
+    RunSummary, RunTotals, WorkedHours, YtdTotals,
+)
+from .utils import get_tax_table
+
+
+UIF_CEILING = Decimal('17712.00')
+UIF_RATE = Decimal('0.01')
+SDL_RATE = Decimal('0.01')
+
+PRIMARY_REBATE = Decimal('17235.00')
+SECONDARY_REBATE = Decimal('9444.00')  # 65 and older
+TERTIARY_REBATE = Decimal('3145.00')  # 75 and older
+
+CENTS = Decimal('0.01')
+
+# Payslips calculated between progress callbacks on the serial path
+PROGRESS_BATCH_SIZE = 500
+
+# Highest earners kept per company on each RunSummary
+TOP_EARNERS = 10
+SUMMARY_FIELDS = ['gross_income', 'tax', 'uif', 'sdl', 'net_pay']
+
+PAYSLIP_FIELDS = ['basic_salary', 'gross_income', 'tax', 'uif', 'sdl', 'net_pay', 'worked_hours']
+YTD_FIELDS = PayslipQuerySet.YTD_FIELDS
+
+
+def get_month_bounds(dt):
+    start = dt.replace(day=1)
+    if dt.month == 12:
+        end = dt.replace(day=31)
+    else:
+        next_month = dt.replace(day=28) + timedelta(days=4)
+        end = next_month.replace(day=1) - timedelta(days=1)
+    return start, end
+
+
+def get_payroll_run_for(dt):
+    """Returns the monthly PayrollRun covering ``dt``, creating it if needed."""
+    period_start, period_end = get_month_bounds(dt)
+    payroll_run, _ = PayrollRun.objects.get_or_create(
+        period_start=period_start,
+        period_end=period_end
+    )
+    return payroll_run
+
+
+def tax_year_start(period_start):
+    # SA tax year: March to Feb
+    year = period_start.year if period_start.month >= 3 else period_start.year - 1
+    return datetime.date(year, 3, 1)
+
+
+def tax_year_label(period_start):
+    start = tax_year_start(period_start)
+    return f"{start.year}/{start.year + 1}"
+
+
+def rebate_for_age(age):
+    rebate = PRIMARY_REBATE
+    if age >= 65:
+        rebate += SECONDARY_REBATE
+    if age >= 75:
+        rebate += TERTIARY_REBATE
+    return rebate
+
+
+@dataclass(frozen=True)
+class PayslipInput:
+    """
+    Everything needed to calculate one employee's payslip, as plain data.
+    """
+    employee_id: int
+    company_id: int
+    is_wage_employee: bool
+    salary: Decimal
+    wage_gross: Decimal
+    age: int
+    ytd_income: Decimal
+    months_paid: int
+
+
+@dataclass(frozen=True)
+class PayslipResult:
+    employee_id: int
+    basic_salary: Decimal
+    gross_income: Decimal
+    tax: Decimal
+    uif: Decimal
+    sdl: Decimal
+    net_pay: Decimal
+
+
+def gross_income_for(data):
+    gross_income = data.wage_gross if data.is_wage_employee else data.salary
+    return gross_income.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def calculate_payslip(data, tax_table):
+    """
+    Calculates a single payslip from a PayslipInput. Pure function: no queries.
+    """
+    gross_income = gross_income_for(data)
+
+    # Annualise YTD income (excluding this month) plus this month
+    months_paid = data.months_paid + 1
+    annualized_income = (data.ytd_income + gross_income) / months_paid * 12
+
+    annual_tax = tax_table.calculate(annualized_income, rebate_for_age(data.age))
+    tax = (annual_tax / 12).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+    uif = (min(gross_income, UIF_CEILING) * UIF_RATE).quantize(CENTS, rounding=ROUND_HALF_UP)
+    sdl = (gross_income * SDL_RATE).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+    return PayslipResult(
+        employee_id=data.employee_id,
+        basic_salary=None if data.is_wage_employee else gross_income,
+        gross_income=gross_income,
+        tax=tax,
+        uif=uif,
+        sdl=sdl,
+        net_pay=gross_income - tax - uif - sdl,
+    )
+
+
+def load_payslip_inputs(payroll_run, employees):
+    """
+    Loads the inputs for every employee in ``employees`` with a fixed number
+    of queries. Returns (inputs, worked_hours by employee id).
+    """
+    employees = list(employees.only('id', 'company_id', 'id_number', 'salary', 'hourly_rate', 'is_wage_employee'))
+    employee_ids = [e.id for e in employees]
+
+    worked_hours = {
+        wh.employee_id: wh
+        for wh in WorkedHours.objects.filter(payroll_run=payroll_run, employee_id__in=employee_ids)
+    }
+
+    ytd = {
+        row['employee_id']: row
+        for row in Payslip.objects.filter(
+            employee_id__in=employee_ids,
+            payroll_run__period_start__gte=tax_year_start(payroll_run.period_start),
+            payroll_run__period_start__lt=payroll_run.period_start
+        ).values('employee_id').annotate(total=Sum('gross_income'), months=Count('id'))
+    }
+
+    inputs = []
+    for employee in employees:
+        wage_gross = Decimal('0.00')
+        if employee.is_wage_employee:
+            wh = worked_hours.get(employee.id)
+            if wh is None:
+                # Saved with the payslips so the hours can be filled in later
+                wh = worked_hours[employee.id] = WorkedHours(employee_id=employee.id, payroll_run=payroll_run)
+            wh.employee = employee
+            wage_gross = wh.calculate_earnings(employee.hourly_rate)
+        row = ytd.get(employee.id, {})
+        inputs.append(PayslipInput(
+            employee_id=employee.id,
+            company_id=employee.company_id,
+            is_wage_employee=employee.is_wage_employee,
+            salary=employee.salary or Decimal('0.00'),
+            wage_gross=Decimal(wage_gross),
+            age=employee.age or 0,
+            ytd_income=Decimal(row.get('total') or 0).quantize(CENTS, rounding=ROUND_HALF_UP),
+            months_paid=row.get('months', 0),
+        ))
+    return inputs, worked_hours
+
+
+def save_payslips(payroll_run, results, worked_hours):
+    """
+    Persists calculated payslips for a run in bulk, along with the earnings
+    recorded on wage employees' WorkedHours. Wage employees without hours for
+    the run get an empty WorkedHours row so they can be edited.
+    Returns (created, updated) counts.
+    """
+    wage_ids = [r.employee_id for r in results if r.basic_salary is None]
+    with transaction.atomic():
+        missing, calculated = [], []
+        for employee_id in wage_ids:
+            wh = worked_hours.get(employee_id)
+            if wh is None:
+                wh = worked_hours[employee_id] = WorkedHours(employee_id=employee_id, payroll_run=payroll_run)
+            if wh.pk is None:
+                missing.append(wh)
+            else:
+                wh.version = F('version') + 1
+                calculated.append(wh)
+        WorkedHours.objects.bulk_update(calculated, WorkedHours.EARNINGS_FIELDS + ['version'], batch_size=500)
+        if missing:
+            WorkedHours.objects.bulk_create(missing)
+            # Re-read so primary keys are available on every backend
+            worked_hours.update({
+                wh.employee_id: wh
+                for wh in WorkedHours.objects.filter(
+                    payroll_run=payroll_run,
+                    employee_id__in=[wh.employee_id for wh in missing]
+                )
+            })
+
+        existing = {
+            p.employee_id: p
+            for p in Payslip.objects.filter(
+                payroll_run=payroll_run,
+                employee_id__in=[r.employee_id for r in results]
+            )
+        }
+
+        to_create, to_update = [], []
+        for result in results:
+            payslip = existing.get(result.employee_id)
+            if payslip is None:
+                payslip = Payslip(employee_id=result.employee_id, payroll_run=payroll_run)
+                to_create.append(payslip)
+            else:
+                payslip.version = F('version') + 1
+                to_update.append(payslip)
+            payslip.basic_salary = result.basic_salary
+            payslip.gross_income = result.gross_income
+            payslip.tax = result.tax
+            payslip.uif = result.uif
+            payslip.sdl = result.sdl
+            payslip.net_pay = result.net_pay
+            payslip.worked_hours = worked_hours.get(result.employee_id) if result.basic_salary is None else None
+
+        Payslip.objects.bulk_create(to_create, batch_size=500)
+        Payslip.objects.bulk_update(to_update, PAYSLIP_FIELDS + ['version'], batch_size=500)
+
+        refresh_ytd_totals([r.employee_id for r in results], payroll_run.period_start)
+
+    return len(to_create), len(to_update)
+
+
+def refresh_ytd_totals(employee_ids, period_start):
+    """
+    Rebuilds the YtdTotals ledger rows of ``employee_ids`` for the tax year
+    containing ``period_start``, with one read and one bulk upsert.
+    """
+    start = tax_year_start(period_start)
+    payslips = Payslip.objects.filter(
+        employee_id__in=employee_ids,
+        payroll_run__period_start__gte=start,
+        payroll_run__period_start__lt=start.replace(year=start.year + 1)
+    ).select_related('employee', 'worked_hours').order_by('employee_id', 'payroll_run__period_start', 'id')
+
+    rows = []
+    running = None
+    employee_id = None
+    for payslip in payslips:
+        if payslip.employee_id != employee_id:
+            employee_id = payslip.employee_id
+            running = dict.fromkeys(YTD_FIELDS, Decimal('0.00'))
+
+        if payslip.employee.is_wage_employee:
+            if payslip.worked_hours is not None:
+                running['wages'] += payslip.worked_hours.total_earnings
+        else:
+            running['basic_salary'] += payslip.basic_salary or 0
+        running['gross_income'] += payslip.gross_income or 0
+        running['tax'] += payslip.tax or 0
+        running['uif'] += payslip.uif or 0
+        running['sdl'] += payslip.sdl or 0
+        running['net_pay'] += payslip.net_pay or 0
+
+        rows.append(YtdTotals(
+            payslip=payslip,
+            employee_id=employee_id,
+            tax_year=tax_year_label(period_start),
+            **{field: value.quantize(CENTS, rounding=ROUND_HALF_UP) for field, value in running.items()}
+        ))
+
+    YtdTotals.objects.bulk_create(
+        rows,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['payslip'],
+        update_fields=['employee', 'tax_year'] + YTD_FIELDS,
+    )
+
+
+def shard_inputs(inputs, workers):
+    """
+    Splits payslip inputs into shards for parallel calculation: one per
+    company, with large companies further split into employee id ranges so
+    the work spreads evenly over ``workers`` processes.
+    """
+    max_size = max(1, -(-len(inputs) // (workers * 4)))
+    shards = []
+    by_company = sorted(inputs, key=lambda data: (data.company_id, data.employee_id))
+    for _, company_inputs in groupby(by_company, key=lambda data: data.company_id):
+        company_inputs = list(company_inputs)
+        for i in range(0, len(company_inputs), max_size):
+            shards.append(company_inputs[i:i + max_size])
+    return shards
+
+
+def _calculate_shard(inputs, tax_table):
+    return [calculate_payslip(data, tax_table) for data in inputs]
+
+
+def calculate_payslips(inputs, tax_table, workers=1, vectorized=False, reconcile=False, progress=None):
+    """
+    Calculates payslips for ``inputs``, serially, across a process pool or
+    with the NumPy calculator in payroll.vectorized (optionally reconciled
+    against the Decimal path). Results are always returned in the order of
+    ``inputs``, so the output is identical whichever way they are calculated.
+    ``progress(done, total)`` is called as batches of payslips finish.
+    """
+    total = len(inputs)
+    if progress is None:
+        progress = lambda done, total: None  # noqa: E731
+
+    if vectorized:
+        from .vectorized import calculate_payslips_vectorized
+        results = calculate_payslips_vectorized(inputs, tax_table, reconcile=reconcile)
+        progress(total, total)
+        return results
+
+    if workers <= 1 or total < 2:
+        results = []
+        for i in range(0, total, PROGRESS_BATCH_SIZE):
+            results.extend(_calculate_shard(inputs[i:i + PROGRESS_BATCH_SIZE], tax_table))
+            progress(len(results), total)
+        return results
+
+    shards = shard_inputs(inputs, workers)
+    results = {}
+    # Workers only do arithmetic on plain data; django.setup() lets them
+    # import this module when processes are spawned rather than forked.
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+        for shard_results in executor.map(_calculate_shard, shards, [tax_table] * len(shards)):
+            for result in shard_results:
+                results[result.employee_id] = result
+            progress(len(results), total)
+    return [results[data.employee_id] for data in inputs]
+
+
+def run_payroll(payroll_run, employee_ids=None, workers=None, vectorized=False, reconcile=False, progress=None):
+    """
+    Calculates and stores payslips for every active employee in a payroll run
+    (or only ``employee_ids``), with the tax brackets of the run's tax year
+    (ValueError if it has none). Inputs are loaded up front, payslips are
+    calculated in memory, across ``workers`` processes if more than one
+    (default: settings.PAYROLL_WORKERS) or vectorized with NumPy, and written
+    back in a single transaction. Returns (created, updated) counts.
+    ``progress(done, total)`` is called as payslips are calculated, and again
+    once they are saved.
+    """
+    if workers is None:
+        workers = getattr(settings, 'PAYROLL_WORKERS', 1)
+    started_at = timezone.now()
+    tax_year = tax_year_label(payroll_run.period_start)
+    tax_table = get_tax_table(tax_year)
+    if not tax_table.rows:
+        raise ValueError(f"There are no tax brackets for the {tax_year} tax year")
+
+    employees = Employee.objects.filter(status='active').order_by('id')
+    if employee_ids is not None:
+        employees = employees.filter(id__in=employee_ids)
+
+    inputs, worked_hours = load_payslip_inputs(payroll_run, employees)
+    if progress is not None:
+        progress(0, len(inputs))
+    results = calculate_payslips(inputs, tax_table, workers, vectorized, reconcile, progress)
+    counts = save_payslips(payroll_run, results, worked_hours)
+    if progress is not None:
+        progress(len(results), len(inputs))
+
+    # Changes made while this run was calculating stay marked
+    dirty = DirtyPayslip.objects.filter(payroll_run=payroll_run, marked_at__lte=started_at)
+    if employee_ids is not None:
+        dirty = dirty.filter(employee_id__in=employee_ids)
+    dirty.delete()
+
+    refresh_run_summaries(payroll_run)
+    refresh_run_totals(payroll_run)
+    return counts
+
+
+def refresh_run_summaries(payroll_run):
+    """
+    Rebuilds the dashboard RunSummary rows for every company with payslips
+    in ``payroll_run``: one grouped aggregate for the totals and department
+    splits, one windowed query for the top earners, then an upsert.
+    Archived runs keep the summaries they had.
+    """
+    if RunSnapshot.objects.filter(payroll_run_id=payroll_run.pk, archived_at__isnull=False).exists():
+        return
+    payslips = Payslip.objects.filter(payroll_run=payroll_run)
+    grouped = payslips.values('employee__company_id', 'employee__department').annotate(
+        headcount=Count('id'), **{field: Sum(field) for field in SUMMARY_FIELDS}
+    ).order_by()
+
+    now = timezone.now()
+    summaries = {}
+    for row in grouped:
+        company_id = row['employee__company_id']
+        summary = summaries.get(company_id)
+        if summary is None:
+            summary = summaries[company_id] = RunSummary(
+                company_id=company_id, payroll_run_id=payroll_run.pk, refreshed_at=now
+            )
+            for field in SUMMARY_FIELDS:
+                setattr(summary, field, Decimal('0.00'))
+        summary.headcount += row['headcount']
+        department = {'headcount': row['headcount']}
+        for field in SUMMARY_FIELDS:
+            total = (row[field] or Decimal('0')).quantize(CENTS)
+            setattr(summary, field, getattr(summary, field) + total)
+            department[field] = total
+        summary.departments[row['employee__department']] = department
+
+    top_earners = payslips.annotate(
+        rank=Window(RowNumber(), partition_by=F('employee__company'), order_by=F('gross_income').desc())
+    ).filter(rank__lte=TOP_EARNERS).values(
+        'employee__company_id', 'employee_id', 'employee__first_name', 'employee__last_name', 'gross_income', 'net_pay',
+    ).order_by('employee__company_id', 'rank')
+    for row in top_earners:
+        summaries[row['employee__company_id']].top_earners.append({
+            'employee_id': row['employee_id'],
+            'name': f"{row['employee__first_name']} {row['employee__last_name']}",
+            'gross_income': row['gross_income'],
+            'net_pay': row['net_pay'],
+        })
+
+    with transaction.atomic():
+        RunSummary.objects.filter(payroll_run_id=payroll_run.pk).exclude(company_id__in=summaries).delete()
+        RunSummary.objects.bulk_create(
+            summaries.values(),
+            update_conflicts=True,
+            unique_fields=['company', 'payroll_run'],
+            update_fields=['headcount', *SUMMARY_FIELDS, 'departments', 'top_earners', 'refreshed_at'],
+        )
+
+
+def payslip_totals(payslips):
+    """
+    Totals of a Payslip queryset, wage earnings included, from one aggregate
+    query: a dict of RunTotals.AMOUNT_FIELDS and ``headcount``.
+    """
+    sources = {
+        field: f'worked_hours__{field}' if field.endswith('_earnings') else field
+        for field in RunTotals.AMOUNT_FIELDS
+    }
+    sources['wages'] = 'worked_hours__total_earnings'
+    # Summed in whole cents: SQLite adds decimals as floats, which can be a cent out
+    totals = payslips.order_by().aggregate(
+        headcount=Count('id'),
+        **{
+            field: Coalesce(Sum(Round(F(source) * 100)), Value(0), output_field=IntegerField())
+            for field, source in sources.items()
+        },
+    )
+    for field in RunTotals.AMOUNT_FIELDS:
+        totals[field] = (Decimal(totals[field]) / 100).quantize(CENTS)
+    return totals
+
+
+def refresh_run_totals(payroll_run):
+    """
+    Stores the totals of ``payroll_run``'s payslips on its RunTotals row.
+    Totals already frozen are left alone; a closed run's are frozen now.
+    """
+    if RunTotals.objects.filter(payroll_run_id=payroll_run.pk, frozen_at__isnull=False).exists():
+        return
+    now = timezone.now()
+    totals = RunTotals(
+        payroll_run_id=payroll_run.pk,
+        refreshed_at=now,
+        frozen_at=now if payroll_run.is_closed else None,
+        **payslip_totals(Payslip.objects.filter(payroll_run_id=payroll_run.pk)),
+    )
+    RunTotals.objects.bulk_create(
+        [totals],
+        update_conflicts=True,
+        unique_fields=['payroll_run'],
+        update_fields=['headcount', *RunTotals.AMOUNT_FIELDS, 'refreshed_at', 'frozen_at'],
+    )
+
+
+def mark_payslips_dirty(employee_ids=None, payroll_run_id=None):
+    """
+    Marks payslips as needing recalculation, for ``employee_ids`` (default:
+    every active employee) in run ``payroll_run_id`` (default: every open
+    run). Closed runs and employees that no longer exist are skipped.
+    """
+    runs = PayrollRun.objects.filter(is_closed=False)
+    if payroll_run_id is not None:
+        runs = runs.filter(pk=payroll_run_id)
+    run_ids = list(runs.values_list('id', flat=True))
+    if not run_ids:
+        return
+
+    employees = Employee.objects.all()
+    if employee_ids is None:
+        employees = employees.filter(status='active')
+    else:
+        employees = employees.filter(id__in=employee_ids)
+
+    now = timezone.now()
+    DirtyPayslip.objects.bulk_create(
+        [
+            DirtyPayslip(employee_id=employee_id, payroll_run_id=run_id, marked_at=now)
+            for employee_id in employees.values_list('id', flat=True) for run_id in run_ids
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['employee', 'payroll_run'],
+        update_fields=['marked_at'],
+    )
+
+
+def recalculate_dirty_payslips(payroll_run=None, employee_ids=None, **kwargs):
+    """
+    Recalculates only the payslips marked dirty, in ``payroll_run`` or in
+    every open run, and only those of ``employee_ids`` if given. Extra
+    keyword arguments go to run_payroll.
+    Returns the number of payslips recalculated.
+    """
+    dirty = DirtyPayslip.objects.filter(payroll_run__is_closed=False)
+    if payroll_run is not None:
+        dirty = dirty.filter(payroll_run=payroll_run)
+    if employee_ids is not None:
+        dirty = dirty.filter(employee_id__in=employee_ids)
+    runs = PayrollRun.objects.filter(pk__in=dirty.values('payroll_run_id'))
+
+    recalculated = 0
+    for run in runs:
+        dirty_ids = list(dirty.filter(payroll_run=run).values_list('employee_id', flat=True))
+        created, updated = run_payroll(run, employee_ids=dirty_ids, **kwargs)
+        recalculated += created + updated
+    return recalculated
+
+
+def annual_leave_accrual(cycle_start, period_start, period_end):
+    """
+    Days of annual leave earned in a pay period by a balance whose cycle
+    started on ``cycle_start``: a full month's accrual, prorated by days
+    when the cycle starts part-way through the period.
+    """
+    if cycle_start > period_end:
+        return Decimal('0.00')
+    days = LeaveBalance.MONTHLY_ANNUAL_ACCRUAL
+    if cycle_start > period_start:
+        period_days = (period_end - period_start).days + 1
+        days = days * ((period_end - cycle_start).days + 1) / period_days
+    return days.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def post_leave_accruals(payroll_run):
+    """
+    Posts a month's annual leave accrual for every employee with a payslip
+    in ``payroll_run`` and adds it to their stored balance, capped at the
+    cycle's allocation. Balances already posted for the run are skipped,
+    so posting again is harmless. Returns the number of entries posted.
+    """
+    balances = LeaveBalance.objects.filter(
+        leave_type=LeaveType.ANNUAL,
+        cycle_start__lte=payroll_run.period_end,
+        employee__in=Payslip.objects.filter(payroll_run=payroll_run).values('employee_id'),
+    ).exclude(accruals__payroll_run=payroll_run).values_list(
+        'id', 'employee_id', 'cycle_start', 'total_days', 'accrued_days', 'used_days'
+    )
+
+    now = timezone.now()
+    with transaction.atomic():
+        accruals = []
+        for balance_id, employee_id, cycle_start, total_days, accrued_days, used_days in balances.iterator(chunk_size=2000):
+            earned = annual_leave_accrual(cycle_start, payroll_run.period_start, payroll_run.period_end)
+            days = max(Decimal('0.00'), min(earned, total_days - accrued_days))
+            accruals.append(LeaveAccrual(
+                leave_balance_id=balance_id,
+                employee_id=employee_id,
+                payroll_run_id=payroll_run.pk,
+                days=days,
+                accrued_days=accrued_days + days,
+                used_days=used_days,
+                posted_at=now,
+            ))
+        LeaveAccrual.objects.bulk_create(accruals, batch_size=500)
+
+        # One UPDATE carries the new running totals over to the balances
+        posted = LeaveAccrual.objects.filter(payroll_run_id=payroll_run.pk, posted_at=now)
+        LeaveBalance.objects.filter(id__in=posted.values('leave_balance_id')).update(
+            accrued_days=Subquery(posted.filter(leave_balance_id=OuterRef('pk')).values('accrued_days')[:1])
+        )
+    return len(accruals)
+
+
+def leave_balances_as_of(payroll_run):
+    """
+    Annual leave accrual entries posted by ``payroll_run``, each holding the
+    employee's accrued, used and remaining days as at that run.
+    """
+    return LeaveAccrual.objects.filter(payroll_run=payroll_run).select_related('employee')
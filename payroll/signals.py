@@ -0,0 +1,175 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Allowance, Company, Deduction, Employee, LeaveBalance, Payslip, PayrollRun, TaxBracket, WorkedHours
+from .utils import clear_tax_tables, invalidate_company_cache
+
+
+@receiver(pre_save, sender=Employee)
+@receiver(pre_save, sender=Payslip)
+@receiver(pre_save, sender=PayrollRun)
+@receiver(pre_save, sender=WorkedHours)
+def bump_row_version(sender, instance, raw=False, **kwargs):
+    if not raw and not instance._state.adding:
+        instance.version += 1
+
+
+@receiver([post_save, post_delete], sender=TaxBracket)
+def invalidate_tax_tables(sender, **kwargs):
+    # A bracket may have moved between tax years, so drop every compiled table
+    clear_tax_tables()
+    # ...and every open payslip may now be taxed differently
+    from .services import mark_payslips_dirty
+    transaction.on_commit(mark_payslips_dirty)
+
+
+class PayslipRefresh:
+    """
+    The runs, and employees in them, whose payslips were saved or deleted in
+    a transaction. Called on commit to refresh each run's summaries and
+    totals, and each employee's YTD ledger for the tax year, once.
+    """
+
+    def __init__(self):
+        self.runs = {}
+        self.employee_ids = defaultdict(set)
+
+    def add(self, payslip):
+        # Read the period now: on a cascade delete the run is gone by commit time
+        if payslip.payroll_run_id not in self.runs:
+            self.runs[payslip.payroll_run_id] = payslip.payroll_run
+        self.employee_ids[payslip.payroll_run_id].add(payslip.employee_id)
+
+    def __call__(self):
+        from .services import refresh_run_summaries, refresh_run_totals, refresh_ytd_totals, tax_year_start
+        tax_years = defaultdict(set)
+        for payroll_run_id, employee_ids in self.employee_ids.items():
+            tax_years[tax_year_start(self.runs[payroll_run_id].period_start)].update(employee_ids)
+        for start, employee_ids in tax_years.items():
+            refresh_ytd_totals(list(employee_ids), start)
+        existing = PayrollRun.objects.filter(pk__in=self.runs).values_list('pk', flat=True)
+        for payroll_run_id in existing:
+            refresh_run_summaries(self.runs[payroll_run_id])
+            refresh_run_totals(self.runs[payroll_run_id])
+
+
+def pending_payslip_refresh():
+    """
+    Returns the PayslipRefresh of the current transaction, registering it
+    to run on commit the first time. A refresh dropped by a rollback is
+    replaced. Outside a transaction, returns None.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return None
+    refresh = getattr(connection, 'payslip_refresh', None)
+    if refresh is None or not any(func is refresh for _, func, _ in connection.run_on_commit):
+        refresh = connection.payslip_refresh = PayslipRefresh()
+        transaction.on_commit(refresh)
+    return refresh
+
+
+@receiver([post_save, post_delete], sender=Payslip)
+def refresh_payslip_ytd_totals(sender, instance, raw=False, **kwargs):
+    # Bulk writes from the payroll engine refresh the ledger themselves
+    if raw:
+        return
+    refresh = pending_payslip_refresh()
+    if refresh is None:
+        refresh = PayslipRefresh()
+        refresh.add(instance)
+        refresh()
+    else:
+        refresh.add(instance)
+
+
+@receiver(post_save, sender=PayrollRun)
+def refresh_closed_run_summaries(sender, instance, raw=False, **kwargs):
+    # Closing a run fixes its dashboard figures and freezes its totals
+    if raw or not instance.is_closed:
+        return
+    from .services import refresh_run_summaries, refresh_run_totals
+    transaction.on_commit(lambda: refresh_run_summaries(instance))
+    transaction.on_commit(lambda: refresh_run_totals(instance))
+
+
+@receiver(post_save, sender=PayrollRun)
+def post_closed_run_leave_accruals(sender, instance, raw=False, **kwargs):
+    # Closing a run earns each paid employee a month's annual leave
+    if raw or not instance.is_closed:
+        return
+    from .services import post_leave_accruals
+    transaction.on_commit(lambda: post_leave_accruals(instance))
+
+
+@receiver(post_save, sender=PayrollRun)
+def snapshot_closed_run(sender, instance, raw=False, **kwargs):
+    # A closed run's payslips are kept as they were in an immutable snapshot
+    if raw or not instance.is_closed:
+        return
+    from .snapshots import write_snapshot
+    transaction.on_commit(lambda: write_snapshot(instance))
+
+
+@receiver([post_save, post_delete], sender=Employee)
+def invalidate_employee_company_cache(sender, instance, raw=False, **kwargs):
+    # Runs before mark_employee_payslips_dirty replaces the loaded values
+    if raw:
+        return
+    company_ids = {instance.company_id}
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    if 'company_id' in loaded:
+        company_ids.add(loaded['company_id'])
+    for company_id in company_ids:
+        transaction.on_commit(lambda company_id=company_id: invalidate_company_cache(company_id))
+
+
+@receiver(post_save, sender=Employee)
+def index_employee(sender, instance, raw=False, **kwargs):
+    if not raw:
+        from .search import index_employees
+        index_employees([instance])
+
+
+@receiver(post_delete, sender=Employee)
+def unindex_employee(sender, instance, **kwargs):
+    from .search import remove_from_index
+    remove_from_index([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Company)
+def invalidate_company(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: invalidate_company_cache(instance.pk))
+
+
+@receiver(post_save, sender=Employee)
+def mark_employee_payslips_dirty(sender, instance, created, raw=False, **kwargs):
+    if raw or not instance.payroll_fields_changed():
+        return
+    from .services import mark_payslips_dirty
+    employee_id = instance.pk
+    transaction.on_commit(lambda: mark_payslips_dirty([employee_id]))
+    instance._loaded_values = {field: getattr(instance, field) for field in Employee.PAYROLL_FIELDS}
+
+
+@receiver(post_save, sender=Employee)
+def initialize_employee_leave(sender, instance, created, raw=False, **kwargs):
+    # Bulk imports create balances themselves (see imports.py)
+    if created and not raw:
+        LeaveBalance.initialize_leave_for_employee(instance)
+
+
+@receiver([post_save, post_delete], sender=WorkedHours)
+@receiver([post_save, post_delete], sender=Allowance)
+@receiver([post_save, post_delete], sender=Deduction)
+def mark_run_payslip_dirty(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    from .services import mark_payslips_dirty
+    # Deferred to commit so a cascade delete of the employee or run marks nothing
+    employee_id, payroll_run_id = instance.employee_id, instance.payroll_run_id
+    transaction.on_commit(lambda: mark_payslips_dirty([employee_id], payroll_run_id))
@@ -0,0 +1,337 @@
+"""
+Snapshots of closed payroll runs.
+
+Closing a run writes every payslip in it, with the worked hours breakdown
+and YTD figures, to one gzip-compressed file in default storage. The file
+is columnar: a JSON header naming the columns, then one JSON line per group
+of rows holding a list of values for each column, so it compresses well
+and is read a group at a time. Each line is its own gzip member, and the
+members' offsets are kept on the RunSnapshot, so a single group can be read
+without the rest. Snapshots are written once and never changed. Exports
+and PDFs of closed runs are served from them, read back as unsaved Payslip
+instances, and once a run's tax year is over its detailed rows can be
+pruned from the database (see archive_run).
+"""
+import gzip
+import hashlib
+import json
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import (
+    ArchivedPayslip, Company, DirtyPayslip, Employee, Payslip, PayslipQuerySet, RunSnapshot, WorkedHours, YtdTotals,
+)
+from .services import CENTS, tax_year_start
+
+SNAPSHOT_FORMAT = 1
+
+# Payslips per group of rows in a snapshot file
+SNAPSHOT_GROUP_SIZE = 5000
+
+# Same order as the run's exports and PDF archives
+SNAPSHOT_ORDERING = ('employee__last_name', 'employee__first_name', 'id')
+
+SNAPSHOT_COLUMNS = (
+    [f'payslip.{name}' for name in (
+        'id', 'employee_id', 'basic_salary', 'gross_income', 'tax', 'uif', 'sdl', 'net_pay', 'created_at',
+    )]
+    + [f'employee.{name}' for name in (
+        'first_name', 'last_name', 'id_number', 'tax_number', 'department', 'job_title', 'date_joined',
+        'is_wage_employee', 'salary', 'company_id',
+    )]
+    + ['company.name', 'company.code']
+    + [f'worked_hours.{name}' for name in (
+        'id', 'normal_hours', 'overtime_hours', 'saturday_hours', 'sunday_public_hours', *WorkedHours.EARNINGS_FIELDS,
+    )]
+    + [f'ytd.{name}' for name in PayslipQuerySet.YTD_FIELDS]
+)
+
+_MODELS = {'payslip': Payslip, 'employee': Employee, 'company': Company, 'worked_hours': WorkedHours}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_path(payroll_run):
+    return f"payroll_snapshots/run_{payroll_run.pk}_{payroll_run.period_start:%Y-%m}.json.gz"
+
+
+def _value(payslip, column):
+    part, name = column.split('.')
+    if part == 'payslip':
+        return getattr(payslip, name)
+    if part == 'employee':
+        return getattr(payslip.employee, name)
+    if part == 'company':
+        return getattr(payslip.employee.company, name)
+    if part == 'worked_hours':
+        return getattr(payslip.worked_hours, name) if payslip.worked_hours is not None else None
+    return getattr(payslip, f'{name}_ytd').quantize(CENTS)
+
+
+def _write_member(out, line):
+    """Writes ``line`` to ``out`` as a gzip member of its own and returns the offset it starts at."""
+    offset = out.tell()
+    with gzip.GzipFile(fileobj=out, mode='wb') as member:
+        member.write(line.encode() + b'\n')
+    return offset
+
+
+def _write_group(out, group):
+    columns = [list(column) for column in zip(*group)]
+    line = json.dumps({'rows': len(group), 'columns': columns}, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return _write_member(out, line)
+
+
+def _checksum(f):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_snapshot(payroll_run):
+    """
+    Writes the snapshot of a closed run and returns its RunSnapshot, or
+    returns the existing one: snapshots are never rewritten.
+    """
+    existing = RunSnapshot.objects.filter(payroll_run_id=payroll_run.pk).first()
+    if existing is not None:
+        return existing
+    if not payroll_run.is_closed:
+        raise ValueError(f"{payroll_run} is not closed")
+
+    payslips = Payslip.objects.filter(payroll_run_id=payroll_run.pk).with_ytd().select_related(
+        'employee__company', 'worked_hours'
+    ).order_by(*SNAPSHOT_ORDERING)
+    header = {
+        'format': SNAPSHOT_FORMAT,
+        'payroll_run': {
+            'id': payroll_run.pk,
+            'period_start': payroll_run.period_start,
+            'period_end': payroll_run.period_end,
+        },
+        'columns': SNAPSHOT_COLUMNS,
+        'created_at': timezone.now(),
+    }
+
+    count, ids, offsets = 0, [], []
+    with tempfile.TemporaryFile() as tmp:
+        _write_member(tmp, json.dumps(header, cls=DjangoJSONEncoder))
+        group = []
+        for payslip in payslips.iterator(chunk_size=SNAPSHOT_GROUP_SIZE):
+            group.append([_value(payslip, column) for column in SNAPSHOT_COLUMNS])
+            ids.append(payslip.pk)
+            if len(group) >= SNAPSHOT_GROUP_SIZE:
+                offsets.append(_write_group(tmp, group))
+                count += len(group)
+                group = []
+        if group:
+            offsets.append(_write_group(tmp, group))
+            count += len(group)
+
+        size = tmp.tell()
+        tmp.seek(0)
+        checksum = _checksum(tmp)
+        tmp.seek(0)
+        path = default_storage.save(snapshot_path(payroll_run), File(tmp))
+
+    try:
+        return RunSnapshot.objects.create(
+            payroll_run_id=payroll_run.pk,
+            path=path,
+            checksum=checksum,
+            size=size,
+            payslip_count=count,
+            first_payslip_id=min(ids, default=None),
+            last_payslip_id=max(ids, default=None),
+            group_offsets=offsets,
+        )
+    except IntegrityError:
+        # Another process wrote this run's snapshot first; keep theirs
+        default_storage.delete(path)
+        return RunSnapshot.objects.get(payroll_run_id=payroll_run.pk)
+
+
+def verify_snapshot(snapshot):
+    """True if the snapshot file is still there and unchanged since it was written."""
+    if not default_storage.exists(snapshot.path):
+        return False
+    with default_storage.open(snapshot.path, 'rb') as f:
+        return _checksum(f) == snapshot.checksum
+
+
+def _converter(column):
+    part, name = column.split('.')
+    if part == 'ytd':
+        return Payslip._meta.get_field('gross_income').to_python
+    return _MODELS[part]._meta.get_field(name).to_python
+
+
+def _header(lines, snapshot):
+    header = json.loads(next(lines))
+    if header.get('format') != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"{snapshot.path} has unknown snapshot format {header.get('format')}")
+    return header['columns'], [_converter(name) for name in header['columns']]
+
+
+def _columns(line, converters):
+    return [
+        [None if value is None else convert(value) for value in column]
+        for convert, column in zip(converters, json.loads(line)['columns'])
+    ]
+
+
+def _open(snapshot):
+    if not default_storage.exists(snapshot.path):
+        raise SnapshotError(f"The snapshot file {snapshot.path} is missing")
+    return default_storage.open(snapshot.path, 'rb')
+
+
+def _iter_groups(snapshot):
+    """Yields (column names, values of each column) for each group of rows in a snapshot."""
+    with _open(snapshot) as f, gzip.GzipFile(fileobj=f, mode='rb') as lines:
+        names, converters = _header(lines, snapshot)
+        for line in lines:
+            yield names, _columns(line, converters)
+
+
+def _iter_rows(snapshot):
+    """Yields each row of a snapshot as a dict of column name to value."""
+    for names, columns in _iter_groups(snapshot):
+        for values in zip(*columns):
+            yield dict(zip(names, values))
+
+
+def _read_group(snapshot, group):
+    """(column names, values of each column) of one group, decompressing only the header and that group."""
+    with _open(snapshot) as f:
+        with gzip.GzipFile(fileobj=f, mode='rb') as lines:
+            names, converters = _header(lines, snapshot)
+        f.seek(snapshot.group_offsets[group])
+        with gzip.GzipFile(fileobj=f, mode='rb') as lines:
+            return names, _columns(lines.readline(), converters)
+
+
+def _fields(row, part):
+    prefix = f'{part}.'
+    return {name[len(prefix):]: value for name, value in row.items() if name.startswith(prefix)}
+
+
+def _payslip(row, payroll_run, companies):
+    """An unsaved Payslip, with its employee, company and worked hours, from a snapshot row."""
+    employee = Employee(id=row['payslip.employee_id'], **_fields(row, 'employee'))
+    company = companies.get(employee.company_id)
+    if company is None:
+        company = companies[employee.company_id] = Company(id=employee.company_id, **_fields(row, 'company'))
+    employee.company = company
+
+    hours = _fields(row, 'worked_hours')
+    worked_hours = None
+    if hours['id'] is not None:
+        worked_hours = WorkedHours(employee=employee, payroll_run=payroll_run, **hours)
+
+    payslip = Payslip(payroll_run=payroll_run, worked_hours=worked_hours, **_fields(row, 'payslip'))
+    payslip.employee = employee
+    # Read by Payslip.ytd, as with Payslip.objects.with_ytd()
+    for name, value in _fields(row, 'ytd').items():
+        setattr(payslip, f'{name}_ytd', value)
+    return payslip
+
+
+def snapshot_payslips(snapshot, company=None):
+    """Yields the payslips in a snapshot, optionally only ``company``'s, in SNAPSHOT_ORDERING."""
+    payroll_run = snapshot.payroll_run
+    companies = {}
+    for row in _iter_rows(snapshot):
+        if company is None or row['employee.company_id'] == company.pk:
+            yield _payslip(row, payroll_run, companies)
+
+
+def closed_run_snapshot(payroll_run):
+    """The snapshot to serve a run's payslips from: only closed runs have one."""
+    if not payroll_run.is_closed:
+        return None
+    return RunSnapshot.objects.filter(payroll_run_id=payroll_run.pk).select_related('payroll_run').first()
+
+
+def archived_payslip(pk):
+    """Payslip ``pk`` read from the snapshot of an archived run, or None."""
+    archived = ArchivedPayslip.objects.select_related('snapshot__payroll_run').filter(pk=pk).first()
+    if archived is None:
+        return None
+    names, columns = _read_group(archived.snapshot, archived.group)
+    ids = columns[names.index('payslip.id')]
+    if pk not in ids:
+        raise SnapshotError(f"Payslip {pk} is not in group {archived.group} of {archived.snapshot.path}")
+    row = dict(zip(names, (column[ids.index(pk)] for column in columns)))
+    return _payslip(row, archived.snapshot.payroll_run, {})
+
+
+def _archived_payslips(snapshot):
+    """ArchivedPayslip rows locating every payslip in a snapshot."""
+    return [
+        ArchivedPayslip(id=pk, snapshot=snapshot, group=group)
+        for group, (names, columns) in enumerate(_iter_groups(snapshot))
+        for pk in columns[names.index('payslip.id')]
+    ]
+
+
+def can_archive(payroll_run, today=None):
+    """
+    Whether a closed run's detailed rows may be pruned: only once its tax
+    year is over, because later payslips read their YTD figures from them.
+    """
+    today = today or timezone.now().date()
+    return payroll_run.is_closed and tax_year_start(payroll_run.period_start) < tax_year_start(today)
+
+
+def archive_run(payroll_run, today=None):
+    """
+    Deletes a closed run's payslips, their YTD ledger rows and the run's
+    worked hours, after checking its snapshot is intact. Run totals,
+    dashboard summaries and leave accruals are kept. Returns the number of
+    payslips deleted.
+    """
+    if not can_archive(payroll_run, today):
+        raise ValueError(f"{payroll_run} cannot be archived until its tax year is over")
+    snapshot = RunSnapshot.objects.filter(payroll_run_id=payroll_run.pk).first()
+    if snapshot is None:
+        raise SnapshotError(f"{payroll_run} has no snapshot")
+    if snapshot.archived_at is not None:
+        return 0
+    if not verify_snapshot(snapshot):
+        raise SnapshotError(f"The snapshot of {payroll_run} is missing or has changed")
+    if snapshot.payslip_count and not snapshot.group_offsets:
+        raise SnapshotError(f"The snapshot of {payroll_run} was written without group offsets")
+    archived = _archived_payslips(snapshot)
+
+    qn = connection.ops.quote_name
+    table = lambda model: qn(model._meta.db_table)
+    column = lambda model, name: qn(model._meta.get_field(name).column)
+    run_column = column(Payslip, 'payroll_run')
+    # Plain deletes: the payslip signals would otherwise rebuild ledgers and summaries row by row
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {table(YtdTotals)} WHERE {column(YtdTotals, 'payslip')} IN "
+            f"(SELECT {qn(Payslip._meta.pk.column)} FROM {table(Payslip)} WHERE {run_column} = %s)",
+            [payroll_run.pk],
+        )
+        cursor.execute(f"DELETE FROM {table(Payslip)} WHERE {run_column} = %s", [payroll_run.pk])
+        deleted = cursor.rowcount
+        cursor.execute(
+            f"DELETE FROM {table(WorkedHours)} WHERE {column(WorkedHours, 'payroll_run')} = %s", [payroll_run.pk]
+        )
+        cursor.execute(
+            f"DELETE FROM {table(DirtyPayslip)} WHERE {column(DirtyPayslip, 'payroll_run')} = %s", [payroll_run.pk]
+        )
+        ArchivedPayslip.objects.bulk_create(archived, batch_size=1000, ignore_conflicts=True)
+        RunSnapshot.objects.filter(pk=snapshot.pk).update(archived_at=timezone.now())
+    return deleted
+
@@ -1,3 +1,787 @@
-from django.test import TestCase
+import dataclasses
+import datetime
+import io
+import shutil
+import tempfile
+import zipfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .exports import payslip_export
+from .imports import import_employees, read_rows
+from .jobs import claim_next_job, enqueue_payroll_job, process_job
+from .models import (
+    Company, CustomUser, DirtyPayslip, Employee, LeaveAccrual, LeaveBalance, LeaveType, Payslip, PayrollJob,
+    PayrollRun, PayslipQuerySet, RunSnapshot, RunTotals, TaxBracket, WorkedHours, YtdTotals,
+)
+from .pagination import CursorPaginator
+from .querycount import assert_max_queries, assert_within_budget
+from .search import matching_employee_ids, rebuild_index, search_words
+from .services import (
+    CENTS, PayslipInput, calculate_payslip, calculate_payslips, get_payroll_run_for, load_payslip_inputs,
+    mark_payslips_dirty, post_leave_accruals, recalculate_dirty_payslips, run_payroll, save_payslips,
+)
+from .snapshots import archive_run, archived_payslip, snapshot_payslips, verify_snapshot
+from .timesheets import ingest_timesheets
+from .utils import TaxTable, clear_tax_tables, get_tax_table
+from .vectorized import ReconciliationError, calculate_payslips_vectorized
+from .workload import generate_workload
+
+TODAY = datetime.date(2025, 6, 15)
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    ALLOWED_HOSTS=['testserver'],
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class PayrollTestCase(TestCase):
+    """
+    A generated company with three months of payroll (see payroll.workload):
+    April and May 2025 closed, with snapshots, and June 2025 open.
+    """
+    companies = 1
+    employees = 40
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.addClassCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        # Small groups, so snapshots and archived lookups span several
+        with mock.patch('payroll.snapshots.SNAPSHOT_GROUP_SIZE', 7), cls.captureOnCommitCallbacks(execute=True):
+            generate_workload(companies=cls.companies, employees=cls.employees, months=3, today=TODAY)
+        cls.company = Employee.objects.latest('id').company
+        cls.user = CustomUser.objects.create_user('payroll', password='payroll', company=cls.company)
+        cls.closed_run = PayrollRun.objects.get(period_start=datetime.date(2025, 5, 1))
+        cls.open_run = PayrollRun.objects.get(period_start=datetime.date(2025, 6, 1))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+
+class ViewQueryBudgetTests(PayrollTestCase):
+    def assertWithinBudget(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return assert_within_budget(response)
+
+    def test_dashboard(self):
+        self.assertWithinBudget(reverse('dashboard'))
+
+    def test_employee_list(self):
+        self.assertWithinBudget(reverse('employee_list'))
+        self.assertWithinBudget(reverse('employee_list') + '?cursor=')
+
+    def test_payslips_summary(self):
+        now = datetime.datetime(2025, 6, 15, 12, tzinfo=datetime.timezone.utc)
+        with mock.patch('payroll.views.timezone.now', return_value=now):
+            self.assertWithinBudget(reverse('payslips_summary'))
+            self.assertWithinBudget(reverse('payslips_summary') + '?cursor=')
+
+    def test_payslip_detail(self):
+        for payroll_run in (self.open_run, self.closed_run):
+            payslip = Payslip.objects.filter(payroll_run=payroll_run).first()
+            self.assertWithinBudget(reverse('payslip_detail', args=[payslip.pk]))
+
+    def test_leave_summary(self):
+        self.assertWithinBudget(reverse('leave_summary'))
+
+    def test_streamed_export_is_flagged(self):
+        response = self.client.get(reverse('payroll_run_export', args=[self.open_run.pk, 'csv']))
+        self.assertTrue(response.query_stats.streaming)
+        self.assertFalse(response.query_stats.over_budget)
+        with self.assertRaisesMessage(AssertionError, "streamed its response"):
+            assert_within_budget(response)
+
+    def test_streamed_export_body(self):
+        response = self.client.get(reverse('payroll_run_export', args=[self.open_run.pk, 'csv']))
+        # Rows are read in chunks, so the count doesn't grow with the run
+        with assert_max_queries(10, label="CSV export"):
+            body = b''.join(response.streaming_content)
+        payslips = Payslip.objects.filter(payroll_run=self.open_run).count()
+        self.assertEqual(len(body.decode().strip().splitlines()), payslips + 1)
+
+    def test_assert_max_queries_lists_sql(self):
+        with self.assertRaisesMessage(AssertionError, "Block ran 2 queries, over its budget of 1"):
+            with assert_max_queries(1):
+                list(Employee.objects.all()[:1])
+                list(PayrollRun.objects.all()[:1])
+
+
+class RunPayrollTests(PayrollTestCase):
+    def payslips(self, payroll_run):
+        return list(
+            Payslip.objects.filter(payroll_run=payroll_run).order_by('id').values_list(
+                'id', 'employee_id', 'basic_salary', 'gross_income', 'tax', 'uif', 'sdl', 'net_pay'
+            )
+        )
+
+    def test_one_payslip_per_active_employee(self):
+        active = set(Employee.objects.filter(status='active').values_list('id', flat=True))
+        self.assertEqual({payslip[1] for payslip in self.payslips(self.open_run)}, active)
+
+    def test_rerun_updates_payslips_in_place(self):
+        before = self.payslips(self.open_run)
+        self.assertEqual(run_payroll(self.open_run), (0, len(before)))
+        self.assertEqual(self.payslips(self.open_run), before)
+
+    def test_command(self):
+        call_command('run_payroll', date='2025-07-10', stdout=io.StringIO())
+        july = PayrollRun.objects.get(period_start=datetime.date(2025, 7, 1))
+        self.assertEqual(len(self.payslips(july)), len(self.payslips(self.open_run)))
+
+
+class TaxTableTests(PayrollTestCase):
+    def walk(self, table, income):
+        for lower_limit, upper_limit, base_tax, marginal_rate in table.rows:
+            if upper_limit is None or income <= upper_limit:
+                return max(base_tax + (income - lower_limit) * (marginal_rate / 100), Decimal('0.00'))
+        return Decimal('0.00')
+
+    def test_bisection_matches_walking_brackets(self):
+        table = get_tax_table('2025/2026')
+        incomes = {Decimal('0.00'), Decimal('0.01'), Decimal('5000000.00')}
+        for lower_limit, upper_limit, _, _ in table.rows:
+            incomes.add(lower_limit)
+            if upper_limit is not None:
+                incomes.update({upper_limit, upper_limit + Decimal('0.01')})
+        for income in sorted(incomes):
+            self.assertEqual(table.calculate(income), self.walk(table, income), income)
+
+    def test_top_bracket_only_may_be_open(self):
+        with self.assertRaises(ValueError):
+            TaxTable('test', [(0, None, 0, 18), (100, 200, 18, 26)])
+
+    def test_tables_are_cached_until_a_bracket_changes(self):
+        self.addCleanup(clear_tax_tables)
+        table = get_tax_table('2025/2026')
+        with assert_max_queries(0):
+            self.assertIs(get_tax_table('2025/2026'), table)
+        TaxBracket.objects.filter(tax_year='2025/2026').first().save()
+        self.assertIsNot(get_tax_table('2025/2026'), table)
+
+    def test_run_uses_its_tax_years_brackets(self):
+        self.addCleanup(clear_tax_tables)
+        for bracket in TaxBracket.objects.filter(tax_year='2025/2026'):
+            bracket.marginal_rate += 1
+            bracket.save()
+        taxes = lambda: dict(Payslip.objects.filter(payroll_run=self.open_run).values_list('employee_id', 'tax'))
+        before = taxes()
+        run_payroll(self.open_run)
+
+        inputs, _ = load_payslip_inputs(self.open_run, Employee.objects.filter(status='active'))
+        table = get_tax_table('2025/2026')
+        self.assertEqual(taxes(), {data.employee_id: calculate_payslip(data, table).tax for data in inputs})
+        self.assertNotEqual(taxes(), before)
+
+    def test_run_without_brackets_for_its_tax_year(self):
+        payroll_run = get_payroll_run_for(datetime.date(2027, 6, 1))
+        with self.assertRaisesMessage(ValueError, "2027/2028"):
+            run_payroll(payroll_run)
+
+
+class YtdLedgerTests(PayrollTestCase):
+    def running_totals(self):
+        """(gross income, tax, net pay) to date as at each payslip, all runs being in one tax year."""
+        totals, running = {}, {}
+        for payslip in Payslip.objects.order_by('employee_id', 'payroll_run__period_start'):
+            gross_income, tax, net_pay = running.get(payslip.employee_id, (0, 0, 0))
+            running[payslip.employee_id] = totals[payslip.pk] = (
+                gross_income + payslip.gross_income, tax + payslip.tax, net_pay + payslip.net_pay
+            )
+        return totals
+
+    def ledger(self):
+        return {
+            row[0]: row[1:]
+            for row in YtdTotals.objects.values_list('payslip_id', 'gross_income', 'tax', 'net_pay')
+        }
+
+    def test_ledger_holds_running_totals(self):
+        self.assertEqual(self.ledger(), self.running_totals())
+
+    def test_ytd_is_read_from_the_ledger(self):
+        payslip = Payslip.objects.select_related('ytd_totals').filter(payroll_run=self.open_run).first()
+        expected = self.running_totals()[payslip.pk]
+        with assert_max_queries(0):
+            self.assertEqual((payslip.ytd_gross_income, payslip.ytd_tax, payslip.ytd_net_pay), expected)
+
+    def test_saving_a_payslip_refreshes_the_ledger(self):
+        payslip = Payslip.objects.filter(payroll_run=self.closed_run).first()
+        payslip.net_pay -= 100
+        with self.captureOnCommitCallbacks(execute=True):
+            payslip.save()
+        self.assertEqual(self.ledger(), self.running_totals())
+
+
+class WithYtdTests(PayrollTestCase):
+    def test_annotations_match_the_ledger(self):
+        ledger = {row.payslip_id: row for row in YtdTotals.objects.all()}
+        payslips = list(Payslip.objects.with_ytd())
+        self.assertEqual(len(payslips), len(ledger))
+        for payslip in payslips:
+            for field in PayslipQuerySet.YTD_FIELDS:
+                self.assertEqual(getattr(payslip.ytd, field), getattr(ledger[payslip.pk], field), field)
+
+    def test_run_is_read_in_one_query(self):
+        with assert_max_queries(1):
+            payslips = list(Payslip.objects.filter(payroll_run=self.open_run).with_ytd())
+            for payslip in payslips:
+                payslip.ytd_net_pay
+
+
+class ParallelPayrollTests(PayrollTestCase):
+    companies = 3
+    employees = 300
+
+    def payslips(self):
+        return list(
+            Payslip.objects.filter(payroll_run=self.open_run).order_by('employee_id').values_list(
+                'employee_id', 'basic_salary', 'gross_income', 'tax', 'uif', 'sdl', 'net_pay'
+            )
+        )
+
+    def test_workers_and_vectorized_match_the_serial_result(self):
+        run_payroll(self.open_run, workers=1)
+        serial = self.payslips()
+        for options in ({'workers': 3}, {'vectorized': True, 'reconcile': True}):
+            run_payroll(self.open_run, **options)
+            self.assertEqual(self.payslips(), serial, options)
+
+    def test_results_keep_the_order_of_the_inputs(self):
+        inputs, _ = load_payslip_inputs(self.open_run, Employee.objects.filter(status='active').order_by('-id'))
+        results = calculate_payslips(inputs, get_tax_table('2025/2026'), workers=3)
+        self.assertEqual([result.employee_id for result in results], [data.employee_id for data in inputs])
+
+
+class VectorizedPayrollTests(PayrollTestCase):
+    def inputs(self):
+        inputs = []
+        for number, salary in enumerate(range(0, 250000, 997)):
+            inputs.append(PayslipInput(
+                employee_id=number,
+                company_id=1,
+                is_wage_employee=number % 3 == 0,
+                salary=Decimal(salary),
+                wage_gross=Decimal(salary) + Decimal('0.005') * (number % 7),
+                age=(30, 65, 80)[number % 3],
+                ytd_income=Decimal(salary) * (number % 12) + Decimal('0.01') * number,
+                months_paid=number % 12,
+            ))
+        return inputs
+
+    def test_matches_decimal_calculation(self):
+        inputs = self.inputs()
+        table = get_tax_table('2025/2026')
+        self.assertEqual(
+            calculate_payslips_vectorized(inputs, table, reconcile=True),
+            [calculate_payslip(data, table) for data in inputs],
+        )
+
+    def test_reconcile_reports_differences_and_saves_nothing(self):
+        before = list(Payslip.objects.filter(payroll_run=self.open_run).values_list('id', 'version'))
+
+        def off_by_a_cent(data, tax_table):
+            result = calculate_payslip(data, tax_table)
+            return dataclasses.replace(result, tax=result.tax + Decimal('0.01'))
+
+        with mock.patch('payroll.vectorized.calculate_payslip', off_by_a_cent):
+            with self.assertRaises(ReconciliationError) as raised:
+                run_payroll(self.open_run, vectorized=True, reconcile=True)
+        self.assertEqual(len(raised.exception.mismatches), len(before))
+        self.assertEqual(list(Payslip.objects.filter(payroll_run=self.open_run).values_list('id', 'version')), before)
+
+
+class PayrollJobTests(PayrollTestCase):
+    def test_one_active_job_per_run(self):
+        job = enqueue_payroll_job(self.open_run)
+        self.assertEqual(enqueue_payroll_job(self.open_run), job)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PayrollJob.objects.create(payroll_run=self.open_run)
+
+    def test_process_job(self):
+        enqueue_payroll_job(self.open_run)
+        job = claim_next_job()
+        self.assertIsNone(claim_next_job())
+
+        saved = []
+
+        def record_heartbeat(*args):
+            saved.append(PayrollJob.objects.get(pk=job.pk).heartbeat_at)
+            return save_payslips(*args)
+
+        with mock.patch('payroll.services.save_payslips', record_heartbeat):
+            job = process_job(job)
+        payslips = Payslip.objects.filter(payroll_run=self.open_run).count()
+        self.assertEqual((job.status, job.done, job.total), ('done', payslips, payslips))
+        # Renewed once the payslips were saved
+        self.assertGreater(job.heartbeat_at, saved[0])
+
+    def test_expired_lease_is_queued_again(self):
+        enqueue_payroll_job(self.open_run)
+        lost = claim_next_job()
+        stale = timezone.now() - datetime.timedelta(seconds=settings.PAYROLL_JOB_LEASE + 1)
+        PayrollJob.objects.filter(pk=lost.pk).update(heartbeat_at=stale)
+
+        job = claim_next_job()
+        self.assertEqual(job.pk, lost.pk)
+        self.assertNotEqual(job.started_at, lost.started_at)
+        # The first worker's updates no longer match the job
+        with self.assertRaises(RuntimeError), mock.patch('payroll.jobs.run_payroll', side_effect=RuntimeError):
+            process_job(lost)
+        self.assertEqual(PayrollJob.objects.get(pk=job.pk).status, 'running')
+
+    def test_status_requires_login(self):
+        job = enqueue_payroll_job(self.open_run)
+        url = reverse('payroll_job_status', args=[job.pk])
+        self.assertEqual(self.client.get(url).json()['status'], 'queued')
+        self.client.logout()
+        self.assertRedirects(self.client.get(url), f"{reverse('login')}?next={url}")
+
+
+class DirtyPayslipTests(PayrollTestCase):
+    def dirty(self):
+        return list(DirtyPayslip.objects.values_list('employee_id', 'payroll_run_id'))
+
+    def raise_salary(self, employee):
+        employee.salary += 1000
+        with self.captureOnCommitCallbacks(execute=True):
+            employee.save()
+
+    def test_salary_change_marks_one_payslip(self):
+        employee = Employee.objects.filter(status='active', is_wage_employee=False).first()
+        self.raise_salary(employee)
+        # The closed runs' payslips are never marked
+        self.assertEqual(self.dirty(), [(employee.pk, self.open_run.pk)])
+
+        self.assertEqual(recalculate_dirty_payslips(), 1)
+        self.assertEqual(self.dirty(), [])
+        payslip = Payslip.objects.get(employee=employee, payroll_run=self.open_run)
+        self.assertEqual(payslip.basic_salary, employee.salary)
+
+    def test_editing_a_payslip_recalculates_only_its_employee(self):
+        salaried = Employee.objects.filter(status='active', is_wage_employee=False).first()
+        self.raise_salary(salaried)
+        payslip = Payslip.objects.filter(payroll_run=self.open_run, worked_hours__isnull=False).first()
+        hours = payslip.worked_hours
+
+        # On commit callbacks run straight away, as they do for a request outside the test's transaction
+        with mock.patch.object(transaction, 'on_commit', lambda func, *args, **kwargs: func()):
+            response = self.client.post(reverse('update_payslip', args=[payslip.pk]), {
+                'tax': payslip.tax, 'uif': payslip.uif, 'net_pay': payslip.net_pay,
+                'normal_hours': hours.normal_hours + 8, 'overtime_hours': hours.overtime_hours,
+                'saturday_hours': hours.saturday_hours, 'sunday_public_hours': hours.sunday_public_hours,
+            })
+        self.assertRedirects(response, reverse('payslips_summary'), fetch_redirect_response=False)
+        assert_within_budget(response)
+        self.assertEqual(self.dirty(), [(salaried.pk, self.open_run.pk)])
+        payslip.refresh_from_db()
+        self.assertGreater(payslip.gross_income, hours.total_earnings)
+
+
+class PayslipPdfTests(PayrollTestCase):
+    companies = 2
+
+    def test_payslip_pdf(self):
+        payslip = Payslip.objects.filter(payroll_run=self.open_run, employee__company=self.company).first()
+        response = self.client.get(reverse('payslip_pdf', args=[payslip.pk]))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+    def test_other_companies_payslips_are_not_found(self):
+        payslip = Payslip.objects.filter(payroll_run=self.open_run).exclude(employee__company=self.company).first()
+        for name in ('payslip_pdf', 'payslip_detail'):
+            self.assertEqual(self.client.get(reverse(name, args=[payslip.pk])).status_code, 404, name)
+
+    def test_run_zip_has_only_the_users_company(self):
+        for payroll_run in (self.open_run, self.closed_run):
+            response = self.client.get(reverse('payroll_run_pdfs', args=[payroll_run.pk]))
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+            payslips = Payslip.objects.filter(payroll_run=payroll_run, employee__company=self.company)
+            self.assertEqual(
+                sorted(int(name[:-len('.pdf')].rsplit('_', 1)[1]) for name in archive.namelist()),
+                sorted(payslips.values_list('employee_id', flat=True)),
+            )
+
+
+class EmployeeImportTests(PayrollTestCase):
+    CSV = (
+        "first_name,last_name,id_number,date_joined,department,salary,is_wage_employee,hourly_rate\n"
+        "Ayanda,Qwabe,9001015800081,2024-02-01,Finance,32000,no,\n"
+        "Johan,Quixley,8507125800083,2023-07-15,Operations,,yes,95.50\n"
+        "Naledi,Qubeka,9203040800089,not a date,Admin,21000,no,\n"
+    )
+
+    def import_csv(self):
+        return import_employees(read_rows(self.CSV.encode(), 'csv'), self.company)
+
+    def test_import_creates_employees_with_balances(self):
+        result = self.import_csv()
+        self.assertEqual(result.created, 2)
+        self.assertEqual([row for row, _ in result.errors], [3])
+        self.assertIn('date_joined', result.errors[0][1])
+
+        employees = Employee.objects.filter(company=self.company, last_name__startswith='Q')
+        self.assertEqual(employees.count(), 2)
+        for employee in employees:
+            self.assertEqual(employee.leavebalance_set.count(), len(LeaveBalance.initial_balances(employee)))
+        found = Employee.objects.filter(id__in=matching_employee_ids('quixley', self.company.pk))
+        self.assertEqual([employee.first_name for employee in found], ['Johan'])
+
+    def test_importing_again_changes_nothing(self):
+        self.import_csv()
+        counts = Employee.objects.count(), LeaveBalance.objects.count()
+        result = self.import_csv()
+        self.assertEqual(result.created, 0)
+        self.assertEqual([row for row, _ in result.errors], [1, 2, 3])
+        self.assertEqual((Employee.objects.count(), LeaveBalance.objects.count()), counts)
+
+    def test_rows_before_an_unreadable_one_are_imported(self):
+        upload = SimpleUploadedFile('employees.jsonl', b'\n'.join([
+            b'{"first_name": "Ayanda", "last_name": "Qwabe", "id_number": "9001015800081",'
+            b' "date_joined": "2024-02-01", "department": "Finance", "salary": "32000"}',
+            b'{"first_name": "Johan", "last_name":',
+        ]))
+        response = self.client.post(reverse('import_employees'), {'file': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertIn("Row 2", response.json()['error'])
+        self.assertTrue(Employee.objects.filter(id_number='9001015800081').exists())
+
+
+class TimesheetTests(PayrollTestCase):
+    companies = 2
+
+    def timesheet(self, normal_hours):
+        employees = Employee.objects.filter(company=self.company, status='active', is_wage_employee=True)
+        return [{'employee_id': str(employee.pk), 'normal_hours': str(normal_hours)} for employee in employees]
+
+    def hours(self):
+        return dict(WorkedHours.objects.filter(payroll_run=self.open_run).values_list('employee_id', 'normal_hours'))
+
+    def gross_incomes(self):
+        return dict(Payslip.objects.filter(payroll_run=self.open_run).values_list('id', 'gross_income'))
+
+    def test_uploading_again_changes_nothing(self):
+        rows = self.timesheet(160)
+        first = ingest_timesheets(rows, self.open_run, self.company)
+        self.assertEqual((first.saved, first.recalculated, first.errors), (len(rows), len(rows), []))
+        hours = self.hours()
+        gross_incomes = self.gross_incomes()
+
+        again = ingest_timesheets(rows, self.open_run, self.company)
+        self.assertEqual(again.saved, len(rows))
+        self.assertEqual(self.hours(), hours)
+        self.assertEqual(self.gross_incomes(), gross_incomes)
+
+    def test_hours_replace_earlier_ones_and_update_payslips(self):
+        rows = self.timesheet(100)
+        ingest_timesheets(rows, self.open_run, self.company)
+        for row in rows:
+            payslip = Payslip.objects.select_related('worked_hours').get(
+                employee_id=row['employee_id'], payroll_run=self.open_run
+            )
+            self.assertEqual(payslip.worked_hours.normal_hours, 100)
+            self.assertEqual(payslip.gross_income, payslip.worked_hours.total_earnings)
+
+    def test_other_companies_are_left_alone(self):
+        other = Employee.objects.filter(status='active').exclude(company=self.company).first()
+        mark_payslips_dirty([other.pk], self.open_run.pk)
+        rows = self.timesheet(100) + [{'employee_id': str(other.pk), 'normal_hours': '100'}]
+
+        result = ingest_timesheets(rows, self.open_run, self.company)
+        self.assertEqual([row for row, _ in result.errors], [len(rows)])
+        self.assertEqual(result.recalculated, len(rows) - 1)
+        self.assertEqual(list(DirtyPayslip.objects.values_list('employee_id', flat=True)), [other.pk])
+
+
+class LeaveAccrualTests(PayrollTestCase):
+    def accruals(self):
+        return sorted(LeaveAccrual.objects.values_list('employee_id', 'payroll_run_id'))
+
+    def test_posted_once_for_each_closed_run(self):
+        paid = sorted(
+            Payslip.objects.filter(payroll_run__is_closed=True).values_list('employee_id', 'payroll_run_id')
+        )
+        self.assertEqual(self.accruals(), paid)
+        for balance in LeaveBalance.objects.filter(leave_type=LeaveType.ANNUAL, accruals__isnull=False).distinct():
+            self.assertEqual(balance.accrued_days, sum(accrual.days for accrual in balance.accruals.all()))
+
+    def test_closing_again_posts_nothing(self):
+        accruals = self.accruals()
+        self.assertEqual(post_leave_accruals(self.closed_run), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.closed_run.save()
+        self.assertEqual(self.accruals(), accruals)
+
+    def test_closing_a_run_posts_its_accruals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.open_run.is_closed = True
+            self.open_run.save()
+        posted = LeaveAccrual.objects.filter(payroll_run=self.open_run)
+        self.assertEqual(posted.count(), Payslip.objects.filter(payroll_run=self.open_run).count())
+        self.assertTrue(all(accrual.days == LeaveBalance.MONTHLY_ANNUAL_ACCRUAL for accrual in posted))
+
+
+class EmployeeSearchTests(PayrollTestCase):
+    companies = 2
+
+    def queries(self):
+        employee = Employee.objects.filter(company=self.company).first()
+        return [
+            employee.last_name, employee.last_name[:3].upper(), employee.id_number[:6],
+            f"{employee.first_name} {employee.last_name[:2]}", 'van der', 'Zanéle', 'nobody', 'a',
+        ]
+
+    def scanned(self, query):
+        """Ids found by checking every employee's words, the slow way."""
+        words = search_words(query)
+        return {
+            employee.pk for employee in Employee.objects.filter(company=self.company)
+            if all(
+                any(term.startswith(word) for term in search_words(
+                    f"{employee.first_name} {employee.last_name} {employee.id_number}"
+                ))
+                for word in words
+            )
+        }
+
+    def found(self, query):
+        return set(Employee.objects.filter(id__in=matching_employee_ids(query, self.company.pk)).values_list(
+            'id', flat=True
+        ))
+
+    def test_index_and_fallback_find_the_same_employees(self):
+        fts = {query: self.found(query) for query in self.queries()}
+        with mock.patch('payroll.search.uses_fts', return_value=False):
+            rebuild_index()
+            terms = {query: self.found(query) for query in self.queries()}
+        self.assertTrue(fts[self.queries()[0]])
+        for query in self.queries():
+            self.assertEqual(fts[query], self.scanned(query), query)
+            self.assertEqual(terms[query], fts[query], query)
+
+    def test_renamed_employee_is_reindexed(self):
+        employee = Employee.objects.filter(company=self.company).first()
+        employee.last_name = 'Xolani-Quagmire'
+        employee.save()
+        self.assertEqual(self.found('quagmire'), {employee.pk})
+        employee.delete()
+        self.assertEqual(self.found('quagmire'), set())
+
+
+class CursorPaginationTests(PayrollTestCase):
+    ordering = ('last_name', 'first_name', 'id')
+
+    def setUp(self):
+        super().setUp()
+        self.employees = Employee.objects.filter(company=self.company)
+        self.paginator = CursorPaginator(self.employees, 7, self.ordering)
+
+    def test_round_trip(self):
+        expected = list(self.employees.order_by(*self.ordering).values_list('id', flat=True))
+
+        pages, page = [], self.paginator.get_page()
+        self.assertFalse(page.has_previous())
+        while True:
+            pages.append([employee.pk for employee in page])
+            if not page.has_next():
+                break
+            page = self.paginator.get_page(page.next_cursor)
+        self.assertEqual([pk for ids in pages for pk in ids], expected)
+
+        backwards = []
+        while page.has_previous():
+            page = self.paginator.get_page(page.previous_cursor)
+            backwards.append([employee.pk for employee in page])
+        self.assertEqual(backwards, pages[-2::-1])
+
+    def test_tampered_cursor_gives_first_page(self):
+        second = self.paginator.get_page(self.paginator.get_page().next_cursor)
+        tampered = second.next_cursor[:-4] + 'abcd'
+        first = self.paginator.get_page(tampered)
+        self.assertEqual(list(first), list(self.paginator.get_page()))
+        self.assertFalse(first.has_previous())
+
+
+    def test_employee_list_links_keep_the_search(self):
+        matching = set(
+            self.employees.filter(id__in=matching_employee_ids('m', self.company.pk)).values_list('id', flat=True)
+        )
+        self.assertGreater(len(matching), 10)
+        seen, query = [], 'q=m&cursor='
+        while query is not None:
+            page = self.client.get(f"{reverse('employee_list')}?{query}").context['employees']
+            seen.extend(employee.pk for employee in page)
+            query = page.next_query if page.has_next() else None
+            self.assertTrue(query is None or 'q=m' in query)
+        self.assertEqual(sorted(seen), sorted(matching))
+
+
+class ApiTests(PayrollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.payslip = Payslip.objects.filter(payroll_run=self.open_run, worked_hours__isnull=False).first()
+
+    def get(self, url, etag=None, **params):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(url, params, headers=headers)
+
+    def assertChangesEtag(self, url, change, **params):
+        etag = self.get(url, **params)['ETag']
+        self.assertEqual(self.get(url, etag, **params).status_code, 304)
+        change()
+        response = self.get(url, etag, **params)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def test_payslip_fields(self):
+        url = reverse('api_payslip', args=[self.payslip.pk])
+        data = self.get(url, fields='id,net_pay,employee').json()
+        self.assertEqual(set(data), {'id', 'net_pay', 'employee'})
+        self.assertEqual(self.get(url, fields='id,nope').status_code, 400)
+        self.assertEqual(set(self.get(url, ytd='1').json()['ytd']), set(PayslipQuerySet.YTD_FIELDS))
+
+    def test_payslip_etag_follows_the_employee(self):
+        employee = self.payslip.employee
+
+        def rename():
+            employee.first_name = 'Renamed'
+            employee.save()
+
+        response = self.assertChangesEtag(reverse('api_payslip', args=[self.payslip.pk]), rename)
+        self.assertEqual(response.json()['employee']['first_name'], 'Renamed')
+
+    def test_payslip_etag_follows_the_worked_hours(self):
+        def add_hours():
+            hours = self.payslip.worked_hours
+            hours.normal_hours += 1
+            hours.save()
+
+        self.assertChangesEtag(reverse('api_payslip', args=[self.payslip.pk]), add_hours)
+
+    def test_run_payslips_etag_follows_earlier_runs_with_ytd(self):
+        earlier = Payslip.objects.get(employee=self.payslip.employee, payroll_run=self.closed_run)
+
+        def edit_earlier():
+            earlier.tax += 1
+            earlier.save()
+
+        self.assertChangesEtag(reverse('api_run_payslips', args=[self.open_run.pk]), edit_earlier, ytd='1')
+
+    def test_other_companies_payslips_are_not_found(self):
+        other = Company.objects.create(code='OTHER01', name='Other')
+        self.user.company = other
+        self.user.save()
+        self.assertEqual(self.get(reverse('api_payslip', args=[self.payslip.pk])).status_code, 404)
+        self.assertEqual(self.get(reverse('api_run_payslips', args=[self.open_run.pk])).json()['results'], [])
+
+
+class RunTotalsTests(PayrollTestCase):
+    def summed(self, payroll_run):
+        """The run's totals added up in Python."""
+        totals = dict.fromkeys(RunTotals.AMOUNT_FIELDS, Decimal('0.00'))
+        payslips = Payslip.objects.filter(payroll_run=payroll_run).select_related('worked_hours')
+        for payslip in payslips:
+            for field in ('basic_salary', 'gross_income', 'tax', 'uif', 'sdl', 'net_pay'):
+                totals[field] += getattr(payslip, field) or 0
+            if payslip.worked_hours is not None:
+                for field in ('normal_earnings', 'overtime_earnings', 'saturday_earnings', 'sunday_earnings'):
+                    totals[field] += getattr(payslip.worked_hours, field)
+                totals['wages'] += payslip.worked_hours.total_earnings
+        totals['headcount'] = len(payslips)
+        return totals
+
+    def stored(self, payroll_run):
+        totals = RunTotals.objects.get(payroll_run=payroll_run)
+        return {field: getattr(totals, field) for field in ['headcount', *RunTotals.AMOUNT_FIELDS]}
+
+    def test_totals_match_the_payslips(self):
+        for payroll_run in PayrollRun.objects.all():
+            self.assertEqual(self.stored(payroll_run), self.summed(payroll_run), payroll_run)
+
+    def test_editing_a_payslip_refreshes_open_totals_only(self):
+        frozen = self.stored(self.closed_run)
+        with self.captureOnCommitCallbacks(execute=True):
+            for payroll_run in (self.open_run, self.closed_run):
+                payslip = Payslip.objects.filter(payroll_run=payroll_run).first()
+                payslip.net_pay += 100
+                payslip.save()
+        self.assertEqual(self.stored(self.open_run), self.summed(self.open_run))
+        self.assertEqual(self.stored(self.closed_run), frozen)
+
+    def test_summary_rows_add_up_to_the_totals(self):
+        now = datetime.datetime(2025, 6, 15, 12, tzinfo=datetime.timezone.utc)
+        with mock.patch('payroll.views.timezone.now', return_value=now):
+            response = self.client.get(reverse('payslips_summary'))
+        totals = response.context['totals']
+        self.assertEqual(totals.headcount, response.context['payslips'].paginator.count)
+        self.assertEqual(totals.net_pay, self.summed(self.open_run)['net_pay'])
+
+
+class SnapshotTests(PayrollTestCase):
+    def live_payslips(self):
+        return {
+            payslip.pk: payslip
+            for payslip in Payslip.objects.filter(payroll_run=self.closed_run).with_ytd().select_related('worked_hours')
+        }
+
+    def test_snapshot_matches_live_payslips(self):
+        snapshot = RunSnapshot.objects.get(payroll_run=self.closed_run)
+        self.assertTrue(verify_snapshot(snapshot))
+        self.assertGreater(len(snapshot.group_offsets), 1)
+
+        live = self.live_payslips()
+        archived = list(snapshot_payslips(snapshot, self.company))
+        self.assertEqual(sorted(payslip.pk for payslip in archived), sorted(live))
+        for payslip in archived:
+            expected = live[payslip.pk]
+            for field in ('basic_salary', 'gross_income', 'tax', 'uif', 'net_pay'):
+                self.assertEqual(getattr(payslip, field), getattr(expected, field), field)
+            for field in PayslipQuerySet.YTD_FIELDS:
+                self.assertEqual(
+                    getattr(payslip, f'{field}_ytd'), Decimal(getattr(expected, f'{field}_ytd')).quantize(CENTS), field
+                )
+            if expected.worked_hours is not None:
+                self.assertEqual(payslip.worked_hours.total_earnings, expected.worked_hours.total_earnings)
+
+    def test_archive_run(self):
+        april = PayrollRun.objects.get(period_start=datetime.date(2025, 4, 1))
+        headers, rows = payslip_export(april, self.company)
+        before = list(rows)
+        payslip = Payslip.objects.filter(payroll_run=april).order_by('-id').first()
+
+        with self.assertRaises(ValueError):
+            archive_run(april, today=TODAY)
+        self.assertEqual(archive_run(april, today=datetime.date(2026, 3, 1)), len(before))
+        self.assertFalse(Payslip.objects.filter(payroll_run=april).exists())
+
+        headers, rows = payslip_export(april, self.company)
+        self.assertEqual(list(rows), before)
+        with assert_max_queries(1):
+            archived = archived_payslip(payslip.pk)
+        self.assertEqual((archived.pk, archived.net_pay), (payslip.pk, payslip.net_pay))
+        response = self.client.get(reverse('payslip_detail', args=[payslip.pk]))
+        self.assertContains(response, payslip.employee.last_name)
+
+    def test_closed_run_payslips_cannot_be_edited(self):
+        payslip = Payslip.objects.filter(payroll_run=self.closed_run, basic_salary__isnull=False).first()
+        response = self.client.post(reverse('update_payslip', args=[payslip.pk]), {
+            'basic_salary': payslip.basic_salary, 'tax': 0, 'uif': payslip.uif, 'net_pay': payslip.net_pay,
+        })
+        self.assertRedirects(response, reverse('payslips_summary'), fetch_redirect_response=False)
+        self.assertEqual(Payslip.objects.get(pk=payslip.pk).tax, payslip.tax)
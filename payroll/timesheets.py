@@ -0,0 +1,179 @@
+"""
+Bulk timesheet ingestion.
+
+Worked hours for a payroll run are read as a stream (see imports.read_rows)
+and upserted in batches with one INSERT ... ON CONFLICT per batch, keyed on
+(employee, payroll_run), with the earnings worked out at the employee's
+current rate. The payslips of employees whose hours arrived are marked out
+of date in the same transaction as each batch, then recalculated.
+"""
+import csv
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import Employee, WorkedHours
+from .services import mark_payslips_dirty, recalculate_dirty_payslips
+
+# Rows validated and written per statement
+TIMESHEET_BATCH_SIZE = 2000
+
+HOURS_FIELDS = ['normal_hours', 'overtime_hours', 'saturday_hours', 'sunday_public_hours']
+
+
+@dataclass
+class TimesheetResult:
+    saved: int = 0
+    recalculated: int = 0
+    # (row number, {field: [messages]}), row numbers counting from 1
+    errors: list = field(default_factory=list)
+    # Set when the stream could not be read to the end; the rows before it are saved
+    read_error: str = ''
+
+    @property
+    def error_count(self):
+        return len(self.errors)
+
+
+def _clean_row(row):
+    """Returns (employee key, hours, errors) for one raw row."""
+    if not isinstance(row, dict):
+        return None, None, {'__all__': ["Expected an object with employee and hours fields"]}
+
+    errors = {}
+    key = None
+    employee_id = str(row.get('employee_id') or '').strip()
+    id_number = str(row.get('id_number') or '').strip()
+    if employee_id:
+        if employee_id.isdigit():
+            key = ('id', int(employee_id))
+        else:
+            errors['employee_id'] = [f"'{employee_id}' is not a valid employee number."]
+    elif id_number:
+        key = ('id_number', id_number)
+    else:
+        errors['employee_id'] = ["Give the employee_id or id_number of the employee."]
+
+    hours = {}
+    for name in HOURS_FIELDS:
+        raw = row.get(name)
+        if isinstance(raw, str):
+            raw = raw.strip()
+        try:
+            value = WorkedHours._meta.get_field(name).clean(raw if raw not in (None, '') else 0, None)
+        except ValidationError as e:
+            errors[name] = e.messages
+            continue
+        if value < 0:
+            errors[name] = ["Hours cannot be negative."]
+        hours[name] = Decimal(value)
+    return key, hours, errors
+
+
+def _ingest_batch(batch, payroll_run, company, seen, result):
+    cleaned = []
+    for row_number, row in batch:
+        key, hours, errors = _clean_row(row)
+        if errors:
+            result.errors.append((row_number, errors))
+        else:
+            cleaned.append((row_number, key, hours))
+
+    ids = [value for _, (kind, value), _ in cleaned if kind == 'id']
+    id_numbers = [value for _, (kind, value), _ in cleaned if kind == 'id_number']
+    employees = Employee.objects.filter(Q(id__in=ids) | Q(id_number__in=id_numbers)).only(
+        'id', 'id_number', 'first_name', 'last_name', 'hourly_rate', 'is_wage_employee', 'company_id'
+    )
+    if company is not None:
+        employees = employees.filter(company=company)
+    by_id, by_id_number = {}, {}
+    for employee in employees:
+        by_id[employee.id] = employee
+        by_id_number.setdefault(employee.id_number, []).append(employee)
+
+    worked_hours = []
+    for row_number, (kind, value), hours in cleaned:
+        if kind == 'id':
+            employee = by_id.get(value)
+        else:
+            matches = by_id_number.get(value, [])
+            if len(matches) > 1:
+                result.errors.append((row_number, {'id_number': [f"More than one employee has ID number {value}; use employee_id."]}))
+                continue
+            employee = matches[0] if matches else None
+        if employee is None:
+            result.errors.append((row_number, {kind if kind == 'id_number' else 'employee_id': [f"No employee {value}."]}))
+            continue
+        if not employee.is_wage_employee:
+            result.errors.append((row_number, {'employee_id': [f"{employee} is not a wage employee."]}))
+            continue
+        if employee.id in seen:
+            result.errors.append((row_number, {'employee_id': [f"{employee} appears more than once in this timesheet."]}))
+            continue
+        seen.add(employee.id)
+
+        wh = WorkedHours(employee=employee, payroll_run=payroll_run, **hours)
+        wh.calculate_earnings(employee.hourly_rate or 0)
+        worked_hours.append(wh)
+
+    # Bulk writes send no signals, so the payslips are marked here, with the hours
+    with transaction.atomic():
+        WorkedHours.objects.bulk_create(
+            worked_hours,
+            update_conflicts=True,
+            unique_fields=['employee', 'payroll_run'],
+            update_fields=HOURS_FIELDS + WorkedHours.EARNINGS_FIELDS,
+        )
+        if worked_hours:
+            employee_ids = [wh.employee_id for wh in worked_hours]
+            # An upsert can't increment, so bump the versions of the rows it wrote here
+            WorkedHours.objects.filter(payroll_run=payroll_run, employee_id__in=employee_ids).update(
+                version=F('version') + 1
+            )
+            mark_payslips_dirty(employee_ids, payroll_run.pk)
+    result.saved += len(worked_hours)
+
+
+def ingest_timesheets(rows, payroll_run, company=None, batch_size=TIMESHEET_BATCH_SIZE, recalculate=True):
+    """
+    Upserts worked hours for ``payroll_run`` from an iterable of dicts with
+    an ``employee_id`` or ``id_number`` and any of the hours fields (missing
+    hours count as 0), optionally limited to ``company``'s employees. The
+    affected payslips are marked dirty and, with ``recalculate``,
+    recalculated; other payslips pending in the run are left for their own
+    recalculation. Invalid rows are skipped and reported in the result. If
+    the stream can't be read to the end, the rows before the bad one are
+    saved and the error is set on the result.
+    """
+    if payroll_run.is_closed:
+        raise ValueError(f"{payroll_run} is closed")
+
+    result = TimesheetResult()
+    seen = set()
+    batch = []
+    rows = iter(rows)
+    row_number = 0
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            break
+        except (ValueError, csv.Error) as e:
+            # Earlier batches are saved and marked, so recalculate them below
+            result.read_error = f"Row {row_number + 1}: {e}"
+            break
+        row_number += 1
+        batch.append((row_number, row))
+        if len(batch) >= batch_size:
+            _ingest_batch(batch, payroll_run, company, seen, result)
+            batch = []
+    if batch:
+        _ingest_batch(batch, payroll_run, company, seen, result)
+    result.errors.sort(key=lambda error: error[0])
+
+    if seen and recalculate:
+        result.recalculated = recalculate_dirty_payslips(payroll_run, employee_ids=list(seen))
+    return result
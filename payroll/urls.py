@@ -2,24 +2,38 @@ from django.conf import settings
 from django.shortcuts import render
 from django.urls import path
 from django.conf.urls.static import static
-from .views import dashboard, create_employee, employee_list, employee_detail, edit_employee, custom_login_view, register, payslip_detail, payslips_summary, update_payslip, leave_summary, edit_leave_balances
+from .views import dashboard, create_employee, employee_list, employee_register_export, import_employees_view, employee_detail, edit_employee, custom_login_view, register, payslip_detail, payslip_pdf, payroll_run_pdfs, payroll_run_export, payslips_summary, run_payroll_view, upload_timesheets, payroll_job_status, update_payslip, leave_summary, edit_leave_balances, api_runs, api_run, api_run_payslips, api_payslip, api_employees, api_employee
 from django.contrib.auth.views import LogoutView
 
 
 urlpatterns = [
     path('', dashboard, name='dashboard'),
     path('employees', employee_list, name='employee_list'),
+    path('employees/export.<str:fmt>', employee_register_export, name='employee_register_export'),
     path('create/', create_employee, name='create_employee'),
+    path('employees/import/', import_employees_view, name='import_employees'),
     path('<int:pk>/', employee_detail, name='employee_detail'),
     path('employees/<int:pk>/edit/', edit_employee, name='edit_employee'),
     path('login/', custom_login_view, name='login'),
     path('register/', register, name='register'),
     path('logout/', LogoutView.as_view(next_page='login'), name='logout'),
     path("payslips/summary/", payslips_summary, name="payslips_summary"),
+    path("payslips/run/", run_payroll_view, name="run_payroll"),
+    path("payslips/jobs/<int:pk>/", payroll_job_status, name="payroll_job_status"),
+    path("payslips/runs/<int:pk>/timesheets/", upload_timesheets, name="upload_timesheets"),
     path('payslip/<int:pk>/', payslip_detail, name='payslip_detail'),
+    path('payslip/<int:pk>/pdf/', payslip_pdf, name='payslip_pdf'),
+    path('payslips/runs/<int:pk>/pdfs.zip', payroll_run_pdfs, name='payroll_run_pdfs'),
+    path('payslips/runs/<int:pk>/export.<str:fmt>', payroll_run_export, name='payroll_run_export'),
     path('payslip/update/<int:payslip_id>/', update_payslip, name='update_payslip'),
     path("leave/summary/", leave_summary, name="leave_summary"),
     path("edit_leave_balances/<int:pk>/", edit_leave_balances, name='edit_leave_balances'),
+    path("api/runs/", api_runs, name="api_runs"),
+    path("api/runs/<int:pk>/", api_run, name="api_run"),
+    path("api/runs/<int:pk>/payslips/", api_run_payslips, name="api_run_payslips"),
+    path("api/payslips/<int:pk>/", api_payslip, name="api_payslip"),
+    path("api/employees/", api_employees, name="api_employees"),
+    path("api/employees/<int:pk>/", api_employee, name="api_employee"),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 
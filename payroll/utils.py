@@ -1,5 +1,10 @@
+import time
+from bisect import bisect_left
 from decimal import Decimal, ROUND_HALF_UP
-from .models import ContributionType, TaxBracket 
+
+from django.core.cache import cache
+
+from .models import Company, ContributionType, Employee, TaxBracket
 
 
 def calculate_contribution(contribution_type, gross_income):
@@ -38,11 +43,102 @@ def calculate_contribution(contribution_type, gross_income):
     return employee_amount, employer_amount
 
 
+class TaxTable:
+    """
+    Immutable, pre-sorted copy of the tax brackets for one tax year.
+    Brackets are found with a binary search instead of a database query.
+    """
+    __slots__ = ('tax_year', 'rows', '_upper_limits')
+
+    def __init__(self, tax_year, rows):
+        # rows: (lower_limit, upper_limit, base_tax, marginal_rate) per bracket
+        rows = tuple(sorted((tuple(row) for row in rows), key=lambda row: row[0]))
+        if any(row[1] is None for row in rows[:-1]):
+            raise ValueError(f"Only the top {tax_year} tax bracket may have no upper limit")
+        upper_limits = tuple(row[1] for row in rows if row[1] is not None)
+        object.__setattr__(self, 'tax_year', tax_year)
+        object.__setattr__(self, 'rows', rows)
+        # The open-ended top bracket never needs a search key
+        object.__setattr__(self, '_upper_limits', upper_limits)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TaxTable is immutable")
+
+    def __reduce__(self):
+        return (TaxTable, (self.tax_year, self.rows))
+
+    @classmethod
+    def from_queryset(cls, tax_year, queryset):
+        return cls(tax_year, queryset.values_list('lower_limit', 'upper_limit', 'base_tax', 'marginal_rate'))
+
+    def calculate(self, income, rebate=Decimal('0.00')):
+        # First bracket whose upper limit covers the income, same as walking them in order
+        index = bisect_left(self._upper_limits, income)
+        if index >= len(self.rows):
+            return Decimal('0.00')
+        lower_limit, _, base_tax, marginal_rate = self.rows[index]
+        tax_before_rebate = base_tax + ((income - lower_limit) * (marginal_rate / 100))
+        return max(tax_before_rebate - rebate, Decimal('0.00'))
+
+
+# Compiled tax tables by tax year, shared by everything in this process.
+# Cleared by the TaxBracket save/delete signals in payroll.signals.
+_tax_tables = {}
+
+
+def get_tax_table(tax_year):
+    table = _tax_tables.get(tax_year)
+    if table is None:
+        table = TaxTable.from_queryset(tax_year, TaxBracket.objects.filter(tax_year=tax_year))
+        _tax_tables[tax_year] = table
+    return table
+
+
+def clear_tax_tables():
+    _tax_tables.clear()
+
+
 def calculate_tax(income, tax_year, rebate=Decimal('0.00')):
-    brackets = TaxBracket.objects.filter(tax_year=tax_year).order_by('lower_limit')
-    for bracket in brackets:
-        if bracket.upper_limit is None or income <= bracket.upper_limit:
-            tax_before_rebate = bracket.base_tax + ((income - bracket.lower_limit) * (bracket.marginal_rate / 100))
-            tax_after_rebate = max(tax_before_rebate - rebate, Decimal('0.00'))
-            return tax_after_rebate
-    return Decimal('0.00')
+    return get_tax_table(tax_year).calculate(income, rebate)
+
+
+# Per-company values shown on every page, cached under a version number that
+# payroll.signals bumps whenever an employee or the company changes. Bulk
+# writes that send no signals call invalidate_company_cache() themselves.
+COMPANY_CACHE_TIMEOUT = 60 * 60
+
+
+def _company_cache_version(company_id):
+    key = f'payroll:company:{company_id}:version'
+    version = cache.get(key)
+    if version is None:
+        # Time-based, so a version lost from the cache is never reused
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_company_cache(company_id):
+    try:
+        cache.incr(f'payroll:company:{company_id}:version')
+    except ValueError:
+        pass  # No version yet: the next read starts a new one
+
+
+def get_cached_company(company_id):
+    version = _company_cache_version(company_id)
+    company = cache.get(f'payroll:company:{company_id}', version=version)
+    if company is None:
+        company = Company.objects.filter(pk=company_id).first()
+        if company is not None:
+            cache.set(f'payroll:company:{company_id}', company, COMPANY_CACHE_TIMEOUT, version=version)
+    return company
+
+
+def get_active_employee_count(company_id):
+    version = _company_cache_version(company_id)
+    count = cache.get(f'payroll:company:{company_id}:active_employees', version=version)
+    if count is None:
+        count = Employee.objects.filter(company_id=company_id, status='active').count()
+        cache.set(f'payroll:company:{company_id}:active_employees', count, COMPANY_CACHE_TIMEOUT, version=version)
+    return count
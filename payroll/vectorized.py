@@ -0,0 +1,166 @@
+"""
+NumPy implementation of the payslip calculation for very large runs.
+
+All money is handled as int64 cents and every division is done exactly in
+integers before rounding half up, so results can be reconciled to the cent
+against the Decimal path in payroll.services.calculate_payslip.
+
+NumPy is optional: it is only imported when this module is used.
+"""
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .services import (
+    PayslipResult, SDL_RATE, UIF_CEILING, UIF_RATE, calculate_payslip, gross_income_for, rebate_for_age,
+)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+def _require_numpy():
+    if np is None:
+        raise ImproperlyConfigured("The vectorized payroll calculator requires NumPy (pip install numpy).")
+
+
+def to_cents(value):
+    cents = Decimal(value or 0).scaleb(2)
+    whole = int(cents)
+    if whole != cents:
+        raise ValueError(f"{value} is not a whole number of cents")
+    return whole
+
+
+def to_basis_points(rate):
+    # 1% = 100 basis points
+    points = Decimal(rate) * 10000
+    if points != points.to_integral_value():
+        raise ValueError(f"Rate {rate} is finer than a basis point")
+    return int(points)
+
+
+def _round_half_up(numerator, denominator):
+    # Exact integer division rounded half up, for non-negative numerators
+    return (2 * numerator + denominator) // (2 * denominator)
+
+
+def compile_brackets(tax_table):
+    """Converts a TaxTable into int64 arrays (cents / basis points)."""
+    _require_numpy()
+    rows = tax_table.rows
+    return {
+        'lower': np.array([to_cents(row[0]) for row in rows], dtype=np.int64),
+        'upper': np.array([to_cents(row[1]) for row in rows if row[1] is not None], dtype=np.int64),
+        'base': np.array([to_cents(row[2]) for row in rows], dtype=np.int64),
+        # marginal_rate is stored as a percentage, e.g. 18 for 18%
+        'rate': np.array([to_basis_points(row[3] / 100) for row in rows], dtype=np.int64),
+    }
+
+
+def calculate_arrays(gross, ytd_income, months_paid, rebate, tax_table):
+    """
+    Calculates monthly tax, UIF, SDL and net pay for whole arrays of
+    employees. ``gross``, ``ytd_income`` and ``rebate`` are int64 cents,
+    ``months_paid`` counts earlier payslips in the tax year.
+    Returns a dict of int64 cent arrays.
+    """
+    _require_numpy()
+    gross = np.asarray(gross, dtype=np.int64)
+    ytd_income = np.asarray(ytd_income, dtype=np.int64)
+    rebate = np.asarray(rebate, dtype=np.int64)
+    months = np.asarray(months_paid, dtype=np.int64) + 1
+    brackets = compile_brackets(tax_table)
+    bracket_count = len(brackets['lower'])
+
+    # Annualised income is annual_num / months cents, kept as an exact fraction
+    annual_num = (ytd_income + gross) * 12
+
+    # First bracket whose upper limit covers the income. searchsorted on the
+    # float value can be one bracket off at a boundary, so correct it exactly.
+    upper = brackets['upper']
+    index = np.searchsorted(upper, annual_num / months, side='left')
+    if len(upper):
+        step_back = (index > 0) & (upper[np.maximum(index - 1, 0)] * months >= annual_num)
+        index = index - step_back
+        clipped = np.minimum(index, len(upper) - 1)
+        step_on = (index < len(upper)) & (upper[clipped] * months < annual_num)
+        index = index + step_on
+
+    taxed = index < bracket_count
+    index = np.minimum(index, max(bracket_count - 1, 0))
+    if bracket_count:
+        lower = brackets['lower'][index]
+        base = brackets['base'][index]
+        rate = brackets['rate'][index]
+        # Annual tax after rebate = base + (income - lower) * rate - rebate,
+        # as numerator / (months * 10000); the monthly figure divides by 12 more
+        numerator = (base - rebate) * months * 10000 + (annual_num - lower * months) * rate
+        denominator = months * 10000 * 12
+        tax = np.where(taxed & (numerator > 0), _round_half_up(np.maximum(numerator, 0), denominator), 0)
+    else:
+        tax = np.zeros_like(gross)
+
+    uif = _round_half_up(np.minimum(gross, to_cents(UIF_CEILING)) * to_basis_points(UIF_RATE), 10000)
+    sdl = _round_half_up(gross * to_basis_points(SDL_RATE), 10000)
+
+    return {
+        'gross': gross,
+        'tax': tax.astype(np.int64),
+        'uif': uif,
+        'sdl': sdl,
+        'net_pay': gross - tax - uif - sdl,
+    }
+
+
+class ReconciliationError(Exception):
+    def __init__(self, mismatches):
+        self.mismatches = mismatches
+        super().__init__(f"{len(mismatches)} payslips differ from the Decimal calculation")
+
+
+def calculate_payslips_vectorized(inputs, tax_table, reconcile=False):
+    """
+    Vectorized equivalent of calculating each PayslipInput with
+    calculate_payslip. With ``reconcile``, every result is also computed on
+    the Decimal path and ReconciliationError lists (input, vectorized,
+    decimal) for any payslip that differs by a cent or more.
+    """
+    _require_numpy()
+    arrays = calculate_arrays(
+        [to_cents(gross_income_for(data)) for data in inputs],
+        [to_cents(data.ytd_income) for data in inputs],
+        [data.months_paid for data in inputs],
+        [to_cents(rebate_for_age(data.age)) for data in inputs],
+        tax_table,
+    )
+
+    def money(cents):
+        return Decimal(cents).scaleb(-2)
+
+    columns = zip(*(arrays[key].tolist() for key in ('gross', 'tax', 'uif', 'sdl', 'net_pay')))
+    results = [
+        PayslipResult(
+            employee_id=data.employee_id,
+            basic_salary=None if data.is_wage_employee else money(gross),
+            gross_income=money(gross),
+            tax=money(tax),
+            uif=money(uif),
+            sdl=money(sdl),
+            net_pay=money(net_pay),
+        )
+        for data, (gross, tax, uif, sdl, net_pay) in zip(inputs, columns)
+    ]
+
+    if reconcile:
+        mismatches = []
+        for data, result in zip(inputs, results):
+            expected = calculate_payslip(data, tax_table)
+            if result != expected:
+                mismatches.append((data, result, expected))
+        if mismatches:
+            raise ReconciliationError(mismatches)
+
+    return results
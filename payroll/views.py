@@ -1,18 +1,31 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 from decimal import Decimal
 from django.contrib import messages
 from .forms import EmployeeForm, LeaveBalanceForm
-from .models import Employee, Company, Payslip, PayrollRun, WorkedHours, LeaveType, LeaveBalance, LeaveRequest
+from .models import Employee, Company, Payslip, PayrollRun, PayrollJob, RunSummary, RunTotals, WorkedHours, LeaveType, LeaveBalance, LeaveRequest
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import condition, require_GET, require_POST
+from django.utils.cache import patch_cache_control
+from django.utils.http import url_has_allowed_host_and_scheme
 from .forms import CompanyLoginForm
 from .forms import CustomUserCreationForm, PayslipForm, WorkedHoursForm
-from django.core.paginator import Paginator
-from django.db.models import Q, Sum
 import datetime
+import io
+import os
 from datetime import date, timedelta
-from payroll.utils import calculate_tax
+from payroll.services import get_month_bounds, get_payroll_run_for, payslip_totals, recalculate_dirty_payslips
+from payroll.jobs import enqueue_payroll_job
+from payroll.exports import EXPORT_FORMATS, employee_export, payslip_export
+from payroll.imports import import_employees, read_rows
+from payroll import api
+from payroll.pagination import CursorPaginator, paginate
+from payroll.search import matching_employee_ids
+from payroll.snapshots import archived_payslip
+from payroll.timesheets import ingest_timesheets
+from payroll.pdf import iter_run_pdfs, pdf_payslips, payslip_pdf_data, payslip_pdf_filename, render_payslip_pdf, stream_zip
 
 
 
@@ -22,22 +35,40 @@ VALID_STATUSES = [
 ]
 
 
-@login_required
-def dashboard(request):
-    payslips = Payslip.objects.all()
+# Payroll runs shown in the dashboard trend chart
+DASHBOARD_RUNS = 12
 
-    labels = [f"{p.employee.first_name} {p.employee.last_name}" for p in payslips]
-    basic_salaries = [float(p.basic_salary or 0) for p in payslips]
+# Listing orders; each ends in a unique field so cursor pagination is stable
+EMPLOYEE_ORDERING = ('last_name', 'first_name', 'id')
+PAYSLIP_ORDERING = ('employee__last_name', 'employee__first_name', 'id')
 
-    tax_total = payslips.aggregate(Sum('tax'))['tax__sum'] or 0
-    net_pay_total = payslips.aggregate(Sum('net_pay'))['net_pay__sum'] or 0
 
-    context = {
-        'labels': labels,
-        'basic_salaries': basic_salaries,
-        'tax_total': tax_total,
-        'net_pay_total': net_pay_total,
+@login_required
+def dashboard(request):
+    # Materialized per-run totals for the user's company, newest first
+    summaries = list(
+        RunSummary.objects.filter(company_id=request.user.company_id)
+        .select_related('payroll_run').order_by('-payroll_run__period_start')[:DASHBOARD_RUNS]
+    )
+    latest = summaries[0] if summaries else None
+    trend = list(reversed(summaries))
+    departments = sorted(latest.departments.items()) if latest else []
+    top_earners = latest.top_earners if latest else []
+
+    # Rendered with json_script, as labels are department and employee names
+    charts = {
+        'trend_labels': [s.payroll_run.period_start.strftime('%b %Y') for s in trend],
+        'trend_gross': [float(s.gross_income) for s in trend],
+        'trend_net': [float(s.net_pay) for s in trend],
+        'department_labels': [name for name, _ in departments],
+        'department_gross': [float(totals['gross_income']) for _, totals in departments],
+        'department_headcount': [totals['headcount'] for _, totals in departments],
+        'top_labels': [earner['name'] for earner in top_earners],
+        'top_gross': [float(earner['gross_income']) for earner in top_earners],
+        'tax_total': float(latest.tax) if latest else 0,
+        'net_pay_total': float(latest.net_pay) if latest else 0,
     }
+    context = {'summary': latest, 'charts': charts}
     return render(request, 'payroll/dashboard.html', context)
 
 
@@ -50,18 +81,12 @@ def employee_list(request):
 
     # Apply search
     if query:
-        employees = employees.filter(
-            Q(first_name__icontains=query) |
-            Q(last_name__icontains=query) |
-            Q(id_number__icontains=query)
-        )
+        employees = employees.filter(id__in=matching_employee_ids(query, request.user.company_id))
 
     if status_filter in VALID_STATUSES:
         employees = employees.filter(status=status_filter) 
 
-    paginator = Paginator(employees, 10)
-    page_number = request.GET.get("page")
-    employees = paginator.get_page(page_number)
+    employees = paginate(request, employees, 10, EMPLOYEE_ORDERING)
 
     return render(request, 'employees/employee_list.html', {
         'employees': employees
@@ -103,6 +128,55 @@ def edit_employee(request, pk):
     return redirect('employee_detail', pk=employee.pk)
 
 
+# Row errors returned by the import endpoint; the count covers them all
+MAX_REPORTED_IMPORT_ERRORS = 500
+
+
+def _uploaded_rows(request):
+    """
+    Returns (rows, error) for an uploaded CSV, JSON or JSON Lines ``file``,
+    or a JSON array posted as the request body.
+    """
+    upload = request.FILES.get('file')
+    if upload is not None:
+        fmt = request.POST.get('format') or os.path.splitext(upload.name)[1].lstrip('.').lower()
+        stream = upload.file
+    elif request.content_type == 'application/json':
+        fmt, stream = 'json', io.BytesIO(request.body)
+    else:
+        return None, "Upload a file or post a JSON array."
+    if fmt not in ('csv', 'json', 'jsonl'):
+        return None, f"Unsupported file format: {fmt or 'unknown'}"
+    return read_rows(stream, fmt), None
+
+
+@login_required
+@require_POST
+def import_employees_view(request):
+    """
+    Bulk-creates employees in the user's company from an uploaded file or
+    a JSON array (see _uploaded_rows). ``?dry_run=1`` validates without saving.
+    """
+    rows, error = _uploaded_rows(request)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+
+    result = import_employees(rows, request.user.company, dry_run=request.GET.get('dry_run') == '1')
+    response = {
+        'created': result.created,
+        'error_count': result.error_count,
+        'errors': [
+            {'row': row_number, 'errors': errors}
+            for row_number, errors in result.errors[:MAX_REPORTED_IMPORT_ERRORS]
+        ],
+    }
+    if result.read_error:
+        # The rows before the unreadable one have been imported
+        response['error'] = f"Could not read the import: {result.read_error}"
+        return JsonResponse(response, status=400)
+    return JsonResponse(response)
+
+
 def custom_login_view(request):
     if request.method == 'POST':
         form = CompanyLoginForm(request, data=request.POST)
@@ -134,190 +208,175 @@ def register(request):
     return render(request, 'payroll/register.html', {'form': form})
 
 
-def get_month_bounds(dt):
-    start = dt.replace(day=1)
-    if dt.month == 12:
-        end = dt.replace(day=31)
-    else:
-        next_month = dt.replace(day=28) + timedelta(days=4)
-        end = next_month.replace(day=1) - timedelta(days=1)
-    return start, end
-
 def payslips_summary(request):
     query = request.GET.get('q', '')
 
-    # Step 1: Get active employees
-    active_employees = Employee.objects.filter(status="active")
-
-    # Apply search
-    if query:
-        active_employees = active_employees.filter(
-            Q(first_name__icontains=query) |
-            Q(last_name__icontains=query) |
-            Q(id_number__icontains=query)
-        )
-
-    # Step 2: Define payroll period (start of current month to end of current month)
+    # Payroll period: start of current month to end of current month
     today = timezone.now().date()
     period_start, period_end = get_month_bounds(today)
+    payroll_run = PayrollRun.objects.select_related('totals').filter(
+        period_start=period_start, period_end=period_end
+    ).first()
 
-    # Step 3: Get or create the PayrollRun for this month
-    payroll_run, created = PayrollRun.objects.get_or_create(
-        period_start=period_start,
-        period_end=period_end
-    )
+    # Payslips are calculated by the payroll run engine; this view only reads them.
+    # Every payslip in the run is listed, including those of employees who have
+    # since left, so the rows add up to the stored totals.
+    payslips = Payslip.objects.filter(payroll_run=payroll_run).select_related('employee', 'worked_hours')
 
-    # Step 4: Create missing Payslip objects for each active employee
-    UIF_CEILING = Decimal('17712.00')
-    UIF_RATE = Decimal('0.01')
-    SDL_RATE = Decimal('0.01')
-    CURRENT_TAX_YEAR = "2024/2025"
-
-    for employee in active_employees:
-        # Calculate all values first
-        worked_hours = None
-        if employee.is_wage_employee:
-                worked_hours, wh_created = WorkedHours.objects.get_or_create(
-                    employee=employee, 
-                    payroll_run=payroll_run,
-                    defaults={
-                        'normal_hours': 0,
-                        'overtime_hours': 0,
-                        'saturday_hours': 0,
-                        'sunday_public_hours': 0,
-                    }
-                )
-                gross_income = worked_hours.calculate_gross_pay()
-        else:
-            gross_income = employee.salary or Decimal('0.00')
-        
-        # Calculate YTD gross income (excluding this month)
-        start_of_tax_year = datetime.date(today.year, 3, 1)  # SA tax year: March to Feb
-        ytd_income = Payslip.objects.filter(
-            employee=employee,
-            payroll_run__period_start__gte=start_of_tax_year,
-            payroll_run__period_start__lt=period_start
-        ).aggregate(total=Sum('basic_salary'))['total'] or Decimal('0.00')
-        
-        months_paid = Payslip.objects.filter(
-            employee=employee,
-            payroll_run__period_start__gte=start_of_tax_year,
-            payroll_run__period_start__lt=period_start
-        ).count() + 1  # Include this month
-        
-        # Avoid division by zero
-        if months_paid == 0:
-            annualized_income = gross_income * 12
-        else:
-            annualized_income = (ytd_income + gross_income) / months_paid * 12
-
-        # Determine the rebate based on age
-        age = employee.age or 0
-        rebate = Decimal('17235.00')  # Base rebate
-        if age >= 65:
-            rebate += Decimal('9444.00')
-        if age >= 75:
-            rebate += Decimal('3145.00')
-
-        # Calculate tax based on annualized income minus applicable rebate
-        annual_tax = calculate_tax(annualized_income, CURRENT_TAX_YEAR, rebate)
-        tax = annual_tax / 12
-        
-        # UIF
-        uif_income = min(gross_income, UIF_CEILING)
-        uif = uif_income * UIF_RATE
-        
-        # SDL
-        sdl = gross_income * SDL_RATE
-        
-        # Net pay
-        net_pay = gross_income - tax - uif - sdl
-
-        # Now use get_or_create with all the values in defaults
-        payslip, created = Payslip.objects.get_or_create(
-            employee=employee,
-            payroll_run=payroll_run,
-            defaults={
-                'gross_income': gross_income,
-                'tax': tax,
-                'uif': uif,
-                'sdl': sdl,
-                'net_pay': net_pay,
-            }
+    # Stored run totals, refreshed whenever the run is calculated; a search
+    # totals only the matching payslips, in one aggregate query
+    totals = getattr(payroll_run, 'totals', None) or RunTotals()
+    if query:
+        payslips = payslips.filter(
+            employee_id__in=matching_employee_ids(query, getattr(request.user, 'company_id', None))
         )
-        
-        # If the payslip already existed, update its values
-        if not created:
-            payslip.basic_salary = gross_income
-            payslip.tax = tax
-            payslip.uif = uif
-            payslip.sdl = sdl
-            payslip.net_pay = net_pay
-            payslip.save()
-
-        # Get worked hours for the employee and payroll run
-        worked_hours = WorkedHours.objects.filter(
-            employee=employee, payroll_run=payroll_run
-        ).first()
-        
-        # Store worked hours in a dictionary tied to payslip ID for easy access in template
-        payslip.worked_hours = worked_hours
-
-    # Step 5: Retrieve all payslips for the current payroll run
-    payslips = Payslip.objects.filter(payroll_run=payroll_run, employee__in=active_employees)
-
-    # Attach WorkedHours to each payslip
-    for payslip in payslips:
-        payslip.worked_hours = WorkedHours.objects.filter(
-            employee=payslip.employee,
-            payroll_run=payslip.payroll_run
-        ).first()
-
-    # Step 6: Calculate totals
-    totals = {
-        'basic_salary_total': sum(p.basic_salary or 0 for p in payslips if p.basic_salary is not None),
-        'gross_income': sum(p.gross_income or 0 for p in payslips),
-        'tax': sum(p.tax for p in payslips),
-        'uif': sum(p.uif for p in payslips),
-        'net_pay': sum(p.net_pay for p in payslips),
-        # WorkedHours breakdown 
-        'normal_hours_total': sum(p.worked_hours.normal_earnings or 0 for p in payslips if p.worked_hours),
-        'overtime_hours_total': sum(p.worked_hours.overtime_earnings or 0 for p in payslips if p.worked_hours),
-        'saturday_hours_total': sum(p.worked_hours.saturday_earnings or 0 for p in payslips if p.worked_hours),
-        'sunday_hours_total': sum(p.worked_hours.sunday_earnings or 0 for p in payslips if p.worked_hours),
-
-        # Extra columns
-        'income_total': sum(
-            (p.basic_salary or 0)
-            + (p.worked_hours.normal_earnings or 0 if p.worked_hours else 0)
-            + (p.worked_hours.overtime_earnings or 0 if p.worked_hours else 0)
-            + (p.worked_hours.saturday_earnings or 0 if p.worked_hours else 0)
-            + (p.worked_hours.sunday_earnings or 0 if p.worked_hours else 0)
-            for p in payslips
-        ),
-        'deductions_total': sum(p.tax + p.uif for p in payslips),
-    }
+        totals = RunTotals(**payslip_totals(payslips))
 
-    paginator = Paginator(payslips, 10)
-    page_number = request.GET.get("page")
-    payslips = paginator.get_page(page_number)
+    payslips = paginate(request, payslips, 10, PAYSLIP_ORDERING)
 
     return render(request, 'payslips/payslips_summary.html', {
         'payslips': payslips,
         'totals': totals,
         'payroll_run': payroll_run,
+        'payroll_job': payroll_run.jobs.first() if payroll_run else None,
+        'dirty_count': payroll_run.dirty_payslips.count() if payroll_run else 0,
+        'period_start': period_start,
         'query': query,
-        'worked_hours': worked_hours
     })
 
 
+@require_POST
+def run_payroll_view(request):
+    payroll_run = get_payroll_run_for(timezone.now().date())
+    if payroll_run.is_closed:
+        messages.error(request, "This payroll run is closed and cannot be recalculated.")
+        return redirect('payslips_summary')
+    enqueue_payroll_job(payroll_run)
+    messages.success(request, "Payroll run queued. Payslips will appear here once it has been calculated.")
+    return redirect('payslips_summary')
+
+
+@login_required
+@require_POST
+def upload_timesheets(request, pk):
+    """
+    Saves worked hours for a payroll run from an uploaded file or a JSON
+    array (see _uploaded_rows), then recalculates the affected payslips.
+    Responds with JSON, or redirects to a local ``next`` URL with a message
+    when posted from a page.
+    """
+    payroll_run = get_object_or_404(PayrollRun, pk=pk)
+    next_url = request.POST.get('next')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        next_url = None
+
+    rows, error = _uploaded_rows(request)
+    result = None
+    if payroll_run.is_closed:
+        error = f"{payroll_run} is closed."
+    elif not error:
+        result = ingest_timesheets(rows, payroll_run, request.user.company)
+        if result.read_error:
+            # The rows before the unreadable one have been saved and recalculated
+            error = (
+                f"Could not read the timesheet: {result.read_error}. {result.saved} timesheets before it were saved "
+                f"and {result.recalculated} payslips recalculated."
+            )
+
+    if next_url:
+        if error:
+            messages.error(request, error)
+        else:
+            messages.success(request, (
+                f"{result.saved} timesheets saved and {result.recalculated} payslips recalculated."
+                + (f" {result.error_count} rows had errors." if result.error_count else "")
+            ))
+        return redirect(next_url)
+
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    return JsonResponse({
+        'saved': result.saved,
+        'recalculated': result.recalculated,
+        'error_count': result.error_count,
+        'errors': [
+            {'row': row_number, 'errors': errors}
+            for row_number, errors in result.errors[:MAX_REPORTED_IMPORT_ERRORS]
+        ],
+    })
+
+
+@login_required
+def payroll_job_status(request, pk):
+    job = get_object_or_404(PayrollJob, pk=pk)
+    return JsonResponse(job.progress())
+
+
+def _archived_payslip_or_404(pk, company):
+    payslip = archived_payslip(pk)
+    if payslip is None or payslip.employee.company_id != company.pk:
+        raise Http404("No payslip matches the given query.")
+    return payslip
+
+
+@login_required
 def payslip_detail(request, pk):
-    payslip = get_object_or_404(Payslip, pk=pk)
+    payslip = Payslip.objects.select_related('employee', 'payroll_run', 'worked_hours', 'ytd_totals').filter(
+        pk=pk, employee__company=request.user.company
+    ).first() or _archived_payslip_or_404(pk, request.user.company)
     return render(request, 'payslips/payslip_detail.html', {'payslip': payslip})
 
 
+@login_required
+def payslip_pdf(request, pk):
+    payslip = pdf_payslips().filter(pk=pk, employee__company=request.user.company).first() or _archived_payslip_or_404(
+        pk, request.user.company
+    )
+    data = payslip_pdf_data(payslip)
+    response = HttpResponse(render_payslip_pdf(data), content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename="{payslip_pdf_filename(data)}"'
+    return response
+
+
+@login_required
+def payroll_run_pdfs(request, pk):
+    payroll_run = get_object_or_404(PayrollRun, pk=pk)
+    response = StreamingHttpResponse(
+        stream_zip(iter_run_pdfs(payroll_run, request.user.company)), content_type='application/zip'
+    )
+    response['Content-Disposition'] = f'attachment; filename="payslips_{payroll_run.period_start:%Y-%m}.zip"'
+    return response
+
+
+def _export_response(fmt, headers, rows, filename):
+    if fmt not in EXPORT_FORMATS:
+        raise Http404(f"Unknown export format: {fmt}")
+    stream, content_type = EXPORT_FORMATS[fmt]
+    response = StreamingHttpResponse(stream(headers, rows), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+@login_required
+def payroll_run_export(request, pk, fmt):
+    payroll_run = get_object_or_404(PayrollRun, pk=pk)
+    headers, rows = payslip_export(payroll_run, request.user.company)
+    return _export_response(fmt, headers, rows, f"payroll_{payroll_run.period_start:%Y-%m}")
+
+
+@login_required
+def employee_register_export(request, fmt):
+    headers, rows = employee_export(request.user.company, request.GET.get('status'))
+    return _export_response(fmt, headers, rows, "employees")
+
+
+@login_required
 def update_payslip(request, payslip_id):
-    payslip = get_object_or_404(Payslip, id=payslip_id)
+    payslip = get_object_or_404(Payslip, id=payslip_id, employee__company=request.user.company)
+    # A closed run's exports and PDFs come from its snapshot, which edits would no longer match
+    if payslip.payroll_run.is_closed:
+        messages.error(request, "This payroll run is closed and its payslips cannot be edited.")
+        return redirect('payslips_summary')
     
     # Try to get WorkedHours if it exists
     worked_hours = WorkedHours.objects.filter(
@@ -331,6 +390,8 @@ def update_payslip(request, payslip_id):
         if payslip_form.is_valid() and hours_form.is_valid():
             payslip_form.save()
             hours_form.save()
+            # Only this employee: other pending changes in the run are left for their own recalculation
+            recalculate_dirty_payslips(payslip.payroll_run, employee_ids=[payslip.employee_id])
             return redirect('payslips_summary')
         
     else:
@@ -349,72 +410,18 @@ def leave_summary(request):
     employees = Employee.objects.filter(status="active")
 
     if query:
-        employees = employees.filter(
-            Q(first_name__icontains=query) |
-            Q(last_name__icontains=query) |
-            Q(id_number__icontains=query)
-        )
-    
-    employees = employees.order_by('last_name', 'first_name')
+        employees = employees.filter(id__in=matching_employee_ids(query, request.user.company_id))
     
-    # Auto-create missing leave balances
-    for employee in employees:
-        existing_balances = LeaveBalance.objects.filter(employee=employee)
-        existing_leave_types = [balance.leave_type for balance in existing_balances]
-        
-        if not existing_balances.exists():
-            # If employee has no leave balances yet, initialize all of them
-            LeaveBalance.initialize_leave_for_employee(employee)
-        else:
-            # Check if any leave types are missing and create them
-            for leave_type in LeaveType:
-                if leave_type not in existing_leave_types:
-                    leave_allocations = {
-                        LeaveType.ANNUAL: Decimal('17.00'),
-                        LeaveType.SICK: Decimal('30.00'), 
-                        LeaveType.FAMILY: Decimal('3.00'),
-                        LeaveType.MATERNITY: Decimal('120.00'),
-                        LeaveType.PARENTAL: Decimal('10.00'),
-                        LeaveType.STUDY: Decimal('5.00'),
-                    }
-                    
-                    LeaveBalance.objects.create(
-                        employee=employee,
-                        leave_type=leave_type,
-                        total_days=leave_allocations.get(leave_type, Decimal('0.00')),
-                        used_days=Decimal('0.00'),
-                        cycle_start=employee.date_joined,  # Use employee's join date
-                    )
-
-    # Calculate and attach leave balances to each employee
+    # Balances are created with the employee; the prefetch only reads this page's
+    employees = paginate(request, employees.prefetch_related('leavebalance_set'), 10, EMPLOYEE_ORDERING)
+
     for employee in employees:
-        balances = LeaveBalance.objects.filter(employee=employee)
-        
         # Simple dictionary matching template structure
-        leave_data = {
-            'Annual': Decimal('0.00'),
-            'Sick': Decimal('0.00'),
-            'Family': Decimal('0.00'),
-            'Maternity': Decimal('0.00'),
-            'Parental': Decimal('0.00'),
-            'Study': Decimal('0.00'),
-        }
-
-        for balance in balances:
-            leave_key = balance.leave_type
-            
-            if leave_key == LeaveType.ANNUAL:
-                accrued = balance.calculate_annual_leave_accrued()
-                leave_data[leave_key] = max(Decimal('0.00'), accrued - balance.used_days)
-            else:
-                leave_data[leave_key] = max(Decimal('0.00'), balance.total_days - balance.used_days)
-
+        leave_data = {leave_type: Decimal('0.00') for leave_type in LeaveType.values}
+        for balance in employee.leavebalance_set.all():
+            leave_data[balance.leave_type] = balance.remaining_days
         employee.leave_balances = leave_data
 
-    paginator = Paginator(employees, 10)
-    page = request.GET.get('page')
-    employees = paginator.get_page(page)
-
     current_date = timezone.now()
     payroll_run = type('PayrollRun', (), {
         'period_end': current_date
@@ -441,4 +448,120 @@ def edit_leave_balances(request, pk):
             messages.success(request, "Leave balance updated successfully.")
         else:
             messages.error(request, "There was an error updating the leave balance.")
-    return render(request, 'leave/edit_leave_balance.html', {'employee': employee})
\ No newline at end of file
+    return render(request, 'leave/edit_leave_balance.html', {'employee': employee})
+
+
+def _api_fields(request, spec, optional=()):
+    fields = api.selected_fields(request, spec, optional)
+    if 'ytd' in optional and request.GET.get('ytd') == '1' and 'ytd' not in fields:
+        fields.append('ytd')
+    return fields
+
+
+def _api_page(request, queryset, fields, spec, ordering):
+    """A JSON page of ``queryset`` by cursor, ``?limit=`` rows at a time."""
+    try:
+        limit = min(max(int(request.GET.get('limit', api.API_PAGE_SIZE)), 1), api.API_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = api.API_PAGE_SIZE
+    page = CursorPaginator(queryset, limit, ordering).get_page(request.GET.get('cursor'))
+    return {
+        'results': [api.serialize(row, fields, spec) for row in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+def _api_response(data):
+    response = JsonResponse(data)
+    # Even closed runs show live employee rows, so cached copies must be revalidated against the ETag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _api_bad_request(error):
+    return JsonResponse({'error': str(error)}, status=400)
+
+
+@login_required
+@require_GET
+@condition(etag_func=api.runs_etag)
+def api_runs(request):
+    try:
+        fields = _api_fields(request, api.RUN_FIELDS)
+    except ValueError as e:
+        return _api_bad_request(e)
+    runs = api.project(PayrollRun.objects.all(), fields, api.RUN_FIELDS)
+    return _api_response(_api_page(request, runs, fields, api.RUN_FIELDS, ('period_start', 'id')))
+
+
+@login_required
+@require_GET
+@condition(etag_func=api.run_etag)
+def api_run(request, pk):
+    try:
+        fields = _api_fields(request, api.RUN_FIELDS)
+    except ValueError as e:
+        return _api_bad_request(e)
+    run = get_object_or_404(api.project(PayrollRun.objects.all(), fields, api.RUN_FIELDS), pk=pk)
+    return _api_response(api.serialize(run, fields, api.RUN_FIELDS))
+
+
+@login_required
+@require_GET
+@condition(etag_func=api.run_payslips_etag)
+def api_run_payslips(request, pk):
+    """Payslips of the user's company in a run, with ``?ytd=1`` for year-to-date totals."""
+    payroll_run = get_object_or_404(PayrollRun.objects.only('id'), pk=pk)
+    try:
+        fields = _api_fields(request, api.PAYSLIP_FIELDS, api.OPTIONAL_PAYSLIP_FIELDS)
+    except ValueError as e:
+        return _api_bad_request(e)
+    payslips = Payslip.objects.filter(payroll_run=payroll_run, employee__company_id=request.user.company_id)
+    if 'ytd' in fields:
+        payslips = payslips.with_ytd()
+    payslips = api.project(payslips, fields, api.PAYSLIP_FIELDS)
+    return _api_response(_api_page(request, payslips, fields, api.PAYSLIP_FIELDS, ('id',)))
+
+
+@login_required
+@require_GET
+@condition(etag_func=api.payslip_etag)
+def api_payslip(request, pk):
+    try:
+        fields = _api_fields(request, api.PAYSLIP_FIELDS, api.OPTIONAL_PAYSLIP_FIELDS)
+    except ValueError as e:
+        return _api_bad_request(e)
+    payslips = Payslip.objects.filter(employee__company_id=request.user.company_id)
+    if 'ytd' in fields:
+        payslips = payslips.with_ytd()
+    payslip = get_object_or_404(api.project(payslips, fields, api.PAYSLIP_FIELDS), pk=pk)
+    return _api_response(api.serialize(payslip, fields, api.PAYSLIP_FIELDS))
+
+
+@login_required
+@require_GET
+@condition(etag_func=api.employees_etag)
+def api_employees(request):
+    try:
+        fields = _api_fields(request, api.EMPLOYEE_FIELDS)
+    except ValueError as e:
+        return _api_bad_request(e)
+    employees = api.project(
+        Employee.objects.filter(company_id=request.user.company_id), fields, api.EMPLOYEE_FIELDS
+    )
+    return _api_response(_api_page(request, employees, fields, api.EMPLOYEE_FIELDS, EMPLOYEE_ORDERING))
+
+
+@login_required
+@require_GET
+@condition(etag_func=api.employee_etag)
+def api_employee(request, pk):
+    try:
+        fields = _api_fields(request, api.EMPLOYEE_FIELDS)
+    except ValueError as e:
+        return _api_bad_request(e)
+    employees = api.project(
+        Employee.objects.filter(company_id=request.user.company_id), fields, api.EMPLOYEE_FIELDS
+    )
+    return _api_response(api.serialize(get_object_or_404(employees, pk=pk), fields, api.EMPLOYEE_FIELDS))
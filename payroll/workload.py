@@ -0,0 +1,264 @@
+"""
+Synthetic payroll data for benchmarks and load tests.
+
+Generates companies with a mix of salaried and wage employees, several
+months of payroll runs with worked hours, and leave requests. Employees go
+through the bulk import and payslips through the payroll engine, so the
+data has the same shape (leave balances, search index, YTD ledger, run
+summaries, snapshots of closed runs) as real data. The same seed always
+gives the same data.
+"""
+import datetime
+import random
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .imports import import_employees
+from .models import Company, Employee, LeaveBalance, LeaveRequest, LeaveType, PayrollRun, WorkedHours
+from .services import get_month_bounds, get_payroll_run_for, run_payroll
+
+# Employees calculated, and rows written, per statement or run_payroll call
+WORKLOAD_BATCH_SIZE = 5000
+
+FIRST_NAMES = [
+    'Thabo', 'Lerato', 'Sipho', 'Naledi', 'Johan', 'Anika', 'Pieter', 'Zanele', 'Kagiso', 'Ayanda', 'Themba',
+    'Nomvula', 'Ruan', 'Chantel', 'Mandla', 'Palesa', 'Bongani', 'Refilwe', 'Hendrik', 'Michelle', 'Sibusiso',
+    'Karabo', 'Lindiwe', 'Tshepo', 'Priya', 'Ravi', 'Fatima', 'Yusuf', 'Elna', 'Dumisani',
+]
+LAST_NAMES = [
+    'Nkosi', 'Dlamini', 'Botha', 'van der Merwe', 'Mokoena', 'Naidoo', 'Pillay', 'Khumalo', 'Pretorius', 'Mahlangu',
+    'Ndlovu', 'Steyn', 'Molefe', 'Venter', 'Zulu', 'Jacobs', 'Govender', 'Sithole', 'du Plessis', 'Mthembu',
+    'Coetzee', 'Maseko', 'Adams', 'Fourie', 'Ngcobo', 'Smith', 'Kruger', 'Mabaso', 'Hendricks', 'Baloyi',
+]
+JOB_TITLES = {
+    'Operations': ['Machine Operator', 'Shift Supervisor', 'Packer', 'Driver'],
+    'Debtors': ['Debtors Clerk', 'Credit Controller'],
+    'Creditors': ['Creditors Clerk', 'Accounts Payable Officer'],
+    'Finance': ['Accountant', 'Finance Officer', 'Payroll Administrator'],
+    'Marketing': ['Marketing Coordinator', 'Sales Representative'],
+    'Maintenance': ['Artisan', 'General Worker', 'Electrician'],
+    'Admin': ['Receptionist', 'Office Administrator', 'HR Officer'],
+}
+# Departments whose staff are mostly paid by the hour
+WAGE_DEPARTMENTS = ['Operations', 'Maintenance']
+
+# Employment statuses other than active, with their share of employees
+INACTIVE_STATUSES = [('on_leave', 0.02), ('suspended', 0.005), ('terminated', 0.02), ('resigned', 0.01)]
+
+
+@dataclass
+class WorkloadResult:
+    companies: int = 0
+    employees: int = 0
+    runs: int = 0
+    payslips: int = 0
+    worked_hours: int = 0
+    leave_requests: int = 0
+
+
+def _luhn_digit(digits):
+    total = 0
+    for index, digit in enumerate(int(d) for d in reversed(digits)):
+        if index % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return str((10 - total % 10) % 10)
+
+
+def _id_number(rng, today):
+    """A South African ID number (birth date, sequence, citizenship, Luhn check) for someone aged 19 to 64."""
+    birth = today - datetime.timedelta(days=rng.randint(19 * 365, 64 * 365))
+    digits = f"{birth:%y%m%d}{rng.randint(0, 9999):04d}08"
+    return digits + _luhn_digit(digits)
+
+
+def _tax_number(rng):
+    return str(rng.choice([0, 1, 2, 3, 9])) + ''.join(str(rng.randint(0, 9)) for _ in range(9))
+
+
+def _status(rng):
+    roll = rng.random()
+    for status, share in INACTIVE_STATUSES:
+        if roll < share:
+            return status
+        roll -= share
+    return 'active'
+
+
+def employee_rows(rng, count, wage_ratio, first_run_start, today):
+    """Yields ``count`` employee dicts for import_employees, with unique ID numbers."""
+    seen = set()
+    for _ in range(count):
+        id_number = _id_number(rng, today)
+        while id_number in seen:
+            id_number = _id_number(rng, today)
+        seen.add(id_number)
+
+        is_wage = rng.random() < wage_ratio
+        department = rng.choice(WAGE_DEPARTMENTS if is_wage and rng.random() < 0.8 else list(JOB_TITLES))
+        joined = first_run_start - datetime.timedelta(days=rng.randint(0, 10 * 365))
+        row = {
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+            'id_number': id_number,
+            'tax_number': _tax_number(rng),
+            'date_joined': joined.isoformat(),
+            'department': department,
+            'job_title': rng.choice(JOB_TITLES[department]),
+            'status': _status(rng),
+            'is_wage_employee': is_wage,
+        }
+        if is_wage:
+            row['hourly_rate'] = str(Decimal(rng.randint(3000, 25000)) / 100)
+        else:
+            # Skewed towards lower salaries, as real payrolls are
+            salary = min(int(8000 + rng.paretovariate(1.6) * 6000), 250000)
+            row['salary'] = str(salary // 100 * 100)
+        yield row
+
+
+def _new_company_codes(count):
+    existing = set(Company.objects.filter(code__startswith='WL').values_list('code', flat=True))
+    codes, number = [], 1
+    while len(codes) < count:
+        code = f"WL{number:05d}"
+        if code not in existing:
+            codes.append(code)
+        number += 1
+    return codes
+
+
+def _worked_hours(rng, employee_id, hourly_rate, payroll_run):
+    hours = WorkedHours(
+        employee_id=employee_id,
+        payroll_run=payroll_run,
+        normal_hours=Decimal(rng.choice([160, 168, 176, 180, 184, 195])),
+        overtime_hours=Decimal(rng.choice([0, 0, 0, 4, 8, 12, 16])),
+        saturday_hours=Decimal(rng.choice([0, 0, 4, 8])),
+        sunday_public_hours=Decimal(rng.choice([0, 0, 0, 8])),
+    )
+    hours.calculate_earnings(hourly_rate or 0)
+    return hours
+
+
+def _chunks(items, size=WORKLOAD_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _leave_requests(rng, employees, today, result):
+    """Creates past leave requests for about a third of ``employees``; approved days are taken off their balances."""
+    requests = []
+    for employee_id in employees:
+        if rng.random() > 0.35:
+            continue
+        leave_type = rng.choices([LeaveType.ANNUAL, LeaveType.SICK, LeaveType.FAMILY], weights=[6, 3, 1])[0]
+        days = rng.randint(1, 5 if leave_type != LeaveType.ANNUAL else 10)
+        start = today - datetime.timedelta(days=rng.randint(days, 180))
+        requests.append(LeaveRequest(
+            employee_id=employee_id,
+            leave_type=leave_type,
+            start_date=start,
+            end_date=start + datetime.timedelta(days=days - 1),
+            days_requested=Decimal(days),
+            reason="Generated",
+            status=rng.choices(['approved', 'pending', 'rejected'], weights=[7, 2, 1])[0],
+        ))
+    LeaveRequest.objects.bulk_create(requests, batch_size=1000)
+    result.leave_requests += len(requests)
+
+    approved = LeaveRequest.objects.filter(
+        employee=OuterRef('employee'), leave_type=OuterRef('leave_type'), status='approved'
+    ).order_by().values('employee').annotate(days=Sum('days_requested')).values('days')
+    LeaveBalance.objects.filter(employee_id__in=employees).update(
+        used_days=F('used_days') + Coalesce(Subquery(approved), Decimal('0.00'))
+    )
+
+
+def generate_workload(
+    companies=1, employees=1000, wage_ratio=0.3, months=3, seed=0, leave=True, workers=None, today=None, log=None
+):
+    """
+    Adds ``companies`` new companies sharing ``employees`` employees, with
+    payroll runs for the last ``months`` months (all but the latest closed)
+    and, with ``leave``, leave requests. Existing closed runs are skipped.
+    Runs are shared by every company, so closing one would post accruals for
+    real employees: ValueError is raised, before anything is written, if a
+    run that would be closed already exists and is open. Payslips are
+    calculated across ``workers`` processes (see run_payroll).
+    ``log(message)`` reports progress. Returns a WorkloadResult.
+    """
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    log = log or (lambda message: None)
+    result = WorkloadResult()
+
+    period_starts = [get_month_bounds(today)[0]]
+    for _ in range(months - 1):
+        period_starts.insert(0, get_month_bounds(period_starts[0] - datetime.timedelta(days=1))[0])
+    first_run_start = period_starts[0]
+
+    open_runs = PayrollRun.objects.filter(period_start__in=period_starts[:-1], is_closed=False)
+    if open_runs.exists():
+        raise ValueError(
+            f"These open payroll runs would be closed: {', '.join(str(run) for run in open_runs.order_by('period_start'))}. "
+            f"Generate fewer months or close them first"
+        )
+
+    generated = []
+    for index, code in enumerate(_new_company_codes(companies)):
+        company = Company.objects.create(code=code, name=f"Workload Company {code[2:]}")
+        generated.append(company)
+        count = employees // companies + (1 if index < employees % companies else 0)
+        imported = import_employees(employee_rows(rng, count, wage_ratio, first_run_start, today), company)
+        if imported.errors:
+            raise ValueError(f"Generated employees failed to import: {imported.errors[:3]}")
+        result.companies += 1
+        result.employees += imported.created
+        log(f"{company}: {imported.created} employees")
+
+    active = list(
+        Employee.objects.filter(company__in=generated, status='active').order_by('id').values_list(
+            'id', 'is_wage_employee', 'hourly_rate'
+        )
+    )
+    wage_employees = [(employee_id, rate) for employee_id, is_wage, rate in active if is_wage]
+    employee_ids = [employee_id for employee_id, _, _ in active]
+
+    runs = []
+    for period_start in period_starts:
+        payroll_run = get_payroll_run_for(period_start)
+        if payroll_run.is_closed:
+            log(f"Skipping {payroll_run}: it is closed")
+        else:
+            for chunk in _chunks(wage_employees):
+                hours = [_worked_hours(rng, employee_id, rate, payroll_run) for employee_id, rate in chunk]
+                WorkedHours.objects.bulk_create(hours, batch_size=1000)
+                result.worked_hours += len(hours)
+            for chunk in _chunks(employee_ids):
+                created, updated = run_payroll(payroll_run, employee_ids=chunk, workers=workers)
+                result.payslips += created + updated
+            runs.append(payroll_run)
+            result.runs += 1
+            log(f"{payroll_run}: {len(employee_ids)} payslips")
+
+    # Closing posts leave accruals, freezes totals and writes snapshots (see payroll.signals).
+    # Only runs created above are closed: any earlier run that existed was closed already.
+    for payroll_run in runs:
+        if payroll_run.period_start == period_starts[-1]:
+            continue
+        with transaction.atomic():
+            payroll_run.is_closed = True
+            payroll_run.save()
+
+    if leave:
+        for chunk in _chunks(employee_ids):
+            _leave_requests(rng, chunk, today, result)
+        log(f"{result.leave_requests} leave requests")
+    return result
@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'payroll.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,6 +76,16 @@ DATABASES = {
     }
 }
 
+# Shared by every process on this host (web workers, payroll_worker and
+# management commands), so their cache invalidations reach each other. Use
+# Redis or Memcached when web processes run on more than one host.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -124,3 +135,25 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_WEEKLY_HOURS = 45
+
+# Number of processes used to calculate payslips in a payroll run (1 = serial)
+PAYROLL_WORKERS = 1
+
+# Seconds a payroll worker can go without reporting progress before its
+# running job is assumed lost and queued again. Must be longer than the
+# largest run takes to save its payslips, which is one transaction.
+PAYROLL_JOB_LEASE = 600
+
+# Most SQL queries a request to a view (by URL name) should run, session and
+# user lookups included; requests over budget are logged as warnings
+PAYROLL_QUERY_BUDGETS = {
+    'dashboard': 8,
+    'employee_list': 8,
+    'payslips_summary': 10,
+    'payslip_detail': 6,
+    'leave_summary': 8,
+    # Saving an edit recalculates the employee's payslip and the run's totals
+    'update_payslip': 60,
+}
+# Budget of every other view (None: no budget)
+PAYROLL_QUERY_BUDGET = 30